@@ -0,0 +1,165 @@
+from collections import Counter, namedtuple
+from sqlalchemy import select, update
+from models import db, User, Doctor, Patient, Department
+import directory
+import identity
+import jobs
+import slot_index
+
+# Batch admin actions over many doctors or patients at once.
+#
+# The admin dashboard posts the ticked ids with one action; a script can
+# post a JSON list of a thousand. Each action classifies every id with one
+# SELECT per chunk of jobs.CHUNK ids, applies the change to the eligible
+# ones with one UPDATE per chunk, and commits once, so the whole batch
+# succeeds or nothing changes. Every id gets an outcome ('blacklisted',
+# 'not found', ...) for the caller to report.
+#
+# Deleting locks the accounts in the request, like the single delete, and
+# leaves the cascade to one background job for the whole batch
+# (jobs.delete_doctors / delete_patients).
+
+MAX_IDS = 5000
+
+Result = namedtuple('Result', 'outcomes job')  # outcomes: {id: outcome}, in request order
+
+
+class BatchError(Exception):
+    """The batch was refused as a whole; `message` is safe to show."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def parse_ids(values):
+    """Distinct ids from form or JSON values, in the order given."""
+    if not isinstance(values, list):
+        raise BatchError("Ids must be a list.")
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise BatchError("Ids must be whole numbers.")
+    if not ids:
+        raise BatchError("Nothing selected.")
+    if len(ids) > MAX_IDS:
+        raise BatchError(f"At most {MAX_IDS} ids per batch.")
+    return ids
+
+
+def counts(result):
+    return Counter(result.outcomes.values())
+
+
+def _roles(model, ids):
+    """{id: user_role} of the ids that are a `model` (doctor or patient)."""
+    roles = {}
+    for chunk in jobs.chunks(ids):
+        roles.update(db.session.execute(
+            select(User.id, User.user_role).join(model, model.id == User.id).where(User.id.in_(chunk))
+        ).tuples().all())
+    return roles
+
+
+def _set_role(ids, role):
+    for chunk in jobs.chunks(ids):
+        db.session.execute(
+            update(User).where(User.id.in_(chunk)).values(user_role=role)
+            .execution_options(synchronize_session=False)
+        )
+
+
+# ------------------ Actions ------------------
+def _blacklist(model, ids):
+    roles = _roles(model, ids)
+    outcomes = {}
+    for user_id in ids:
+        role = roles.get(user_id)
+        outcomes[user_id] = ('not found' if role is None else
+                             'already blacklisted' if role == 'blacklisted' else 'blacklisted')
+    _set_role([user_id for user_id, outcome in outcomes.items() if outcome == 'blacklisted'], 'blacklisted')
+    db.session.commit()
+    for user_id, outcome in outcomes.items():
+        if outcome == 'blacklisted':
+            identity.invalidate(user_id)
+    return Result(outcomes, None)
+
+
+def _delete(model, ids, kind, payload_key):
+    roles = _roles(model, ids)
+    found = [user_id for user_id in ids if user_id in roles]
+    job = None
+    if found:
+        # Lock the accounts now; the cascade runs in the background
+        _set_role(found, 'blacklisted')
+        job = jobs.enqueue(kind, **{payload_key: found})
+    db.session.commit()
+    for user_id in found:
+        identity.invalidate(user_id)
+    return Result({user_id: 'scheduled' if user_id in roles else 'not found' for user_id in ids}, job)
+
+
+def blacklist_doctors(ids):
+    result = _blacklist(Doctor, ids)
+    directory.invalidate()
+    slot_index.invalidate()
+    return result
+
+
+def blacklist_patients(ids):
+    return _blacklist(Patient, ids)
+
+
+def delete_doctors(ids):
+    result = _delete(Doctor, ids, 'delete_doctors', 'doctor_ids')
+    directory.invalidate()
+    slot_index.invalidate()
+    return result
+
+
+def delete_patients(ids):
+    return _delete(Patient, ids, 'delete_patients', 'patient_ids')
+
+
+def reassign_department(ids, department_id):
+    """Move doctors to another department (the edit_doctor change, in bulk)."""
+    try:
+        department_id = int(department_id)
+    except (TypeError, ValueError):
+        department_id = None
+    if department_id is None or not db.session.get(Department, department_id):
+        raise BatchError("Choose an existing department.")
+    current = {}
+    for chunk in jobs.chunks(ids):
+        current.update(db.session.execute(
+            select(Doctor.id, Doctor.department_id).where(Doctor.id.in_(chunk))
+        ).tuples().all())
+    outcomes = {}
+    for doctor_id in ids:
+        outcomes[doctor_id] = ('not found' if doctor_id not in current else
+                               'unchanged' if current[doctor_id] == department_id else 'moved')
+    moved = [doctor_id for doctor_id, outcome in outcomes.items() if outcome == 'moved']
+    for chunk in jobs.chunks(moved):
+        # the search index follows through its trigger on doctors.department_id
+        db.session.execute(
+            update(Doctor).where(Doctor.id.in_(chunk)).values(department_id=department_id)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    directory.invalidate()
+    slot_index.invalidate()
+    for doctor_id in moved:
+        identity.invalidate(doctor_id)
+    return Result(outcomes, None)
+
+
+DOCTOR_ACTIONS = {
+    'blacklist': blacklist_doctors,
+    'delete': delete_doctors,
+    'department': reassign_department,
+}
+
+PATIENT_ACTIONS = {
+    'blacklist': blacklist_patients,
+    'delete': delete_patients,
+}
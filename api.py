@@ -0,0 +1,278 @@
+import hashlib
+from datetime import date, timedelta
+from functools import wraps
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from models import db, User, Doctor, Department, Appointment, DoctorAvailability, Patient
+import archive
+import directory
+import history
+import identity
+import queries
+import routing
+import slots
+
+# Versioned JSON API for mobile and kiosk clients, under /api/v1.
+#
+# Callers use the same session cookie as the web pages (POST /login). Every
+# response carries a weak ETag built from the version of the rows behind it
+# (row count and latest updated_at, see conditional()), so a client that
+# polls with If-None-Match gets an empty 304 for the cost of one aggregate
+# query, without the rows being loaded or serialized. The directory
+# (departments and doctors) changes rarely: its version is cached with the
+# directory itself and clients may reuse it for DIRECTORY_MAX_AGE seconds
+# without asking.
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DIRECTORY_MAX_AGE = 300
+MAX_AVAILABILITY_DAYS = 60
+AVAILABILITY_CACHE = 'public, no-cache'
+
+
+def error(status, message):
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def api_role_required(*roles):
+    """Like identity.role_required, but answers 401/403 instead of
+    redirecting to the login page."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            user = identity.current_identity()
+            if user is None:
+                return error(401, "login required")
+            if user.role not in roles:
+                return error(403, "not allowed")
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def _etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def version_etag(version):
+    user = identity.current_identity()
+    # the same URL returns different rows to different callers
+    return _etag(request.full_path, user.id if user else None, *version)
+
+
+def is_fresh(version):
+    """True if the client already holds the representation of `version`."""
+    return request.if_none_match.contains_weak(version_etag(version))
+
+
+def conditional(version, build, cache_control):
+    """Respond with jsonify(build()), or 304 if the client already holds the
+    representation identified by `version` (then build() is not called)."""
+    etag = version_etag(version)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def version_statement(stmt, model):
+    """(row count, latest updated_at) of the rows a select() returns."""
+    return stmt.with_only_columns(func.count(), func.max(model.updated_at))
+
+
+def _date_arg(name, default=None):
+    value = request.args.get(name)
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        return None
+
+
+# ------------------ Serializers ------------------
+def department_json(d):
+    return {'id': d.id, 'name': d.department_name, 'description': d.description, 'slot_minutes': d.slot_minutes}
+
+
+def doctor_json(d):
+    return {'id': d.id, 'name': d.name, 'department_id': d.department_id,
+            'department': d.department_name, 'experience_years': d.experience_years}
+
+
+def window_json(w):
+    # free intervals as start times; the length is slot_minutes
+    return {'date': w.date.isoformat(), 'start': w.start_time.strftime('%H:%M'),
+            'end': w.end_time.strftime('%H:%M'), 'available': bool(w.is_available),
+            'slot_minutes': slots.window_slot_minutes(w),
+            'free': [i.start.strftime('%H:%M') for i in slots.intervals(w) if i.is_free]}
+
+
+def appointment_json(a):
+    return {'id': a.id, 'date': a.appointment_date.isoformat(), 'time': a.appointment_time.strftime('%H:%M'),
+            'status': a.status, 'doctor_id': a.doctor_id, 'doctor': a.doctor.user.user_name,
+            'department': a.doctor.department.department_name, 'patient_id': a.patient_id,
+            'patient': a.patient.patient_name}
+
+
+def history_json(h):
+    return {'id': h.id, 'appointment_id': h.appointment_id, 'doctor_id': h.doctor_id,
+            'doctor': h.doctor_name, 'department': h.department, 'visit_type': h.visit_type,
+            'test_type': h.test_type, 'diagnosis': h.diagnosis, 'treatment': h.treatment,
+            'prescription': h.prescription, 'created_at': h.created_at.isoformat() if h.created_at else None}
+
+
+def summary_json(s):
+    return {'visits': s.visits, 'visit_counts': s.visit_counts,
+            'last_visit_at': s.last_visit_at.isoformat() if s.last_visit_at else None,
+            'last_diagnosis': s.last_diagnosis, 'last_doctor': s.last_doctor_name,
+            'active_prescriptions': s.active_prescriptions}
+
+
+# ------------------ Directory ------------------
+_DIRECTORY_CACHE = f'public, max-age={DIRECTORY_MAX_AGE}'
+
+
+@bp.route('/departments')
+def departments():
+    return conditional(directory.version(),
+                       lambda: {'departments': [department_json(d) for d in directory.departments()]},
+                       _DIRECTORY_CACHE)
+
+
+@bp.route('/departments/<int:dept_id>/doctors')
+def department_doctors(dept_id):
+    if not directory.department(dept_id):
+        return error(404, "no such department")
+    return conditional(directory.version(),
+                       lambda: {'doctors': [doctor_json(d) for d in directory.department_doctors(dept_id)]},
+                       _DIRECTORY_CACHE)
+
+
+@bp.route('/doctors/<int:doctor_id>')
+def doctor(doctor_id):
+    entry = directory.doctor(doctor_id)
+    if not entry:
+        return error(404, "no such doctor")
+    return conditional(directory.version(), lambda: doctor_json(entry), _DIRECTORY_CACHE)
+
+
+# ------------------ Availability ------------------
+def availability_statement(doctor_id):
+    """?days=N (default 7): the doctor's windows from today."""
+    days = min(max(request.args.get('days', 7, type=int), 1), MAX_AVAILABILITY_DAYS)
+    today = date.today()
+    return select(DoctorAvailability).where(
+        DoctorAvailability.doctor_id == doctor_id,
+        DoctorAvailability.date.between(today, today + timedelta(days=days - 1)),
+    )
+
+
+def availability_version(row):
+    """ETag version from the (count, latest updated_at) row of
+    version_statement(); the date is part of it as the range moves at midnight."""
+    return tuple(row) + (date.today(),)
+
+
+def availability_json(doctor_id, windows):
+    return {'doctor_id': doctor_id, 'windows': [window_json(w) for w in windows]}
+
+
+@bp.route('/doctors/<int:doctor_id>/availability')
+@routing.read_only
+def availability(doctor_id):
+    if not directory.doctor(doctor_id):
+        return error(404, "no such doctor")
+    stmt = availability_statement(doctor_id)
+    return conditional(
+        availability_version(db.session.execute(version_statement(stmt, DoctorAvailability)).one()),
+        lambda: availability_json(doctor_id, db.session.scalars(stmt.order_by(DoctorAvailability.date))),
+        AVAILABILITY_CACHE
+    )
+
+
+# ------------------ Appointments ------------------
+def appointments_version(query):
+    """(row count, latest updated_at) of the appointments, plus the latest
+    updated_at of the doctors, departments and patients whose names they
+    show (a rename changes the body but no appointment row)."""
+    doctor_user = aliased(User)
+    return tuple(
+        query.join(Doctor, Doctor.id == Appointment.doctor_id)
+        .join(doctor_user, doctor_user.id == Doctor.id)
+        .join(Department, Department.id == Doctor.department_id)
+        .join(Patient, Patient.id == Appointment.patient_id)
+        .with_entities(func.count(), func.max(Appointment.updated_at), func.max(Doctor.updated_at),
+                       func.max(doctor_user.updated_at), func.max(Department.updated_at),
+                       func.max(Patient.updated_at))
+        .one()
+    )
+
+
+@bp.route('/appointments')
+@api_role_required('patient', 'doctor', 'admin')
+@routing.read_only
+def appointments():
+    """The caller's appointments (admins pass ?patient_id= or ?doctor_id=),
+    from ?from= (default today) to ?to=, in keyset pages (?cursor=)."""
+    user = identity.current_identity()
+    query = Appointment.query
+    if user.role == 'patient':
+        query = query.filter(Appointment.patient_id == user.id)
+    elif user.role == 'doctor':
+        query = query.filter(Appointment.doctor_id == user.id)
+    else:
+        patient_id = request.args.get('patient_id', type=int)
+        doctor_id = request.args.get('doctor_id', type=int)
+        if not (patient_id or doctor_id):
+            return error(400, "patient_id or doctor_id is required")
+        if patient_id:
+            query = query.filter(Appointment.patient_id == patient_id)
+        if doctor_id:
+            query = query.filter(Appointment.doctor_id == doctor_id)
+
+    first_day = _date_arg('from', date.today())
+    last_day = _date_arg('to')
+    if first_day is None or (request.args.get('to') and last_day is None):
+        return error(400, "dates must be YYYY-MM-DD")
+    query = query.filter(Appointment.appointment_date >= first_day)
+    if last_day:
+        query = query.filter(Appointment.appointment_date <= last_day)
+
+    def build():
+        page = queries.appointment_page(query.options(*queries.appointment_listing_options()),
+                                        request.args.get('cursor'))
+        return {'appointments': [appointment_json(a) for a in page.items], 'next_cursor': page.next_cursor}
+
+    return conditional(appointments_version(query), build, 'private, no-cache')
+
+
+# ------------------ Patient history ------------------
+@bp.route('/patients/<int:patient_id>/history')
+@api_role_required('patient', 'doctor', 'admin')
+@routing.read_only
+def patient_history(patient_id):
+    """The patient's summary and history records, newest first, in keyset
+    pages (?cursor=)."""
+    user = identity.current_identity()
+    # patients may only see their own history
+    if user.role == 'patient' and user.id != patient_id:
+        return error(403, "not allowed")
+    if not db.session.get(Patient, patient_id):
+        return error(404, "no such patient")
+    # hot and archived records, as the timeline reads them
+    records = archive.all_history()
+    version = db.session.execute(
+        select(func.count(), func.max(records.c.updated_at)).where(records.c.patient_id == patient_id)
+    ).one()
+
+    def build():
+        page = history.timeline(patient_id, request.args.get('cursor'))
+        return {'patient_id': patient_id, 'summary': summary_json(history.summary(patient_id)),
+                'history': [history_json(h) for h in page.items], 'next_cursor': page.next_cursor}
+
+    return conditional(tuple(version), build, 'private, no-cache')
@@ -1,17 +1,80 @@
-from flask import Flask, redirect, url_for,render_template,request,session,flash
-from models import db, User, Doctor, Patient, Department, Appointment, DoctorAvailability, PatientHistory
+from flask import Flask, redirect, url_for,render_template,request,session,flash,jsonify,abort,g,Response,stream_with_context
+from models import (db, User, Doctor, Patient, Department, Appointment, DoctorAvailability, PatientHistory, Job,
+                    WeeklySchedule, AvailabilityException)
 from datetime import datetime, date, timedelta
+from sqlalchemy.orm import joinedload
+import calendar
+import os
+import admin_batch
+import api
+import booking
+import cache
+import dbconfig
+import directory
+import events
+import export
+import fragments
+import history
+import identity
+import instrumentation
+import jobs
+import queries
+import routing
+import schedules
+import slot_index
+import slots
+import stats
 
 app = Flask(__name__)
 
-# Database configurations
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
+# Database configurations (URI, pool and SQLite pragmas from the environment, see dbconfig.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = dbconfig.database_uri()
+app.config['SQLALCHEMY_BINDS'] = routing.binds(dbconfig.replica_uri())
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('HMS_REPLICA_STICKY_SECONDS', 5))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 app.secret_key = 'supersecretkey'
 
+# Request profiling (see instrumentation.py); off unless HMS_PROFILING=1
+app.config['PROFILING'] = os.environ.get('HMS_PROFILING') == '1'
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('HMS_SLOW_REQUEST_MS', 500))
+# lets a Prometheus scraper read /metrics without an admin session
+app.config['METRICS_TOKEN'] = os.environ.get('HMS_METRICS_TOKEN')
+
 # Initializing database
-db.init_app(app)
+dbconfig.init_app(app, db)
+routing.init_app(app, db)
+
+# Registered first so the profile covers the other hooks
+instrumentation.init_app(app)
+
+# Resolve the logged-in user once per request (see identity.py)
+app.before_request(identity.load_current_identity)
+role_required = identity.role_required
+# dashboards may read from the replica (see routing.py)
+read_only = routing.read_only
+
+# Rendered fragments reused across requests (see fragments.py)
+fragments.init_app(app)
+
+# Live slot updates on the booking page (see events.py)
+app.config['SSE_HOLD_SECONDS'] = float(os.environ.get('HMS_SSE_HOLD_SECONDS', 0))
+events.init_app(app)
+
+# JSON API for mobile and kiosk clients (see api.py)
+app.register_blueprint(api.bp)
+
+
+@app.template_global()
+def page_url(param, cursor):
+    """URL of the current page with one pagination cursor replaced (or
+    dropped when cursor is None), keeping every other query parameter."""
+    args = request.args.to_dict()
+    if cursor:
+        args[param] = cursor
+    else:
+        args.pop(param, None)
+    return url_for(request.endpoint, **request.view_args, **args)
 
 
 @app.route('/')
@@ -34,6 +97,7 @@ def login():
 
             session['user_id'] = user.id
             session['user_name'] = user.user_name
+            identity.invalidate(user.id)
 
             if user.user_role == 'admin':
                 return redirect(url_for('admin_dashboard'))
@@ -73,7 +137,7 @@ def register():
             user_role='patient'
         )
         db.session.add(new_user)
-        db.session.commit()
+        db.session.flush()  # assigns new_user.id
 
 
         new_patient = Patient(
@@ -82,6 +146,7 @@ def register():
         )
 
         db.session.add(new_patient)
+        stats.patients_registered(new_user.created_at.date())
         db.session.commit()
         
         flash('Registration successful! Please login.')
@@ -92,42 +157,35 @@ def register():
 
 
 @app.route('/admin_dashboard')
+@role_required('admin')
+@read_only
 def admin_dashboard():
     search_query = request.args.get('search', '').strip()
 
-    if search_query:
-        doctors = Doctor.query.join(User).filter(
-            (User.user_name.contains(search_query)) |
-            (Doctor.department_id.in_(
-                [d.id for d in Department.query.filter(Department.department_name.contains(search_query))]
-            ))
-        ).all()
-
-        patients = Patient.query.join(User).filter(
-            User.user_name.contains(search_query)
-        ).all()
-    else:
-        doctors = Doctor.query.all()
-        patients = Patient.query.all()
-
+    # Each listing is paged independently with its own cursor parameter
+    doctors = queries.admin_doctors(search_query, request.args.get('doctors_after'))
+    patients = queries.admin_patients(search_query, request.args.get('patients_after'))
 
     # upcoming appointments
     today = datetime.now().date()
-    appointments = Appointment.query.filter(Appointment.appointment_date >= today).all()
+    appointments = queries.upcoming_appointments(today, request.args.get('upcoming_after'))
 
     # all appointments
-    all_appointments = Appointment.query.all()
+    all_appointments = queries.all_appointments(request.args.get('appointments_after'))
 
     return render_template(
         'AdminUI/admin_dashboard.html',
         doctors=doctors,
+        departments=directory.departments(),
         patients=patients,
         appointments=appointments,
-        all_appointments=all_appointments
+        all_appointments=all_appointments,
+        search_query=search_query
     )
 
 
 @app.route('/admin/add_doctor', methods=['GET', 'POST'])
+@role_required('admin')
 def add_doctor():
     if request.method == 'POST':
         name = request.form.get('name')
@@ -150,14 +208,13 @@ def add_doctor():
             user_role='doctor'
         )
         db.session.add(new_user)
-        db.session.commit()
 
         
         department = Department.query.filter_by(department_name=department_name).first()
         if not department:
             department = Department(department_name=department_name)
             db.session.add(department)
-            db.session.commit()
+        db.session.flush()  # assigns new_user.id and department.id
 
         
         new_doctor = Doctor(
@@ -167,48 +224,43 @@ def add_doctor():
         )
         db.session.add(new_doctor)
         db.session.commit()
+        directory.invalidate()
+        slot_index.invalidate()
 
         flash("Doctor added successfully!")
         return redirect(url_for('admin_dashboard'))
 
     
-    departments = Department.query.all()
+    departments = directory.departments()
     return render_template('AdminUI/add_doctor.html', departments=departments)
 
 
 # Route to delete a doctor
 @app.route('/admin/delete_doctor/<int:doctor_id>', methods=['POST'])
+@role_required('admin')
 def delete_doctor(doctor_id):
-    # (Optional) check admin authorization here
-
     doctor = Doctor.query.get(doctor_id)
     if not doctor:
         flash("Doctor not found!")
         return redirect(url_for('admin_dashboard'))
 
-    # 1) Remove dependent rows first (histories, appointments, availability)
-    PatientHistory.query.filter_by(doctor_id=doctor.id).delete()
-    Appointment.query.filter_by(doctor_id=doctor.id).delete()
-    DoctorAvailability.query.filter_by(doctor_id=doctor.id).delete()
-
-    # 2) Delete doctor row
-    db.session.delete(doctor)
-
-    # 3) Delete associated user row (if User.id == Doctor.id)
-    user = User.query.get(doctor.id)
-    if user:
-        db.session.delete(user)
-
-    # 4) Commit once
+    # Lock the account and hide the doctor from patients now; the cascade
+    # delete of their records runs in the background (see jobs.py)
+    doctor.user.user_role = 'blacklisted'
+    job = jobs.enqueue('delete_doctor', doctor_id=doctor.id)
     db.session.commit()
+    directory.invalidate()
+    slot_index.invalidate()
+    identity.invalidate(doctor_id)
 
-    flash("Doctor and related records deleted successfully!")
+    flash(f"Doctor scheduled for deletion (job #{job.id}).")
     return redirect(url_for('admin_dashboard'))
 
 
 
 # Route to edit a doctor
 @app.route('/admin/edit_doctor/<int:doctor_id>', methods=['GET', 'POST'])
+@role_required('admin')
 def edit_doctor(doctor_id):
     # Find the doctor
     doctor = Doctor.query.get(doctor_id)
@@ -219,6 +271,12 @@ def edit_doctor(doctor_id):
         email = request.form.get('email')
         experience_years = request.form.get('experience_years')
         department_id = request.form.get('department_id')
+        slot_minutes = request.form.get('slot_minutes', type=int) or None
+
+        error = _slot_minutes_error(doctor, slot_minutes, int(department_id))
+        if error:
+            flash(error, "danger")
+            return redirect(url_for('edit_doctor', doctor_id=doctor.id))
         
         # Update user information
         doctor.user.user_name = name
@@ -227,19 +285,45 @@ def edit_doctor(doctor_id):
         # Update doctor information
         doctor.experience_years = int(experience_years)
         doctor.department_id = int(department_id)
+        doctor.slot_minutes = slot_minutes
         
         # Save changes
         db.session.commit()
+        directory.invalidate()
+        slot_index.invalidate()
+        identity.invalidate(doctor.id)
         flash("Doctor updated successfully!")
         return redirect(url_for('admin_dashboard'))
     
     # GET request - show edit form
-    departments = Department.query.all()
-    return render_template('AdminUI/edit_doctor.html', doctor=doctor, departments=departments)
+    departments = directory.departments()
+    return render_template('AdminUI/edit_doctor.html', doctor=doctor, departments=departments,
+                           max_slots=slots.MAX_SLOTS_PER_WINDOW)
+
+
+def _slot_minutes_error(doctor, slot_minutes, department_id):
+    """Why the doctor cannot take this appointment length (None = their
+    department's), or None: it must fit their weekly hours and the
+    different hours of their upcoming exceptions."""
+    if slot_minutes is not None and not slots.MIN_SLOT_MINUTES <= slot_minutes <= slots.MAX_SLOT_MINUTES:
+        return (f"The appointment length must be between {slots.MIN_SLOT_MINUTES} and "
+                f"{slots.MAX_SLOT_MINUTES} minutes.")
+    department = db.session.get(Department, department_id)
+    minutes = slot_minutes or (department.slot_minutes if department else None) or slots.DEFAULT_SLOT_MINUTES
+    hours = [(row.start_time, row.end_time) for row in WeeklySchedule.query.filter_by(doctor_id=doctor.id)]
+    hours += [(row.start_time, row.end_time) for row in AvailabilityException.query.filter(
+        AvailabilityException.doctor_id == doctor.id, AvailabilityException.date >= date.today(),
+        AvailabilityException.start_time.isnot(None))]
+    for start_time, end_time in hours:
+        error = slots.window_error(start_time, end_time, minutes)
+        if error:
+            return f"{error} Shorten {doctor.user.user_name}'s hours first or choose a longer length."
+    return None
 
 
 # Route to blacklist a doctor
 @app.route('/admin/blacklist_doctor/<int:doctor_id>', methods=['POST'])
+@role_required('admin')
 def blacklist_doctor(doctor_id):
     # Find the doctor
     doctor = Doctor.query.get(doctor_id)
@@ -250,6 +334,9 @@ def blacklist_doctor(doctor_id):
         
         # Save changes
         db.session.commit()
+        directory.invalidate()
+        slot_index.invalidate()
+        identity.invalidate(doctor.id)
         flash("Doctor blacklisted successfully!")
     else:
         flash("Doctor not found!")
@@ -259,6 +346,7 @@ def blacklist_doctor(doctor_id):
 
 # Route to edit a patient
 @app.route('/admin/edit_patient/<int:patient_id>', methods=['GET', 'POST'])
+@role_required('admin')
 def edit_patient(patient_id):
     # Find the patient
     patient = Patient.query.get(patient_id)
@@ -278,6 +366,7 @@ def edit_patient(patient_id):
         
         # Save changes
         db.session.commit()
+        identity.invalidate(patient.id)
         flash("Patient updated successfully!")
         return redirect(url_for('admin_dashboard'))
     
@@ -287,36 +376,127 @@ def edit_patient(patient_id):
 
 # Route to delete a patient
 @app.route('/admin/delete_patient/<int:patient_id>', methods=['POST'])
+@role_required('admin')
 def delete_patient(patient_id):
-    # (Optional) ensure current user is admin here
-
     patient = Patient.query.get(patient_id)
     if not patient:
         flash("Patient not found!")
         return redirect(url_for('admin_dashboard'))
 
-    # 1) Remove dependent rows first
-    PatientHistory.query.filter_by(patient_id=patient.id).delete()
-    Appointment.query.filter_by(patient_id=patient.id).delete()
+    # Lock the account now; the cascade delete runs in the background
+    patient.user.user_role = 'blacklisted'
+    job = jobs.enqueue('delete_patient', patient_id=patient.id)
+    db.session.commit()
+    identity.invalidate(patient_id)
+
+    flash(f"Patient scheduled for deletion (job #{job.id}).")
+    return redirect(url_for('admin_dashboard'))
+
+
+
+# Streaming CSV/NDJSON export: ?from=YYYY-MM-DD&to=YYYY-MM-DD&doctor=<id>&department=<id>
+@app.route('/admin/export/<kind>.<fmt>')
+@role_required('admin')
+def export_data(kind, fmt):
+    if kind not in export.QUERIES or fmt not in export.FORMATS:
+        abort(404)
+    try:
+        filters = {
+            'date_from': date.fromisoformat(request.args['from']) if request.args.get('from') else None,
+            'date_to': date.fromisoformat(request.args['to']) if request.args.get('to') else None,
+            'doctor_id': request.args.get('doctor', type=int),
+            'department_id': request.args.get('department', type=int),
+        }
+    except ValueError:
+        abort(400)
+
+    return Response(
+        stream_with_context(export.export(kind, fmt, **filters)),
+        mimetype=export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'}
+    )
+
+
+# Appointment and registration statistics from the rollup tables (see stats.py)
+@app.route('/admin/stats')
+@role_required('admin')
+def admin_stats():
+    today = date.today()
+    try:
+        date_from = date.fromisoformat(request.args['from']) if request.args.get('from') else today - timedelta(days=29)
+        date_to = date.fromisoformat(request.args['to']) if request.args.get('to') else today
+    except ValueError:
+        abort(400)
 
-    # 2) Delete patient row
-    db.session.delete(patient)
+    daily = stats.daily_totals(date_from, date_to)
+    return render_template(
+        'AdminUI/stats.html',
+        date_from=date_from,
+        date_to=date_to,
+        daily=daily,
+        total=stats.overall(daily),
+        doctors=stats.doctor_totals(date_from, date_to),
+        departments=stats.department_totals(date_from, date_to),
+        registrations=stats.weekly_registrations(date_from, date_to)
+    )
 
-    # 3) Delete corresponding user record (if applicable)
-    user = User.query.get(patient.id)
-    if user:
-        db.session.delete(user)
 
-    # 4) Commit once
+# Rebuild the statistics rollups in the background
+@app.route('/admin/stats/rebuild', methods=['POST'])
+@role_required('admin')
+def rebuild_stats():
+    job = jobs.enqueue('rebuild_stats')
     db.session.commit()
+    flash(f"Statistics rebuild queued (job #{job.id}).")
+    return redirect(url_for('admin_stats'))
 
-    flash("Patient and related records deleted successfully!")
-    return redirect(url_for('admin_dashboard'))
+
+# Background job status, for polling
+@app.route('/admin/jobs/<int:job_id>')
+@role_required('admin')
+def job_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404)
+    return jsonify(jobs.describe(job))
+
+
+@app.route('/admin/jobs')
+@role_required('admin')
+def job_list():
+    query = Job.query.order_by(Job.id.desc())
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    return jsonify([jobs.describe(job) for job in query.limit(50)])
+
+
+# Per-endpoint timing percentiles (see instrumentation.py)
+@app.route('/admin/profile')
+@role_required('admin')
+def profile_stats():
+    return jsonify(instrumentation.summary())
 
 
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    scraper = token and request.headers.get('Authorization') == f'Bearer {token}'
+    identity_ = identity.current_identity()
+    if not scraper and (identity_ is None or identity_.role != 'admin'):
+        abort(403)
+    return Response(instrumentation.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# Directory/identity cache counters
+@app.route('/admin/cache_stats')
+@role_required('admin')
+def cache_stats():
+    return jsonify(dict(cache.all_stats(), slot_index=slot_index.stats(), slot_events=events.stats()))
+
 
 # Route to blacklist a patient
 @app.route('/admin/blacklist_patient/<int:patient_id>', methods=['POST'])
+@role_required('admin')
 def blacklist_patient(patient_id):
     # Find the patient
     patient = Patient.query.get(patient_id)
@@ -330,38 +510,90 @@ def blacklist_patient(patient_id):
     
     # Save changes
     db.session.commit()
+    identity.invalidate(patient.id)
     flash("Patient blacklisted successfully!")
     
     return redirect(url_for('admin_dashboard'))
 
 
+def _run_batch(actions, noun):
+    """Apply a batch action from the dashboard form (action, ids, department_id)
+    or a JSON body with the same keys; JSON callers get every id's outcome."""
+    as_json = request.is_json
+    if as_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': "Expected a JSON object with action and ids."}), 400
+        action, ids, department_id = data.get('action'), data.get('ids') or [], data.get('department_id')
+    else:
+        action = request.form.get('action')
+        ids = request.form.getlist('ids')
+        department_id = request.form.get('department_id')
+
+    try:
+        if not isinstance(action, str) or action not in actions:
+            raise admin_batch.BatchError("Unknown batch action.")
+        ids = admin_batch.parse_ids(ids)
+        if action == 'department':
+            result = admin_batch.reassign_department(ids, department_id)
+        else:
+            result = actions[action](ids)
+    except admin_batch.BatchError as e:
+        if as_json:
+            return jsonify({'error': e.message}), 400
+        flash(e.message, 'danger')
+        return redirect(url_for('admin_dashboard'))
+
+    counts = admin_batch.counts(result)
+    if as_json:
+        return jsonify({
+            'action': action,
+            'results': [{'id': item_id, 'outcome': outcome} for item_id, outcome in result.outcomes.items()],
+            'counts': dict(counts),
+            'job': jobs.describe(result.job) if result.job else None,
+        })
+    summary = ', '.join(f"{count} {outcome}" for outcome, count in sorted(counts.items()))
+    job = f" (job #{result.job.id})" if result.job else ''
+    flash(f"{noun.capitalize()} batch {action}: {summary}{job}.")
+    return redirect(url_for('admin_dashboard'))
+
+
+# Batch blacklist, delete or department change for the ticked doctors
+@app.route('/admin/batch/doctors', methods=['POST'])
+@role_required('admin')
+def batch_doctors():
+    return _run_batch(admin_batch.DOCTOR_ACTIONS, 'doctors')
+
+
+# Batch blacklist or delete for the ticked patients
+@app.route('/admin/batch/patients', methods=['POST'])
+@role_required('admin')
+def batch_patients():
+    return _run_batch(admin_batch.PATIENT_ACTIONS, 'patients')
+
+
 @app.route('/doctor_dashboard/<username>')
+@role_required('doctor')
+@read_only
 def doctor_dashboard(username):
-    # Fetch doctor details based on username
-    user = User.query.filter_by(user_name=username, user_role='doctor').first()
-    if not user:
-        flash("Doctor not found.", "danger")
-        return redirect(url_for('login'))
-
-    doctor = Doctor.query.filter_by(id=user.id).first()
-    if not doctor:
-        flash("Doctor not found", "danger")
-        return redirect(url_for('login'))
+    # The logged-in doctor (Doctor.id == User.id)
+    doctor = g.identity
 
     # Fetch upcoming appointments (today and future)
     today = date.today()
-    upcoming = Appointment.query.filter(
+    upcoming = Appointment.query.options(joinedload(Appointment.patient)).filter(
         Appointment.doctor_id == doctor.id,
         Appointment.appointment_date >= today,
         Appointment.status == 'booked'
     ).order_by(Appointment.appointment_date, Appointment.appointment_time).all()
 
     # Assigned patients
-    patient_ids = {appt.patient_id for appt in doctor.appointments}
-    assigned_patients = Patient.query.filter(Patient.id.in_(patient_ids)).all() if patient_ids else []
+    assigned_patients = Patient.query.filter(Patient.id.in_(
+        db.select(Appointment.patient_id).where(Appointment.doctor_id == doctor.id)
+    )).all()
 
     return render_template('DoctorUI/doctor_dashboard.html',
-                           username=username,
+                           username=doctor.name,
                            doctor=doctor,
                            upcoming=upcoming,
                            assigned_patients=assigned_patients)
@@ -369,17 +601,10 @@ def doctor_dashboard(username):
 
 #route to mark appointment as completed or cancelled
 @app.route('/update_appointment_status/<int:appointment_id>/<action>/<string:username>', methods=['POST'])
+@role_required('doctor')
 def update_appointment_status(appointment_id, action, username):
-    # validate doctor user
-    user = User.query.filter_by(user_name=username, user_role='doctor').first()
-    if not user:
-        flash("Doctor not found.", "danger")
-        return redirect(url_for('login'))
-
-    doctor = Doctor.query.filter_by(id=user.id).first()
-    if not doctor:
-        flash("Doctor profile not found.", "danger")
-        return redirect(url_for('login'))
+    doctor = g.identity
+    username = doctor.name
 
     appt = Appointment.query.get_or_404(appointment_id)
     # ensure this doctor owns the appointment
@@ -388,41 +613,38 @@ def update_appointment_status(appointment_id, action, username):
         return redirect(url_for('doctor_dashboard', username=username))
 
     if action == 'complete':
-        appt.status = 'completed'
+        booking.complete_appointment(appt)
     elif action in ('cancel', 'cancelled'):
-        appt.status = 'cancelled'
+        booking.cancel_appointment(appt)
     else:
         flash("Unknown action.", "warning")
         return redirect(url_for('doctor_dashboard', username=username))
 
-    db.session.commit()
     flash(f"Appointment {action}d.", "success")
     return redirect(url_for('doctor_dashboard', username=username))
 
 
 #route to view completed appointments
 @app.route('/doctor/<string:username>/completed_appointments')
+@role_required('doctor')
 def completed_appointments(username):
-    user = User.query.filter_by(user_name=username, user_role='doctor').first()
-    if not user:
-        flash("Doctor not found.", "danger")
-        return redirect(url_for('login'))
-
-    doctor = Doctor.query.filter_by(id=user.id).first()
-    completed = Appointment.query.filter_by(doctor_id=doctor.id, status='completed').all()
+    doctor = g.identity
+    completed = (Appointment.query.options(joinedload(Appointment.patient))
+                 .filter_by(doctor_id=doctor.id, status='completed').all())
 
-    return render_template('DoctorUI/completed_appointments.html', username=username, doctor=doctor, completed=completed)
+    return render_template('DoctorUI/completed_appointments.html', username=doctor.name, doctor=doctor, completed=completed)
 
 #route to add patient history after appointment completion
 @app.route('/doctor/<string:username>/add_history/<int:appointment_id>', methods=['GET', 'POST'])
+@role_required('doctor')
 def add_history(username, appointment_id):
     appointment = Appointment.query.get_or_404(appointment_id)
-    user = User.query.filter_by(user_name=username, user_role='doctor').first()
-    if not user:
-        flash("Doctor not found.", "danger")
-        return redirect(url_for('login'))
+    doctor = g.identity
+    username = doctor.name
+    if appointment.doctor_id != doctor.id:
+        flash("Not authorized to update this appointment.", "danger")
+        return redirect(url_for('doctor_dashboard', username=username))
 
-    doctor = Doctor.query.filter_by(id=user.id).first()
     patient = appointment.patient
 
     if request.method == 'POST':
@@ -442,7 +664,10 @@ def add_history(username, appointment_id):
             test_type=test_done,
             visit_type=visit_type
         )
+        history.fill_doctor_fields(new_record)
         db.session.add(new_record)
+        db.session.flush()
+        history.refresh(patient.id)
         db.session.commit()
 
         flash('Patient history successfully recorded.', 'success')
@@ -453,29 +678,32 @@ def add_history(username, appointment_id):
                            appointment=appointment,
                            patient=patient)
 
+def _may_view_history(user, role, patient_id):
+    # patients may only see their own history
+    return user is not None and user.role == role and not (role == 'patient' and user.id != patient_id)
+
+
 #route to view patient history
 @app.route('/<string:role>/<string:username>/patient/<int:patient_id>/history')
+@read_only
 def view_patient_history(role, username, patient_id):
     """
-    Displays complete medical history of a selected patient for any role:
-    Admin / Doctor / Patient
+    Displays the medical history of a selected patient for any role:
+    Admin / Doctor / Patient. The summary header comes from the read model;
+    the timeline shows the newest visits and loads older ones on demand.
     """
-    # Verify valid user
-    user = User.query.filter_by(user_name=username, user_role=role).first()
-    if not user:
-        flash(f"{role.capitalize()} not found.", "danger")
+    # Verify the logged-in user
+    user = g.identity
+    if not _may_view_history(user, role, patient_id):
+        flash("Not authorized to view this history.", "danger")
         return redirect(url_for('login'))
+    username = user.name
 
     # Fetch patient
     patient = Patient.query.get_or_404(patient_id)
 
-    # Fetch all medical history records for this patient
-    history_records = (
-        PatientHistory.query
-        .filter_by(patient_id=patient.id)
-        .order_by(PatientHistory.created_at.desc())
-        .all()
-    )
+    # Newest page of the timeline (or an older one with ?after=)
+    page = history.timeline(patient.id, request.args.get('after'))
 
     # Determine redirect URL based on role
     if role == 'doctor':
@@ -492,119 +720,193 @@ def view_patient_history(role, username, patient_id):
         role=role,
         username=username,
         patient=patient,
-        history_records=history_records,
+        summary=history.summary(patient.id),
+        history_records=page.items,
+        next_cursor=page.next_cursor,
+        start=request.args.get('start', 1, type=int),
         back_url=back_url
     )
 
 
+@app.route('/<string:role>/<string:username>/patient/<int:patient_id>/history/older')
+@read_only
+def older_patient_history(role, username, patient_id):
+    """Next page of the timeline as rendered rows, for the Load older button."""
+    user = g.identity
+    if not _may_view_history(user, role, patient_id):
+        abort(403)
+    page = history.timeline(patient_id, request.args.get('after'))
+    return jsonify({
+        'html': render_template('DoctorUI/_history_rows.html', history_records=page.items,
+                                start=request.args.get('start', 1, type=int)),
+        'count': len(page.items),
+        'next_cursor': page.next_cursor,
+    })
+
+
 #route to manage doctor availability
 @app.route('/doctor/<string:username>/availability', methods=['GET', 'POST'])
+@role_required('doctor')
 def manage_availability(username):
-    """Show and update availability for next 7 days."""
-    user = User.query.filter_by(user_name=username, user_role='doctor').first()
-    if not user:
-        flash("Doctor not found.", "danger")
-        return redirect(url_for('login'))
+    """Edit the weekly schedule and exceptions; windows are rolled out from them."""
+    doctor = g.identity
+    username = doctor.name
 
-    doctor = Doctor.query.filter_by(id=user.id).first()
+    schedule = {row.weekday: row for row in WeeklySchedule.query.filter_by(doctor_id=doctor.id)}
 
-    # Generate next 7 days list (including today)
-    today = date.today()
-    next_week = [today + timedelta(days=i) for i in range(7)]
-
-    # Handle form submission
+    # Handle form submission (the whole week at once)
     if request.method == 'POST':
-        for d in next_week:
-            start_str = request.form.get(f"start_{d}")
-            end_str = request.form.get(f"end_{d}")
-            available = request.form.get(f"avail_{d}") == 'on'
-
-            # Only save if both times are provided
-            if start_str and end_str:
-                start_time = datetime.strptime(start_str, "%H:%M").time()
-                end_time = datetime.strptime(end_str, "%H:%M").time()
-
-                slot = DoctorAvailability.query.filter_by(doctor_id=doctor.id, date=d).first()
-                if not slot:
-                    slot = DoctorAvailability(
-                        doctor_id=doctor.id,
-                        date=d,
-                        start_time=start_time,
-                        end_time=end_time,
-                        is_available=available
-                    )
-                    db.session.add(slot)
-                else:
-                    slot.start_time = start_time
-                    slot.end_time = end_time
-                    slot.is_available = available
-
+        slot_minutes = slots.slot_minutes_for(db.session.get(Doctor, doctor.id))
+        for weekday in range(7):
+            start_str = request.form.get(f"start_{weekday}")
+            end_str = request.form.get(f"end_{weekday}")
+            works = request.form.get(f"works_{weekday}") == 'on'
+            row = schedule.get(weekday)
+
+            if not (works and start_str and end_str):
+                if row:
+                    db.session.delete(row)
+                continue
+
+            start_time = datetime.strptime(start_str, "%H:%M").time()
+            end_time = datetime.strptime(end_str, "%H:%M").time()
+            if start_time >= end_time:
+                db.session.rollback()
+                flash(f"{calendar.day_name[weekday]}: the end time must be after the start time.", "danger")
+                return redirect(url_for('manage_availability', username=username))
+            error = slots.window_error(start_time, end_time, slot_minutes)
+            if error:
+                db.session.rollback()
+                flash(f"{calendar.day_name[weekday]}: {error}", "danger")
+                return redirect(url_for('manage_availability', username=username))
+            if not row:
+                row = WeeklySchedule(doctor_id=doctor.id, weekday=weekday)
+                db.session.add(row)
+            row.start_time = start_time
+            row.end_time = end_time
+
+        db.session.flush()
+        # an empty week means no bookings, not "keep the old windows"
+        schedules.roll_out_doctor(doctor.id, keep_unscheduled=False)
         db.session.commit()
-        flash("Availability updated successfully!", "success")
+        slot_index.doctor_changed(doctor.id)
+        flash("Weekly schedule saved; your availability has been updated.", "success")
         return redirect(url_for('manage_availability', username=username))
 
-    # Fetch existing availability records for display
-    availability = {
-        slot.date: slot for slot in DoctorAvailability.query.filter_by(doctor_id=doctor.id).all()
-    }
+    today = date.today()
+    exceptions = (AvailabilityException.query
+                  .filter(AvailabilityException.doctor_id == doctor.id, AvailabilityException.date >= today)
+                  .order_by(AvailabilityException.date)
+                  .all())
+    # what patients currently see for the next two weeks
+    upcoming = (DoctorAvailability.query
+                .filter(DoctorAvailability.doctor_id == doctor.id,
+                        DoctorAvailability.date.between(today, today + timedelta(days=13)))
+                .order_by(DoctorAvailability.date)
+                .all())
 
     return render_template(
         'DoctorUI/manage_availability.html',
         username=username,
         doctor=doctor,
-        next_week=next_week,
-        availability=availability
+        weekdays=list(enumerate(calendar.day_name)),
+        schedule=schedule,
+        exceptions=exceptions,
+        upcoming=upcoming,
+        today=today
     )
 
 
+@app.route('/doctor/<string:username>/availability/exceptions', methods=['POST'])
+@role_required('doctor')
+def add_availability_exception(username):
+    """Take a day off, or set different hours for one day."""
+    doctor = g.identity
+    username = doctor.name
+    try:
+        day = date.fromisoformat(request.form.get('date', ''))
+        start_str = request.form.get('start_time')
+        end_str = request.form.get('end_time')
+        start_time = datetime.strptime(start_str, "%H:%M").time() if start_str else None
+        end_time = datetime.strptime(end_str, "%H:%M").time() if end_str else None
+    except ValueError:
+        flash("Please enter a valid date and times.", "danger")
+        return redirect(url_for('manage_availability', username=username))
+
+    hours_error = None
+    if start_time and end_time and start_time < end_time:
+        hours_error = slots.window_error(start_time, end_time, slots.slot_minutes_for(db.session.get(Doctor, doctor.id)))
+
+    if day < date.today():
+        flash("Exceptions can only be added for today or later.", "danger")
+    elif (start_time is None) != (end_time is None) or (start_time and start_time >= end_time):
+        flash("Leave both times empty for a day off, or enter a start time before the end time.", "danger")
+    elif hours_error:
+        flash(hours_error, "danger")
+    else:
+        exception = AvailabilityException.query.filter_by(doctor_id=doctor.id, date=day).first()
+        if not exception:
+            exception = AvailabilityException(doctor_id=doctor.id, date=day)
+            db.session.add(exception)
+        exception.start_time = start_time
+        exception.end_time = end_time
+        exception.reason = request.form.get('reason', '').strip() or None
+        db.session.flush()
+        schedules.roll_out(db.session, doctor.id, doctor.id, day, day)
+        db.session.commit()
+        slot_index.doctor_changed(doctor.id)
+        flash(f"Exception saved for {day}.", "success")
+    return redirect(url_for('manage_availability', username=username))
+
+
+@app.route('/doctor/<string:username>/availability/exceptions/<int:exception_id>/delete', methods=['POST'])
+@role_required('doctor')
+def delete_availability_exception(username, exception_id):
+    doctor = g.identity
+    username = doctor.name
+    exception = AvailabilityException.query.filter_by(id=exception_id, doctor_id=doctor.id).first_or_404()
+    day = exception.date
+    db.session.delete(exception)
+    db.session.flush()
+    # back to the weekly schedule for that day
+    schedules.roll_out(db.session, doctor.id, doctor.id, day, day)
+    db.session.commit()
+    slot_index.doctor_changed(doctor.id)
+    flash(f"Exception for {day} removed.", "success")
+    return redirect(url_for('manage_availability', username=username))
+
+
 # Patient dashboard
 @app.route('/patient_dashboard/<string:username>')
+@role_required('patient')
+@read_only
 def patient_dashboard(username):
-    # Getting logged-in patient user
-    user = User.query.filter_by(user_name=username, user_role='patient').first()
+    # Getting logged-in patient user (Patient.id == User.id)
+    patient = g.identity
 
-    patient = Patient.query.filter_by(id=user.id).first()
-
-    # Loading all departments
-    departments = Department.query.order_by(Department.department_name).all()
-
-    # Simple search: ?q=name or ?dept=dept_id
+    # Full-text search: ?q=name/department or ?dept=dept_id
     q = request.args.get('q', '').strip()
     dept_id = request.args.get('dept', type=int)
-    doctors_query = Doctor.query.join(User, Doctor.id == User.id)  # join to access user_name
-
-    if q:
-        doctors_query = doctors_query.filter(User.user_name.ilike(f"%{q}%"))
-    if dept_id:
-        doctors_query = doctors_query.filter(Doctor.department_id == dept_id)
-
-    found_doctors = doctors_query.all() if (q or dept_id) else []
+    found_doctors = queries.search_doctors(q, dept_id) if (q or dept_id) else []
 
     # Upcoming appointments (today & future)
     today = date.today()
-    upcoming = (Appointment.query
-        .filter_by(patient_id=patient.id)
-        .filter(
-            (Appointment.appointment_date >= today) &
-            (Appointment.status == 'booked'))
-            .order_by(Appointment.appointment_date, Appointment.appointment_time)
-            .all())
+    upcoming = queries.patient_upcoming_appointments(patient.id, today)
 
     # Past appointments (before today) to show in dashboard (or status completed)
-    past = (Appointment.query
-        .filter_by(patient_id=patient.id)
-        .filter(
-            (Appointment.appointment_date < today) |
-            Appointment.status.in_(['completed', 'cancelled'])
-        )
-        .order_by(Appointment.appointment_date.desc())
-        .all())
+    past = queries.patient_past_appointments(patient.id, today, request.args.get('past_after'))
+
+    return render_patient_dashboard(patient, found_doctors, upcoming, past, q, dept_id)
+
 
+def render_patient_dashboard(patient, found_doctors, upcoming, past, q, dept_id):
+    """The dashboard page; also used by the async view in asgi.py."""
     return render_template('PatientUI/patient_dashboard.html',
-                           username=username,
-                           user=user,
+                           username=patient.name,
+                           user=patient,
                            patient=patient,
-                           departments=departments,
+                           departments=directory.departments(),
+                           directory_version=directory.version(),
                            found_doctors=found_doctors,
                            upcoming=upcoming,
                            past=past,
@@ -616,9 +918,11 @@ def patient_dashboard(username):
 @app.route('/department/<int:dept_id>/<string:username>')
 def department_detail(dept_id, username):
 
-    dept = Department.query.get_or_404(dept_id)
-    doctors = Doctor.query.filter_by(department_id=dept.id).all()
-    return render_template('PatientUI/department_detail.html', 
+    dept = directory.department(dept_id)
+    if not dept:
+        abort(404)
+    doctors = directory.department_doctors(dept.id)
+    return render_template('PatientUI/department_details.html', 
                           department=dept, 
                           doctors=doctors, 
                           username=username)
@@ -627,85 +931,109 @@ def department_detail(dept_id, username):
 # Doctor detail and  availability and booking page
 @app.route('/doctor/<int:doctor_id>/view/<string:username>', methods=['GET'])
 def doctor_view(doctor_id, username):
-    doctor = Doctor.query.get_or_404(doctor_id)
+    doctor = directory.doctor(doctor_id)
+    if not doctor:
+        abort(404)
     # next 7 days
-    today = date.today()
-    next_week = [today + timedelta(days=i) for i in range(7)]
-    # load availability slots for this doctor
-    slots = DoctorAvailability.query.filter_by(doctor_id=doctor.id).filter(
-        DoctorAvailability.date.in_(next_week)
-    ).order_by(DoctorAvailability.date).all()
-    # map date -> list of slots
+    next_week = queries.next_days(7)
+    # read before the windows: the page's updates stream from here
+    events_after = events.latest_id()
+    # load availability windows for this doctor
+    windows = db.session.scalars(queries.doctor_windows_statement(doctor.id, next_week)).all()
+    return render_doctor_view(doctor, username, next_week, windows, events_after)
+
+
+def render_doctor_view(doctor, username, next_week, windows, events_after):
+    """The booking page; also used by the async view in asgi.py."""
+    # map date -> list of bookable intervals
     slots_map = {}
-    for s in slots:
-        slots_map.setdefault(s.date, []).append(s)
+    for w in windows:
+        slots_map.setdefault(w.date, []).extend(slots.intervals(w))
     return render_template('PatientUI/doctor_view.html', 
                           username=username, 
                           doctor=doctor, 
                           next_week=next_week, 
-                          slots_map=slots_map)
+                          slots_map=slots_map,
+                          events_after=events_after)
+
+
+# Booking page updates as server-sent events: ?from=YYYY-MM-DD&days=7&after=<event id>
+@app.route('/doctor/<int:doctor_id>/slots/events')
+def slot_events(doctor_id):
+    if not directory.doctor(doctor_id):
+        abort(404)
+    args = events.stream_args(request.args, request.headers)
+    if args is None:
+        abort(400)
+    return Response(stream_with_context(events.stream(doctor_id, *args)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _slot_search():
+    """Run the earliest-free-slot search from the query string."""
+    dept_id = request.args.get('dept', type=int)
+    q = request.args.get('q', '').strip()
+    days = min(max(request.args.get('days', 7, type=int), 1), slot_index.HORIZON_DAYS)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return dept_id, q, days, slot_index.earliest(department_id=dept_id, name=q or None, days=days, limit=limit)
+
+
+# Earliest free slots across a department or by doctor name
+@app.route('/patient/<string:username>/next_slots')
+@role_required('patient')
+def next_free_slots(username):
+    patient = g.identity
+    username = patient.name
+    dept_id, q, days, found = _slot_search()
+    return render_template('PatientUI/next_slots.html',
+                           username=username,
+                           departments=directory.departments(),
+                           dept_id=dept_id,
+                           q=q,
+                           days=days,
+                           horizon=slot_index.HORIZON_DAYS,
+                           found=found)
+
+
+@app.route('/slots/next')
+@role_required('patient', 'doctor', 'admin')
+def next_free_slots_json():
+    dept_id, q, days, found = _slot_search()
+    return jsonify({
+        'department_id': dept_id,
+        'q': q,
+        'days': days,
+        'slots': [{
+            'date': s.date.isoformat(),
+            'start': s.start.strftime('%H:%M'),
+            'end': s.end.strftime('%H:%M'),
+            'doctor_id': s.doctor_id,
+            'doctor_name': s.doctor_name,
+            'department_id': s.department_id,
+            'department_name': s.department_name,
+        } for s in found],
+    })
 
 
 # Apppointment Booking route 
 @app.route('/book_appointment/<string:username>/<int:doctor_id>/<string:slot_date>/<string:start_time>', methods=['POST'])
+@role_required('patient')
 def book_appointment(username, doctor_id, slot_date, start_time):
-    # Find patient
-    user = User.query.filter_by(user_name=username, user_role='patient').first()
-    if not user:
-        flash("Patient not found.", "danger")
-        return redirect(url_for('login'))
-
-    patient = Patient.query.filter_by(id=user.id).first()
-    doctor = Doctor.query.get_or_404(doctor_id)
+    patient = g.identity
+    username = patient.name
+    doctor = directory.doctor(doctor_id)
+    if not doctor:
+        abort(404)
 
     slot_date_obj = datetime.strptime(slot_date, "%Y-%m-%d").date()
     start_time_obj = datetime.strptime(start_time, "%H:%M").time()
 
-    # Checking if slot exists and is available or not
-    slot = DoctorAvailability.query.filter_by(
-        doctor_id=doctor.id,
-        date=slot_date_obj,
-        start_time=start_time_obj,
-        is_available=True
-    ).first()
-
-    # Checking if the same slot is already booked by anyone (for the same doctor/date/time)
-    exists = Appointment.query.filter_by(
-        doctor_id=doctor.id,
-        appointment_date=slot_date_obj,
-        appointment_time=start_time_obj,
-        status='booked'
-    ).first()
-
-    # checking if the patient already has an appointment that day
-    patient_same_day = Appointment.query.filter_by(
-        patient_id=patient.id,
-        appointment_date=slot_date_obj
-    ).filter(Appointment.status.in_(['booked', 'completed'])).first()
-
-    if patient_same_day:
-        flash("You already have an appointment booked on this date with another doctor. Please choose a different day.", "warning")
-        return redirect(url_for('doctor_view', doctor_id=doctor.id, username=username))
-
-    # Unified unavailable slot check
-    if not slot or exists:
-        flash("This slot has already been booked or is unavailable. Please choose another.", "warning")
+    try:
+        booking.book_appointment(patient.id, doctor.id, slot_date_obj, start_time_obj)
+    except booking.BookingError as e:
+        flash(e.message, "warning")
         return redirect(url_for('doctor_view', doctor_id=doctor.id, username=username))
 
-    #creating a new appointment when everything is valid
-    new_appt = Appointment(
-        patient_id=patient.id,
-        doctor_id=doctor.id,
-        appointment_date=slot.date,
-        appointment_time=slot.start_time,
-        status='booked'
-    )
-    db.session.add(new_appt)
-
-    # Mark slot unavailable
-    slot.is_available = False
-    db.session.commit()
-
     flash("Appointment booked successfully.", "success")
     return redirect(url_for('patient_dashboard', username=username))
 
@@ -713,27 +1041,29 @@ def book_appointment(username, doctor_id, slot_date, start_time):
 
 # Cancel appointment (patient)
 @app.route('/patient_cancel/<string:username>/<int:appointment_id>', methods=['POST'])
+@role_required('patient')
 def patient_cancel_appointment(username, appointment_id):
-    user = User.query.filter_by(user_name=username, user_role='patient').first()
-    if not user:
-        flash("Patient not found.", "danger")
-        return redirect(url_for('login'))
-    patient = Patient.query.filter_by(id=user.id).first()
+    patient = g.identity
+    username = patient.name
 
     appt = Appointment.query.get_or_404(appointment_id)
     if appt.patient_id != patient.id:
         flash("Not authorized to cancel this appointment.", "danger")
         return redirect(url_for('patient_dashboard', username=username))
 
-    appt.status = 'cancelled'
-    db.session.commit()
+    booking.cancel_appointment(appt)
     flash("Appointment cancelled.", "info")
     return redirect(url_for('patient_dashboard', username=username))
 
 
 # Route to edit a patient's profile
 @app.route('/patient/edit_profile/<int:patient_id>', methods=['GET', 'POST'])
+@role_required('patient', 'admin')
 def edit_profile(patient_id):
+    if g.identity.role == 'patient' and g.identity.id != patient_id:
+        flash("Not authorized to edit this profile.", "danger")
+        return redirect(url_for('patient_dashboard', username=g.identity.name))
+
     # Find the patient
     patient = Patient.query.get(patient_id)
     
@@ -752,6 +1082,7 @@ def edit_profile(patient_id):
         
         # Save changes
         db.session.commit()
+        identity.invalidate(patient.id)
         flash("Profile updated successfully!", "success")
         return redirect(url_for('patient_dashboard', username=patient.user.user_name))
     
@@ -0,0 +1,151 @@
+"""Archival of old appointments and their history records.
+
+Appointments dated more than HMS_ARCHIVE_DAYS days ago move, together with
+their history records, from the hot tables (appointments, patient_history)
+to appointments_archive and patient_history_archive, in batches of
+--batch-size appointments, each batch its own short transaction. History
+records not tied to an appointment move once they are as old. Run it from
+cron, e.g. nightly:
+
+    python archive.py
+    python archive.py --days 180 --batch-size 2000
+
+The dashboards, booking and the appointments API only ever read the hot
+tables, which stay the size of the horizon. The history page and API, the
+history summaries, the exports and the stats rebuild read both, through
+all_appointments() and all_history().
+
+The archive tables live in the same database file, so backups and
+replication.py carry them along and every engine (the replica, the async
+views in asgi.py) can read them without attaching anything.
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, insert, delete, func, union_all
+from models import db, Appointment, PatientHistory, ArchivedAppointment, ArchivedHistory
+
+HORIZON_DAYS = int(os.environ.get('HMS_ARCHIVE_DAYS', 365))
+BATCH_SIZE = 500
+
+TABLES = ('appointments_archive', 'patient_history_archive')
+
+
+# ------------------ Reading across hot and archive ------------------
+def _union(hot, cold, name):
+    columns = [column.name for column in hot.__table__.columns]
+    return union_all(
+        select(*(hot.__table__.c[c] for c in columns)),
+        select(*(cold.__table__.c[c] for c in columns)),
+    ).subquery(name)
+
+
+def all_appointments():
+    """Subquery of every appointment, hot or archived, with the columns of
+    `appointments`."""
+    return _union(Appointment, ArchivedAppointment, 'all_appointments')
+
+
+def all_history():
+    """Subquery of every history record, hot or archived."""
+    return _union(PatientHistory, ArchivedHistory, 'all_history')
+
+
+# ------------------ Moving ------------------
+def _move(conn, hot, cold, condition):
+    """Copy the hot rows matching `condition` to the archive, then delete
+    them. Returns the number of rows moved."""
+    columns = [column.name for column in hot.__table__.columns]
+    conn.execute(insert(cold).from_select(columns, select(*(hot.__table__.c[c] for c in columns))
+                                          .where(condition)))
+    return conn.execute(delete(hot).where(condition)).rowcount
+
+
+def archive_batch(conn, cutoff, batch_size=BATCH_SIZE):
+    """Move up to `batch_size` appointments dated before `cutoff` with
+    their history records, then up to `batch_size` loose history records
+    created before it (caller's transaction). Returns a Counter of rows moved."""
+    moved = Counter()
+    # SQLite hands out max(id) + 1 to new rows; keeping the newest row in
+    # each hot table means an archived id is never reused. The newest
+    # history record may belong to an appointment, which then stays too.
+    newest = select(func.max(Appointment.id)).scalar_subquery()
+    newest_record_owner = (select(PatientHistory.appointment_id)
+                           .where(PatientHistory.id == select(func.max(PatientHistory.id)).scalar_subquery())
+                           .scalar_subquery())
+    ids = conn.execute(
+        select(Appointment.id)
+        .where(Appointment.appointment_date < cutoff, Appointment.id < newest,
+               Appointment.id != func.coalesce(newest_record_owner, 0))
+        .order_by(Appointment.appointment_date, Appointment.appointment_time)
+        .limit(batch_size)
+    ).scalars().all()
+    if ids:
+        moved['history'] += _move(conn, PatientHistory, ArchivedHistory, PatientHistory.appointment_id.in_(ids))
+        moved['appointments'] += _move(conn, Appointment, ArchivedAppointment, Appointment.id.in_(ids))
+
+    newest = select(func.max(PatientHistory.id)).scalar_subquery()
+    loose = conn.execute(
+        select(PatientHistory.id)
+        .where(PatientHistory.appointment_id.is_(None),
+               PatientHistory.created_at < datetime.combine(cutoff, datetime.min.time()),
+               PatientHistory.id < newest)
+        .limit(batch_size)
+    ).scalars().all()
+    if loose:
+        moved['history'] += _move(conn, PatientHistory, ArchivedHistory, PatientHistory.id.in_(loose))
+    return moved
+
+
+def archive(cutoff, batch_size=BATCH_SIZE, pause=0.0, progress=None):
+    """Archive everything before `cutoff`, one transaction per batch;
+    `pause` seconds between batches let waiting writers in."""
+    total = Counter()
+    while True:
+        with db.engine.begin() as conn:
+            moved = archive_batch(conn, cutoff, batch_size)
+        if not moved:
+            break
+        total.update(moved)
+        if progress:
+            progress(total)
+        time.sleep(pause)
+
+    if total:
+        # without fresh statistics the planner sorts the archive side of the
+        # export instead of merging both tables along their date indexes
+        with db.engine.begin() as conn:
+            for table in ('appointments', 'patient_history') + TABLES:
+                conn.exec_driver_sql(f'ANALYZE {table}')
+    return total
+
+
+def cutoff_for(days, today=None):
+    return (today or date.today()) - timedelta(days=days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=HORIZON_DAYS,
+                        help=f"archive appointments older than this many days (default {HORIZON_DAYS})")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.05, help="seconds between batches")
+    args = parser.parse_args()
+    if args.days < 1:
+        parser.error("--days must be at least 1")
+
+    from app import app
+    cutoff = cutoff_for(args.days)
+    started = time.perf_counter()
+    with app.app_context():
+        total = archive(cutoff, args.batch_size, args.pause,
+                        progress=lambda t: print(f"  {t['appointments']} appointments, {t['history']} records",
+                                                 end='\r', flush=True))
+    print(f"Archived {total['appointments']} appointments and {total['history']} history records "
+          f"before {cutoff} in {time.perf_counter() - started:.1f} s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""Asynchronous (ASGI) serving mode for high-concurrency polling.
+
+Patients refresh their dashboard and the doctor pages heavily around slot
+release times. Under a sync gunicorn worker every one of those requests
+holds the worker while it waits on SQLite. Served from here, the polling
+views (ASYNC_VIEWS) run as coroutines on one event loop and query through
+SQLAlchemy's asyncio extension (aiosqlite) with the same models, so a
+request waiting on the database holds no thread. Every other route runs
+the regular Flask app on a thread pool.
+
+Needs the optional packages in requirements-async.txt:
+
+    pip install -r requirements-async.txt
+    python asgi.py --port 8000
+    python asgi.py --port 8000 --workers 4
+    uvicorn asgi:application --port 8000     # or any ASGI server
+
+bench/polling.py compares it with gunicorn.
+"""
+import argparse
+import asyncio
+import inspect
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from flask import g, request, abort, Response
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+from app import app, render_patient_dashboard, render_doctor_view
+from models import db, DoctorAvailability
+import api
+import dbconfig
+import directory
+import events
+import identity
+import queries
+import routing
+
+# An async view is looked up by the endpoint the request matches in Flask's
+# url_map and runs inside a regular request context: before_request hooks
+# (identity, profiling), decorators such as role_required, render_template,
+# url_for, flash and the session cookie all work as in Flask. The request
+# context lives in the request's own task (contexts are context variables),
+# so it stays valid across awaits.
+#
+# Views must not touch db.session: that is synchronous and would block the
+# loop. They run the statements from queries.py / api.py on an AsyncSession
+# instead, loading everything the template walks up front (the listings
+# already eager-load their relationships). The per-worker caches
+# (directory, identity) are read directly; a miss loads synchronously, at
+# most once per TTL, and session() releases that connection before the
+# view awaits. All async views are read-only and may use the replica.
+#
+# A view may return a Response whose body is an async generator (with
+# direct_passthrough=True); it is streamed chunk by chunk and closed when the
+# client disconnects. slot_events uses this to hold an event stream open per
+# booking page without holding a thread (see events.py).
+#
+# The Flask app is called on a thread pool of HMS_ASGI_THREADS threads (each
+# request runs start to finish on one thread, so streamed responses keep
+# their context) and its response is sent back through the loop.
+#
+# The async engines keep a small fixed pool: every aiosqlite connection is
+# a thread, and more of them only contend for the GIL; queries wait for a
+# connection on the loop instead.
+#
+# Environment (defaults in brackets):
+#   HMS_ASGI_THREADS            [8]  threads for the Flask routes
+#   HMS_ASGI_POOL_SIZE          [4]  connections per async engine
+
+ASYNC_VIEWS = {}
+
+POOL_SIZE = int(os.environ.get('HMS_ASGI_POOL_SIZE', 4))
+
+_executor = ThreadPoolExecutor(int(os.environ.get('HMS_ASGI_THREADS', 8)), thread_name_prefix='wsgi')
+
+
+def async_view(endpoint):
+    """Serve `endpoint` (a Flask endpoint name) with the decorated coroutine."""
+    def decorator(view):
+        ASYNC_VIEWS[endpoint] = view
+        return view
+    return decorator
+
+
+# ------------------ Async database ------------------
+_sessions = {}  # bind key (None = primary) -> async_sessionmaker
+
+
+def _create_engines():
+    """Async twins of the app's engines, with the same pool and pragmas."""
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        uri = str(engine.url)
+        if not dbconfig.is_file_sqlite(uri):
+            raise RuntimeError(f"the async views need a file SQLite database, not {uri}")
+        options = dict(dbconfig.engine_options(uri), pool_size=POOL_SIZE, max_overflow=0)
+        async_engine = create_async_engine(engine.url.set(drivername='sqlite+aiosqlite'), **options)
+        if dbconfig.tuning_enabled():
+            dbconfig.install_pragmas(async_engine.sync_engine)
+        if key == routing.REPLICA:
+            routing.install_query_only(async_engine.sync_engine)
+        _sessions[key] = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+def session():
+    """AsyncSession for this request: the replica when routing allows it."""
+    if not _sessions:
+        _create_engines()
+    # A cache miss may have loaded through db.session. Hand its connection
+    # back before awaiting: requests holding them across awaits would drain
+    # the sync pool, and the next miss would block the loop waiting for one.
+    db.session.close()
+    if routing.REPLICA in _sessions and routing.replica_allowed():
+        return _sessions[routing.REPLICA]()
+    return _sessions[None]()
+
+
+async def _dispose_engines():
+    for sessionmaker in _sessions.values():
+        await sessionmaker.kw['bind'].dispose()
+    _sessions.clear()
+
+
+# ------------------ Async views ------------------
+@async_view('patient_dashboard')
+@identity.role_required('patient')
+async def patient_dashboard(username):
+    patient = g.identity
+    q = request.args.get('q', '').strip()
+    dept_id = request.args.get('dept', type=int)
+    today = date.today()
+
+    async with session() as s:
+        found_doctors = []
+        search = queries.search_doctors_statement(q, dept_id) if (q or dept_id) else None
+        if search is not None:
+            found_doctors = (await s.scalars(search)).all()
+        upcoming = (await s.scalars(queries.patient_upcoming_statement(patient.id, today))).all()
+        past = await s.scalars(queries.patient_past_statement(patient.id, today, request.args.get('past_after')))
+        past = queries.make_page(past.all(), queries.appointment_key)
+
+    return render_patient_dashboard(patient, found_doctors, upcoming, past, q, dept_id)
+
+
+@async_view('doctor_view')
+async def doctor_view(doctor_id, username):
+    doctor = directory.doctor(doctor_id)
+    if not doctor:
+        abort(404)
+    next_week = queries.next_days(7)
+    async with session() as s:
+        events_after = await s.scalar(events.latest_statement())
+        windows = (await s.scalars(queries.doctor_windows_statement(doctor.id, next_week))).all()
+    return render_doctor_view(doctor, username, next_week, windows, events_after)
+
+
+@async_view('slot_events')
+async def slot_events(doctor_id):
+    if not directory.doctor(doctor_id):
+        abort(404)
+    args = events.stream_args(request.args, request.headers)
+    if args is None:
+        abort(400)
+    return Response(_slot_event_stream(doctor_id, *args), mimetype='text/event-stream', direct_passthrough=True,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def _slot_event_stream(doctor_id, first_day, days, after):
+    """events.stream() on the loop, held open until the client leaves."""
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+
+    def deliver(event):
+        # called on the publishing thread
+        try:
+            loop.call_soon_threadsafe(inbox.put_nowait, event)
+        except RuntimeError:
+            pass  # the loop has shut down
+
+    chans = events.channels(doctor_id, first_day, days)
+    # the first subscription in the process waits (once) for the relay to start
+    subscription = events.subscribe(chans, deliver)
+    try:
+        yield events.preamble()
+        async with session() as s:
+            replayed = (await s.scalars(events.replay_statement(doctor_id, first_day, days, after))).all()
+        for row in replayed:
+            yield events.format_event(row)
+        replayed = {row.id for row in replayed}
+        while True:
+            try:
+                event = await asyncio.wait_for(inbox.get(), events.HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield events.HEARTBEAT
+                continue
+            if event.id > after and event.id not in replayed:
+                yield events.format_event(event)
+    finally:
+        events.unsubscribe(subscription, chans)
+
+
+@async_view('api.availability')
+async def availability(doctor_id):
+    if not directory.doctor(doctor_id):
+        return api.error(404, "no such doctor")
+    stmt = api.availability_statement(doctor_id)
+    async with session() as s:
+        version = api.availability_version((await s.execute(api.version_statement(stmt, DoctorAvailability))).one())
+        # an unchanged availability costs the one aggregate query
+        windows = None if api.is_fresh(version) else \
+            (await s.scalars(stmt.order_by(DoctorAvailability.date))).all()
+    return api.conditional(version, lambda: api.availability_json(doctor_id, windows), api.AVAILABILITY_CACHE)
+
+
+# ------------------ Dispatch ------------------
+async def _dispatch(view, args):
+    """Flask's full_dispatch_request() for a coroutine view."""
+    try:
+        # the async views are all read-only (routing.read_only cannot wrap a coroutine)
+        g.read_only = True
+        rv = app.preprocess_request()
+        if rv is None:
+            rv = view(**args)
+            if inspect.isawaitable(rv):
+                rv = await rv
+    except Exception as e:
+        rv = app.handle_user_exception(e)
+    return app.finalize_request(rv)
+
+
+async def _run_async_view(view, environ, receive, send):
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            response = await _dispatch(view, ctx.request.view_args)
+        except Exception as e:
+            error = e
+            response = app.handle_exception(e)
+        body, status, headers = response.get_wsgi_response(environ)
+        if hasattr(body, '__aiter__'):
+            await _stream_response(receive, send, status, headers, body)
+        else:
+            await _send_response(send, status, headers, body)
+    finally:
+        ctx.pop(error)
+
+
+async def _run_flask(environ, send):
+    """Run the Flask app for one request on the thread pool."""
+    loop = asyncio.get_running_loop()
+
+    def send_now(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [_start_message(status, headers)]
+
+        iterable = app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if chunk:
+                    if started:
+                        send_now(started.pop())
+                    send_now({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if started:
+                send_now(started.pop())
+            send_now({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    await loop.run_in_executor(_executor, run)
+
+
+def _start_message(status, headers):
+    return {'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]}
+
+
+async def _send_response(send, status, headers, body):
+    await send(_start_message(status, headers))
+    await send({'type': 'http.response.body', 'body': b''.join(body)})
+
+
+async def _stream_response(receive, send, status, headers, body):
+    """Send an async generator body (an event stream) chunk by chunk until
+    it ends or the client disconnects, which closes the generator."""
+    async def pump():
+        await send(_start_message(status, headers))
+        async for chunk in body:
+            await send({'type': 'http.response.body', 'body': chunk.encode() if isinstance(chunk, str) else chunk,
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    streaming = asyncio.create_task(pump())
+    watching = asyncio.create_task(disconnected())
+    try:
+        await asyncio.wait((streaming, watching), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (streaming, watching):
+            task.cancel()
+        await asyncio.gather(streaming, watching, return_exceptions=True)
+        await body.aclose()
+        if streaming.done() and not streaming.cancelled() and streaming.exception():
+            raise streaming.exception()
+
+
+# ------------------ ASGI application ------------------
+async def _read_body(receive):
+    body = io.BytesIO()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI http scope."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _match_async_view(environ):
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        # 404s, redirects and 405s are Flask's to answer
+        return None
+    return ASYNC_VIEWS.get(endpoint)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await _dispose_engines()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise RuntimeError(f"unsupported ASGI scope {scope['type']}")
+
+    environ = _environ(scope, await _read_body(receive))
+    view = _match_async_view(environ)
+    if view is not None:
+        await _run_async_view(view, environ, receive, send)
+    else:
+        await _run_flask(environ, send)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help="processes, each with its own event loop")
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run('asgi:application', host=args.host, port=args.port, workers=args.workers,
+                log_level=args.log_level)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Multi-process stress check for the booking service.
+
+Creates a scratch database with one doctor, one availability window and N
+patients, then starts N processes that all try to book the window's first
+interval at the same moment. Exactly one booking must win; the run exits
+non-zero otherwise.
+
+    python -m bench.booking_stress --processes 32
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import Counter
+from datetime import date, time, timedelta
+
+SLOT_DATE = date.today() + timedelta(days=1)
+SLOT_TIME = time(10, 0)
+
+
+def setup_database():
+    from app import app
+    from migrate import initialize
+    from models import db, User, Doctor, Patient, Department, DoctorAvailability
+
+    with app.app_context():
+        initialize()
+        department = Department(department_name='Stress')
+        db.session.add(department)
+        doctor_user = User(user_name='stress-doctor', user_email='doctor@stress.test',
+                           user_password='x', user_role='doctor')
+        db.session.add(doctor_user)
+        db.session.flush()
+        db.session.add(Doctor(id=doctor_user.id, department_id=department.id, experience_years=1))
+        db.session.add(DoctorAvailability(doctor_id=doctor_user.id, date=SLOT_DATE,
+                                          start_time=SLOT_TIME, end_time=time(11, 0), is_available=True))
+        db.session.commit()
+        return doctor_user.id
+
+
+def add_patients(count):
+    from app import app
+    from models import db, User, Patient
+
+    ids = []
+    with app.app_context():
+        for i in range(count):
+            user = User(user_name=f'stress-patient-{i}', user_email=f'patient{i}@stress.test',
+                        user_password='x', user_role='patient')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Patient(id=user.id, patient_name=user.user_name))
+            ids.append(user.id)
+        db.session.commit()
+    return ids
+
+
+def attempt(args):
+    patient_id, doctor_id, start = args
+    from sqlalchemy.exc import OperationalError
+    from app import app
+    import booking
+
+    with app.app_context():
+        start.wait()
+        try:
+            booking.book_appointment(patient_id, doctor_id, SLOT_DATE, SLOT_TIME)
+            return 'booked'
+        except booking.BookingError as e:
+            return type(e).__name__
+        except OperationalError:
+            # "database is locked" - the attempt lost without writing anything
+            return 'locked'
+
+
+def count_bookings(doctor_id):
+    from app import app
+    from models import Appointment, DoctorAvailability
+
+    with app.app_context():
+        booked = Appointment.query.filter_by(doctor_id=doctor_id, appointment_date=SLOT_DATE,
+                                             appointment_time=SLOT_TIME, status='booked').count()
+        window = DoctorAvailability.query.filter_by(doctor_id=doctor_id, date=SLOT_DATE).first()
+        return booked, not window.booked_mask & 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hms-stress-')
+    # set before the app is imported, here and in the spawned workers
+    os.environ['HMS_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'stress.db')
+
+    doctor_id = setup_database()
+    patient_ids = add_patients(args.processes)
+
+    ctx = multiprocessing.get_context('spawn')
+    manager = ctx.Manager()
+    start = manager.Event()
+    with ctx.Pool(args.processes) as pool:
+        pending = pool.map_async(attempt, [(pid, doctor_id, start) for pid in patient_ids])
+        start.set()
+        outcomes = Counter(pending.get())
+
+    booked, slot_open = count_bookings(doctor_id)
+    print(f"processes: {args.processes}")
+    for outcome, n in sorted(outcomes.items()):
+        print(f"  {outcome}: {n}")
+    print(f"active bookings in database: {booked}, interval still open: {slot_open}")
+
+    ok = outcomes['booked'] == 1 and booked == 1 and not slot_open
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Fill a scratch SQLite database with synthetic hospital data.
+
+Volumes are configurable up to production scale; the same --seed and
+--anchor always produce the same database. Every doctor gets a 09:00-17:00
+window of 15-minute intervals on each day of the range, and appointments
+are spread over those intervals (past days completed or cancelled, future
+days booked) with the window bitmaps filled in to match. Completed
+appointments get a history record with probability --history-ratio.
+
+Accounts are doctor<N>@bench.test and patient<N>@bench.test (N from 1),
+password "bench"; the admin is the default admin@hms.com / admin@123.
+
+    python -m bench.datagen bench.db
+    python -m bench.datagen big.db --doctors 5000 --patients 500000 \\
+        --appointments 10000000 --days-past 60 --days-ahead 14
+
+Each doctor also gets a 09:00-17:00 weekly schedule on every weekday, so
+`python schedules.py` has something to roll out.
+
+Note that the one-appointment-per-day rule for patients is not applied to
+generated data.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, time as dtime
+from sqlalchemy import insert
+
+DEPARTMENTS = [
+    ('Cardiology', 'Heart and blood vessel conditions'),
+    ('Dermatology', 'Skin, hair and nail conditions'),
+    ('Endocrinology', 'Diabetes, thyroid and hormone disorders'),
+    ('Gastroenterology', 'Digestive system and liver'),
+    ('General Medicine', 'Primary care and general consultations'),
+    ('Gynecology', 'Women\'s reproductive health'),
+    ('Nephrology', 'Kidney diseases and dialysis'),
+    ('Neurology', 'Brain, spine and nerve disorders'),
+    ('Oncology', 'Cancer diagnosis and treatment'),
+    ('Ophthalmology', 'Eye care and vision'),
+    ('Orthopedics', 'Bones, joints and muscles'),
+    ('Pediatrics', 'Care for infants and children'),
+    ('Psychiatry', 'Mental health'),
+    ('Pulmonology', 'Lungs and breathing'),
+    ('Urology', 'Urinary tract and male reproductive health'),
+]
+
+FIRST_NAMES = ['Aarav', 'Aditi', 'Anil', 'Asha', 'Bala', 'Chitra', 'Deepak', 'Divya', 'Farah', 'Gaurav',
+               'Hema', 'Imran', 'Isha', 'Jaya', 'Karan', 'Kavya', 'Lakshmi', 'Manoj', 'Meera', 'Nikhil',
+               'Neha', 'Omar', 'Pooja', 'Rahul', 'Ritu', 'Sanjay', 'Sara', 'Tarun', 'Uma', 'Vikram']
+LAST_NAMES = ['Agarwal', 'Bose', 'Chopra', 'Das', 'Fernandes', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Khan',
+              'Menon', 'Mehta', 'Nair', 'Patel', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Verma']
+
+DIAGNOSES = [('Hypertension', 'Lifestyle changes', 'Amlodipine 5mg'),
+             ('Type 2 diabetes', 'Diet and exercise plan', 'Metformin 500mg'),
+             ('Migraine', 'Rest, avoid triggers', 'Sumatriptan 50mg'),
+             ('Seasonal allergy', 'Avoid allergens', 'Cetirizine 10mg'),
+             ('Lower back pain', 'Physiotherapy', 'Ibuprofen 400mg'),
+             ('Viral fever', 'Fluids and rest', 'Paracetamol 500mg')]
+VISIT_TYPES = ['In-person', 'Follow-up', 'Teleconsultation']
+TEST_TYPES = ['', 'Blood test', 'ECG', 'X-ray', 'MRI', 'Urine test']
+
+PASSWORD = 'bench'
+WINDOW_START = dtime(9, 0)
+WINDOW_END = dtime(17, 0)
+SLOT_MINUTES = 15
+INTERVALS = 32  # 09:00-17:00 in 15-minute intervals
+
+
+def person(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def interval_time(index):
+    minutes = WINDOW_START.hour * 60 + index * SLOT_MINUTES
+    return dtime(minutes // 60, minutes % 60)
+
+
+class Writer:
+    """Buffers rows per table and inserts them in chunked transactions."""
+
+    def __init__(self, conn, tables, chunk_size):
+        self.conn = conn
+        self.tables = tables
+        self.chunk_size = chunk_size
+        self.buffers = {name: [] for name in tables}
+        self.counts = {name: 0 for name in tables}
+
+    def add(self, name, row):
+        buffer = self.buffers[name]
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        with self.conn.begin():
+            # parents before children, in declaration order
+            for name, table in self.tables.items():
+                rows = self.buffers[name]
+                if rows:
+                    self.conn.execute(insert(table), rows)
+                    self.counts[name] += len(rows)
+                    self.buffers[name] = []
+
+
+def generate(conn, args):
+    from models import (User, Doctor, Patient, Department, Appointment, PatientHistory, DoctorAvailability,
+                        WeeklySchedule)
+
+    rng = random.Random(args.seed)
+    anchor = args.anchor
+    writer = Writer(conn, {
+        'users': User.__table__,
+        'departments': Department.__table__,
+        'doctors': Doctor.__table__,
+        'patients': Patient.__table__,
+        'weekly_schedules': WeeklySchedule.__table__,
+        'doctor_availability': DoctorAvailability.__table__,
+        'appointments': Appointment.__table__,
+        'patient_history': PatientHistory.__table__,
+    }, args.chunk_size)
+
+    registered_since = datetime.combine(anchor, dtime()) - timedelta(days=365)
+    # the same default admin as init_db.py
+    writer.add('users', {'id': 1, 'user_name': 'admin', 'user_email': 'admin@hms.com',
+                         'user_password': 'admin@123', 'user_role': 'admin', 'created_at': registered_since})
+    next_user = 2
+
+    departments = []
+    for dept_id, (name, description) in enumerate(DEPARTMENTS[:args.departments], start=1):
+        writer.add('departments', {'id': dept_id, 'department_name': name, 'description': description,
+                                   'slot_minutes': SLOT_MINUTES})
+        departments.append((dept_id, name))
+
+    doctors = []
+    for n in range(1, args.doctors + 1):
+        dept_id, dept_name = departments[n % len(departments)]
+        name = 'Dr. ' + person(rng)
+        writer.add('users', {'id': next_user, 'user_name': name, 'user_email': f'doctor{n}@bench.test',
+                             'user_password': PASSWORD, 'user_role': 'doctor',
+                             'created_at': registered_since})
+        writer.add('doctors', {'id': next_user, 'department_id': dept_id,
+                               'experience_years': rng.randint(1, 35)})
+        for weekday in range(7):
+            writer.add('weekly_schedules', {'doctor_id': next_user, 'weekday': weekday,
+                                            'start_time': WINDOW_START, 'end_time': WINDOW_END})
+        doctors.append((next_user, name, dept_name))
+        next_user += 1
+
+    first_patient = next_user
+    for n in range(1, args.patients + 1):
+        name = person(rng)
+        writer.add('users', {'id': next_user, 'user_name': name, 'user_email': f'patient{n}@bench.test',
+                             'user_password': PASSWORD, 'user_role': 'patient',
+                             'created_at': registered_since + timedelta(minutes=rng.randrange(365 * 24 * 60))})
+        writer.add('patients', {'id': next_user, 'patient_name': name})
+        next_user += 1
+    writer.flush()
+
+    # Appointments per window: the fill rate spread evenly, with the
+    # fractional part rounded randomly so the total comes out right.
+    days = [anchor + timedelta(days=d) for d in range(-args.days_past, args.days_ahead + 1)]
+    windows = len(doctors) * len(days)
+    per_window = min(args.appointments / windows, INTERVALS) if windows else 0
+    whole, fraction = int(per_window), per_window - int(per_window)
+
+    appointment_id = history_id = window_id = 1
+    for doctor_id, doctor_name, dept_name in doctors:
+        for day in days:
+            count = whole + (1 if rng.random() < fraction else 0)
+            mask = 0
+            for index in rng.sample(range(INTERVALS), count):
+                if day >= anchor:
+                    status = 'booked'
+                else:
+                    status = 'cancelled' if rng.random() < args.cancel_ratio else 'completed'
+                if status != 'cancelled':
+                    mask |= 1 << index
+                patient_id = rng.randrange(first_patient, first_patient + args.patients)
+                booked_at = datetime.combine(day, dtime()) - timedelta(days=rng.randint(1, 30))
+                writer.add('appointments', {
+                    'id': appointment_id, 'patient_id': patient_id, 'doctor_id': doctor_id,
+                    'appointment_date': day, 'appointment_time': interval_time(index),
+                    'status': status, 'created_at': booked_at,
+                })
+                if status == 'completed' and rng.random() < args.history_ratio:
+                    diagnosis, treatment, prescription = rng.choice(DIAGNOSES)
+                    writer.add('patient_history', {
+                        'id': history_id, 'patient_id': patient_id, 'appointment_id': appointment_id,
+                        'doctor_id': doctor_id, 'visit_type': rng.choice(VISIT_TYPES),
+                        'test_type': rng.choice(TEST_TYPES), 'diagnosis': diagnosis, 'treatment': treatment,
+                        'prescription': prescription, 'doctor_name': doctor_name, 'department': dept_name,
+                        'created_at': datetime.combine(day, interval_time(index)),
+                    })
+                    history_id += 1
+                appointment_id += 1
+
+            writer.add('doctor_availability', {
+                'id': window_id, 'doctor_id': doctor_id, 'date': day, 'start_time': WINDOW_START,
+                'end_time': WINDOW_END, 'is_available': True, 'slot_minutes': SLOT_MINUTES,
+                'booked_mask': mask,
+            })
+            window_id += 1
+    writer.flush()
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="database file to create (must not exist)")
+    parser.add_argument('--departments', type=int, default=len(DEPARTMENTS),
+                        choices=range(1, len(DEPARTMENTS) + 1), metavar=f'1-{len(DEPARTMENTS)}')
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--appointments', type=int, default=50000)
+    parser.add_argument('--days-past', type=int, default=30)
+    parser.add_argument('--days-ahead', type=int, default=14)
+    parser.add_argument('--history-ratio', type=float, default=0.6)
+    parser.add_argument('--cancel-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--anchor', type=date.fromisoformat, default=date.today(),
+                        help="the generated 'today' (default: the real today)")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+    # set before the app is imported
+    os.environ['HMS_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(args.path)
+
+    from app import app
+    from migrate import initialize
+    from models import db
+    import history
+    import stats
+
+    started = time.perf_counter()
+    with app.app_context():
+        initialize()
+        with db.engine.connect() as conn:
+            # scratch database: trade durability for load speed
+            conn.exec_driver_sql('PRAGMA journal_mode = OFF')
+            conn.exec_driver_sql('PRAGMA synchronous = OFF')
+            conn.commit()
+            counts = generate(conn, args)
+            # the search triggers already indexed rows one by one; the
+            # rollups and history summaries are cheaper to compute once at the end
+            with conn.begin():
+                stats.rebuild(conn)
+                history.rebuild(conn)
+            conn.exec_driver_sql('ANALYZE')
+            conn.commit()
+    elapsed = time.perf_counter() - started
+
+    for table, count in counts.items():
+        print(f"{table:20} {count:>12,}")
+    print(f"generated in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
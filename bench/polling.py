@@ -0,0 +1,225 @@
+"""How many concurrent polling clients one server process sustains.
+
+Simulates patients refreshing around slot release times: each client holds
+a logged-in session and, in a loop, loads the patient dashboard and a
+doctor's booking page, then waits --think seconds (jittered) before the
+next refresh. For each serving mode a single server process is started on
+a database from bench.datagen and the number of clients is stepped up
+(--clients); a level is sustained when its p95 latency stays within
+--slo-ms and no request fails or times out. Prints a JSON report:
+
+    sync     gunicorn, one sync worker (the default setup)
+    gthread  gunicorn, one worker with --threads threads
+    asgi     asgi.py under uvicorn, one process (needs requirements-async.txt)
+
+    python -m bench.polling bench.db
+    python -m bench.polling bench.db --modes sync asgi --clients 50 100 200 400 --think 2
+
+The clients run in this process on one asyncio loop, so on a small machine
+they compete with the server for CPU; compare modes within one run.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+import urllib.parse
+from collections import Counter
+from datetime import datetime
+from bench.routes import ROOT, HttpDriver, load_fixtures, start_gunicorn, start_server, git_commit
+
+MODES = ['sync', 'gthread', 'asgi']
+
+
+def start(mode, database, port, threads):
+    if mode == 'sync':
+        return start_gunicorn(database, 1, port)
+    if mode == 'gthread':
+        return start_gunicorn(database, 1, port, '--threads', str(threads))
+    return start_server('asgi.py', [sys.executable, 'asgi.py', '--port', str(port), '--log-level', 'warning'],
+                        database, port)
+
+
+# ------------------ Clients ------------------
+class Client:
+    """One patient polling over a keep-alive HTTP/1.1 connection (reopened
+    whenever the server closes it, as sync gunicorn does after each response)."""
+
+    def __init__(self, port, cookie, paths):
+        self.port = port
+        self.cookie = cookie
+        self.paths = paths
+        self.reader = self.writer = None
+
+    async def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+        if headers.get('connection', '').lower() == 'close':
+            await self._close()
+        return status
+
+    async def fetch(self, path):
+        request = (f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{self.port}\r\n"
+                   f"Cookie: {self.cookie}\r\n\r\n").encode()
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+            try:
+                self.writer.write(request)
+                await self.writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # a kept-alive connection the server had already dropped
+                await self._close()
+                if attempt:
+                    raise
+
+    async def run(self, deadline, think, timeout, results):
+        rng = random.Random(id(self))
+        # spread the first refreshes over one think period
+        await asyncio.sleep(rng.uniform(0, think))
+        while time.perf_counter() < deadline:
+            for path in self.paths(rng):
+                started = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(self.fetch(path), timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    status = 0
+                    await self._close()
+                results.append((status, time.perf_counter() - started))
+            await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+        await self._close()
+
+
+async def run_level(port, sessions, doctors, clients, seconds, think, timeout):
+    results = []
+    deadline = time.perf_counter() + seconds
+
+    def refresh(patient_name):
+        def paths(rng):
+            return [f'/patient_dashboard/{patient_name}',
+                    f'/doctor/{rng.choice(doctors)}/view/{patient_name}']
+        return paths
+
+    tasks = [Client(port, cookie, refresh(name)).run(deadline, think, timeout, results)
+             for cookie, name in (sessions[i % len(sessions)] for i in range(clients))]
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, slo_ms):
+    from instrumentation import percentile
+
+    latencies = sorted(seconds * 1000 for _, seconds in results)
+    errors = sum(1 for status, _ in results if status == 0 or status >= 500)
+    p95 = percentile(latencies, 0.95)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'statuses': dict(sorted(Counter(str(status) for status, _ in results).items())),
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5),
+            'p95': p95,
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'sustained': bool(results) and errors == 0 and p95 <= slo_ms,
+    }
+
+
+def run_mode(mode, args, fixtures):
+    server = start(mode, args.database, args.port, args.threads)
+    levels = {}
+    try:
+        driver = HttpDriver(f'http://127.0.0.1:{args.port}', 1)
+        sessions = [(driver.login(email), urllib.parse.quote(name)) for _, name, email in fixtures['patients']]
+        for clients in args.clients:
+            results, elapsed = asyncio.run(run_level(args.port, sessions, fixtures['doctors'], clients,
+                                                     args.seconds, args.think, args.timeout))
+            levels[clients] = summarize(results, elapsed, args.slo_ms)
+            print(f"{mode} {clients} clients: {levels[clients]['throughput_rps']} rps, "
+                  f"p95 {levels[clients]['latency_ms']['p95']} ms, {levels[clients]['errors']} errors",
+                  file=sys.stderr)
+            if not levels[clients]['sustained']:
+                # higher levels only get worse
+                break
+    finally:
+        server.terminate()
+        server.wait()
+    sustained = [clients for clients, level in levels.items() if level['sustained']]
+    return {'sustained_clients': max(sustained) if sustained else 0, 'levels': levels}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help="database file from bench.datagen (only read)")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--clients', nargs='+', type=int, default=[10, 25, 50, 100, 200, 400],
+                        help="concurrent clients per level, ascending")
+    parser.add_argument('--seconds', type=float, default=15, help="duration of each level")
+    parser.add_argument('--think', type=float, default=1.0, help="mean seconds between a client's refreshes")
+    parser.add_argument('--slo-ms', type=float, default=500, help="p95 latency a sustained level must meet")
+    parser.add_argument('--timeout', type=float, default=10, help="seconds before a request counts as failed")
+    parser.add_argument('--threads', type=int, default=8, help="threads of the gthread worker")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('-o', '--output', help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+    if 'asgi' in args.modes and not all(importlib.util.find_spec(m) for m in ('uvicorn', 'aiosqlite')):
+        parser.error("the asgi mode needs the packages in requirements-async.txt")
+    sys.path.insert(0, ROOT)
+    fixtures = load_fixtures(args.database, 0)
+
+    modes = {mode: run_mode(mode, args, fixtures) for mode in args.modes}
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'database': os.path.basename(args.database),
+        'cpus': os.cpu_count(),
+        'think_seconds': args.think,
+        'slo_p95_ms': args.slo_ms,
+        'seconds_per_level': args.seconds,
+        'modes': modes,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
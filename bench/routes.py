@@ -0,0 +1,392 @@
+"""Benchmark the main routes against a database made by bench.datagen.
+
+Each scenario sends --requests requests to one route and reports
+throughput, latency percentiles and (with the in-process driver) SQL
+statements per request, as JSON:
+
+    client  the Flask test client in this process; SQL statements are
+            counted with engine events
+    http    --concurrency threads against gunicorn, started here with
+            --workers or already running at --url
+
+Booking writes to the database, so run against a copy. Compare two runs
+with --baseline; the exit status is 1 if any scenario's p95 got worse by
+more than --threshold:
+
+    cp bench.db run.db && python -m bench.routes run.db -o before.json
+    python -m bench.routes run.db --driver http --workers 4 --concurrency 16
+    python -m bench.routes run.db -o after.json --baseline before.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'bench'
+ADMIN = ('admin@hms.com', 'admin@123')
+
+# logged-in patients the read scenarios rotate through
+SESSION_POOL = 20
+
+SCENARIOS = ['login', 'admin_dashboard', 'patient_dashboard', 'doctor_view',
+             'book_appointment', 'view_patient_history']
+
+
+# ------------------ Fixtures ------------------
+def load_fixtures(path, bookings):
+    """Accounts and free intervals to aim the requests at, read straight from
+    the database so the http driver needs no app import."""
+    conn = sqlite3.connect(path)
+    today = date.today().isoformat()
+    patients = conn.execute(
+        "SELECT u.id, u.user_name, u.user_email FROM users u "
+        "WHERE u.user_role = 'patient' AND u.user_email LIKE '%@bench.test' ORDER BY u.id LIMIT ?",
+        (SESSION_POOL,)
+    ).fetchall()
+    with_history = conn.execute(
+        "SELECT DISTINCT h.patient_id, u.user_name, u.user_email FROM patient_history h "
+        "JOIN users u ON u.id = h.patient_id ORDER BY h.patient_id LIMIT ?", (SESSION_POOL,)
+    ).fetchall()
+    doctors = conn.execute(
+        "SELECT id FROM users WHERE user_role = 'doctor' ORDER BY id LIMIT ?", (SESSION_POOL,)
+    ).fetchall()
+
+    # free intervals from the window bitmaps, one per doctor-day so bookings
+    # do not compete with each other
+    free = []
+    for doctor_id, day, start, slot_minutes, mask in conn.execute(
+            "SELECT doctor_id, date, start_time, slot_minutes, booked_mask FROM doctor_availability "
+            "WHERE date > ? AND is_available ORDER BY date, doctor_id", (today,)):
+        start = datetime.strptime(start[:5], '%H:%M')
+        for index in range(63):
+            if not mask & (1 << index):
+                minutes = start.hour * 60 + start.minute + index * (slot_minutes or 15)
+                free.append((doctor_id, day, f'{minutes // 60:02d}:{minutes % 60:02d}'))
+                break
+        if len(free) >= bookings:
+            break
+    # patients with no upcoming appointment, so the one-per-day rule does not refuse them
+    bookers = conn.execute(
+        "SELECT u.id, u.user_name, u.user_email FROM users u WHERE u.user_role = 'patient' "
+        "AND NOT EXISTS (SELECT 1 FROM appointments a WHERE a.patient_id = u.id AND a.appointment_date > ?) "
+        "ORDER BY u.id DESC LIMIT ?", (today, bookings)
+    ).fetchall()
+    conn.close()
+
+    if not patients or not doctors:
+        sys.exit("no bench accounts found; create the database with python -m bench.datagen")
+    return {'patients': patients, 'with_history': with_history or patients,
+            'doctors': [d for (d,) in doctors], 'free': free, 'bookers': bookers}
+
+
+def count_booked(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM appointments WHERE status = 'booked'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# ------------------ Drivers ------------------
+class ClientDriver:
+    """Requests through app.test_client(); one client per logged-in user."""
+
+    name = 'client'
+    concurrency = 1
+
+    def __init__(self):
+        from app import app
+        from models import db
+        from sqlalchemy import event
+
+        self.app = app
+        self.queries = 0
+        app.testing = True
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.queries += 1
+
+    def anonymous(self):
+        return self.app.test_client()
+
+    def login(self, email, password=PASSWORD):
+        client = self.app.test_client()
+        client.post('/login', data={'user_email': email, 'user_password': password})
+        return client
+
+    def request(self, client, method, path, form=None):
+        before = self.queries
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=form)
+        elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, self.queries - before
+
+    def run(self, jobs):
+        return [self.request(*job) for job in jobs]
+
+
+class HttpDriver:
+    """Plain HTTP/1.1 requests from a thread pool; sessions are cookies."""
+
+    name = 'http'
+
+    def __init__(self, url, concurrency):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.concurrency = concurrency
+
+    def _send(self, cookie, method, path, form=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Cookie': cookie} if cookie else {}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response
+        finally:
+            conn.close()
+
+    def anonymous(self):
+        return None
+
+    def login(self, email, password=PASSWORD):
+        response = self._send(None, 'POST', '/login', {'user_email': email, 'user_password': password})
+        cookie = response.getheader('Set-Cookie') or ''
+        return cookie.split(';', 1)[0]
+
+    def request(self, cookie, method, path, form=None):
+        started = time.perf_counter()
+        try:
+            status = self._send(cookie, method, path, form).status
+        except OSError:
+            status = 0
+        return status, time.perf_counter() - started, None
+
+    def run(self, jobs):
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            return list(pool.map(lambda job: self.request(*job), jobs))
+
+
+def start_server(name, command, database, port):
+    """Start a server process for `database` and wait until it answers on `port`."""
+    env = dict(os.environ, HMS_DATABASE_URI='sqlite:///' + os.path.abspath(database))
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                sys.exit(f"{name} exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit(f"{name} did not start within 30s")
+
+
+def start_gunicorn(database, workers, port, *options):
+    return start_server(
+        'gunicorn',
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+         '--log-level', 'warning', *options, 'app:app'],
+        database, port
+    )
+
+
+# ------------------ Scenarios ------------------
+def build_jobs(name, driver, fixtures, count):
+    """(session, method, path, form) for each request of a scenario. Logins
+    needed to set up the sessions happen here, outside the timing."""
+    patients = fixtures['patients']
+
+    if name == 'login':
+        anonymous = driver.anonymous()
+        return [(anonymous, 'POST', '/login', {'user_email': patients[i % len(patients)][2], 'user_password': PASSWORD})
+                for i in range(count)]
+
+    if name == 'admin_dashboard':
+        admin = driver.login(*ADMIN)
+        return [(admin, 'GET', '/admin_dashboard', None)] * count
+
+    if name == 'book_appointment':
+        pairs = list(zip(fixtures['bookers'], fixtures['free']))[:count]
+        jobs = []
+        for (patient_id, patient_name, email), (doctor_id, day, start) in pairs:
+            path = f'/book_appointment/{urllib.parse.quote(patient_name)}/{doctor_id}/{day}/{start}'
+            jobs.append((driver.login(email), 'POST', path, {}))
+        return jobs
+
+    pool = fixtures['with_history'] if name == 'view_patient_history' else patients
+    sessions = [(driver.login(email), patient_id, urllib.parse.quote(patient_name))
+                for patient_id, patient_name, email in pool]
+    doctors = fixtures['doctors']
+    jobs = []
+    for i in range(count):
+        session, patient_id, patient_name = sessions[i % len(sessions)]
+        if name == 'patient_dashboard':
+            path = f'/patient_dashboard/{patient_name}'
+        elif name == 'doctor_view':
+            path = f'/doctor/{doctors[i % len(doctors)]}/view/{patient_name}'
+        else:
+            path = f'/patient/{patient_name}/patient/{patient_id}/history'
+        jobs.append((session, 'GET', path, None))
+    return jobs
+
+
+def summarize(results, elapsed):
+    from instrumentation import percentile
+
+    latencies = sorted(seconds * 1000 for _, seconds, _ in results)
+    queries = [q for _, _, q in results if q is not None]
+    errors = sum(1 for status, _, _ in results if status == 0 or status >= 500)
+    report = {
+        'requests': len(results),
+        'errors': errors,
+        # a run of unexpected redirects usually means a login did not stick
+        'statuses': dict(sorted(Counter(str(status) for status, _, _ in results).items())),
+        'seconds': round(elapsed, 4),
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries),
+        } if queries else None,
+    }
+    return report
+
+
+def run_scenario(name, driver, fixtures, args):
+    jobs = build_jobs(name, driver, fixtures, args.requests)
+    if not jobs:
+        return None
+    # warm caches and connections (not for bookings, which use up slots)
+    if name != 'book_appointment':
+        driver.run(jobs[:args.warmup])
+    started = time.perf_counter()
+    results = driver.run(jobs)
+    return summarize(results, time.perf_counter() - started)
+
+
+# ------------------ Reporting ------------------
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Print p95 and throughput changes; True if no scenario regressed."""
+    ok = True
+    for name, now in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not now or not before:
+            continue
+        old_p95, new_p95 = before['latency_ms']['p95'], now['latency_ms']['p95']
+        change = (new_p95 - old_p95) / old_p95 if old_p95 else 0
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{name:22} p95 {old_p95:9.2f} -> {new_p95:9.2f} ms ({change:+.0%})  "
+              f"throughput {before['throughput_rps']} -> {now['throughput_rps']} rps"
+              f"{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help="database file from bench.datagen (bookings modify it)")
+    parser.add_argument('--driver', choices=['client', 'http'], default='client')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads (http driver)")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers to start (http driver)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help="benchmark an already running server instead of starting gunicorn")
+    parser.add_argument('-o', '--output', help="write the JSON report here (default: stdout)")
+    parser.add_argument('--baseline', help="earlier JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed p95 slowdown, default 0.2 = 20%%")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+    fixtures = load_fixtures(args.database, args.requests)
+
+    server = None
+    if args.driver == 'client':
+        # set before the app is imported
+        os.environ['HMS_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(args.database)
+        sys.path.insert(0, ROOT)
+        driver = ClientDriver()
+    else:
+        if not args.url:
+            server = start_gunicorn(args.database, args.workers, args.port)
+        driver = HttpDriver(args.url or f'http://127.0.0.1:{args.port}', args.concurrency)
+
+    booked_before = count_booked(args.database)
+    try:
+        scenarios = {}
+        for name in args.scenarios:
+            scenarios[name] = run_scenario(name, driver, fixtures, args)
+            print(f"{name}: done", file=sys.stderr)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if scenarios.get('book_appointment'):
+        scenarios['book_appointment']['booked'] = count_booked(args.database) - booked_before
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'driver': driver.name,
+        'concurrency': driver.concurrency,
+        'workers': args.workers if server else None,
+        'requests_per_scenario': args.requests,
+        'python': platform.python_version(),
+        'database': os.path.basename(args.database),
+        'scenarios': scenarios,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            return 0 if compare(json.load(f), report, args.threshold) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
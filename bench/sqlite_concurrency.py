@@ -0,0 +1,190 @@
+"""Mixed read/write throughput of SQLite with and without the engine tuning.
+
+For each mode a fresh database is generated with bench.datagen, then
+--processes worker processes run the app's own code paths for --seconds:
+reads load a patient's upcoming and past appointments (the patient
+dashboard queries), writes book an interval and cancel it again (two
+commits through the booking service). Runs once with HMS_SQLITE_TUNING=0
+(rollback journal, SQLite defaults) and once tuned (WAL, synchronous=NORMAL,
+busy_timeout, cache and mmap; see dbconfig.py) and prints a JSON report.
+
+    python -m bench.sqlite_concurrency
+    python -m bench.sqlite_concurrency --processes 16 --write-ratio 0.3 -o sqlite.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'default': '0',
+    'tuned': '1',
+}
+
+
+def worker(args):
+    index, jobs, patients, seconds, write_ratio, seed, start = args
+    from sqlalchemy.exc import OperationalError
+    from app import app
+    from models import db, Appointment
+    import booking
+    import queries
+
+    rng = random.Random(seed + index)
+    latencies = {'read': [], 'write': []}
+    outcomes = Counter()
+    today = date.today()
+
+    with app.app_context():
+        start.wait()
+        deadline = time.perf_counter() + seconds
+        position = 0
+        while time.perf_counter() < deadline:
+            kind = 'write' if jobs and rng.random() < write_ratio else 'read'
+            started = time.perf_counter()
+            try:
+                if kind == 'read':
+                    patient_id = rng.choice(patients)
+                    queries.patient_upcoming_appointments(patient_id, today)
+                    queries.patient_past_appointments(patient_id, today)
+                else:
+                    patient_id, doctor_id, day, start_time = jobs[position % len(jobs)]
+                    position += 1
+                    appointment = booking.book_appointment(patient_id, doctor_id, day, start_time)
+                    booking.cancel_appointment(db.session.get(Appointment, appointment.id))
+                outcomes[kind] += 1
+                latencies[kind].append(time.perf_counter() - started)
+            except booking.BookingError:
+                outcomes['refused'] += 1
+            except OperationalError:
+                # "database is locked": the busy timeout ran out
+                db.session.rollback()
+                outcomes['locked'] += 1
+            finally:
+                # like the end of a request: the connection goes back to the pool
+                db.session.remove()
+    return outcomes, latencies
+
+
+def generate(path, mode, args):
+    env = dict(os.environ, HMS_SQLITE_TUNING=MODES[mode])
+    subprocess.run([sys.executable, '-m', 'bench.datagen', path, '--doctors', str(args.doctors),
+                    '--patients', str(args.patients), '--appointments', str(args.appointments),
+                    '--seed', str(args.seed)],
+                   cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def load_jobs(path, processes):
+    """Per-process booking targets (own patient, own intervals) and the
+    patients to read."""
+    sys.path.insert(0, ROOT)
+    from bench.routes import load_fixtures
+
+    fixtures = load_fixtures(path, processes * 20)
+    free = [(doctor_id, date.fromisoformat(day), datetime.strptime(start, '%H:%M').time())
+            for doctor_id, day, start in fixtures['free']]
+    jobs = []
+    for i in range(processes):
+        if i < len(fixtures['bookers']):
+            patient_id = fixtures['bookers'][i][0]
+            jobs.append([(patient_id, *slot) for slot in free[i::processes]])
+        else:
+            jobs.append([])
+    return jobs, [p[0] for p in fixtures['patients']]
+
+
+def journal_mode(path, tuning):
+    script = ("from app import app, db\n"
+              "with app.app_context():\n"
+              "    print(db.session.execute(db.text('PRAGMA journal_mode')).scalar())")
+    env = dict(os.environ, HMS_DATABASE_URI='sqlite:///' + path, HMS_SQLITE_TUNING=tuning)
+    return subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def run_mode(mode, workdir, args):
+    from instrumentation import percentile
+
+    path = os.path.join(workdir, f'{mode}.db')
+    generate(path, mode, args)
+    jobs, patients = load_jobs(path, args.processes)
+
+    # inherited by the spawned workers
+    os.environ['HMS_DATABASE_URI'] = 'sqlite:///' + path
+    os.environ['HMS_SQLITE_TUNING'] = MODES[mode]
+
+    ctx = multiprocessing.get_context('spawn')
+    manager = ctx.Manager()
+    start = manager.Event()
+    with ctx.Pool(args.processes) as pool:
+        pending = pool.map_async(worker, [(i, jobs[i], patients, args.seconds, args.write_ratio, args.seed, start)
+                                          for i in range(args.processes)])
+        # give the workers time to import the app before starting the clock
+        time.sleep(2)
+        start.set()
+        results = pending.get()
+
+    outcomes = Counter()
+    latencies = {'read': [], 'write': []}
+    for worker_outcomes, worker_latencies in results:
+        outcomes.update(worker_outcomes)
+        for kind in latencies:
+            latencies[kind] += worker_latencies[kind]
+
+    report = {'journal_mode': journal_mode(path, MODES[mode]), 'outcomes': dict(outcomes)}
+    for kind, values in latencies.items():
+        values = sorted(v * 1000 for v in values)
+        report[kind] = {
+            'ops': len(values),
+            'ops_per_second': round(len(values) / args.seconds, 1),
+            'latency_ms': {f'p{int(p * 100)}': percentile(values, p) for p in (0.5, 0.95, 0.99)},
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="share of operations that book")
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--appointments', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=list(MODES))
+    parser.add_argument('-o', '--output', help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hms-sqlite-')
+    report = {
+        'processes': args.processes,
+        'seconds': args.seconds,
+        'write_ratio': args.write_ratio,
+        'modes': {},
+    }
+    for mode in args.modes:
+        report['modes'][mode] = result = run_mode(mode, workdir, args)
+        print(f"{mode:8} {result['journal_mode']:8} reads/s {result['read']['ops_per_second']:>8}  "
+              f"writes/s {result['write']['ops_per_second']:>7}  write p99 {result['write']['latency_ms']['p99']} ms  "
+              f"locked {result['outcomes'].get('locked', 0)}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+from datetime import date
+from sqlalchemy import update, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from models import db, Appointment, DoctorAvailability
+import events
+import slot_index
+import slots
+import stats
+
+# Appointment booking service.
+#
+# Booking never reads a slot and then writes it. The interval is claimed with
+# a conditional UPDATE that sets its bit in the window's booked_mask only if
+# the bit is still clear; the row count says whether we won. The partial
+# unique index on active appointments (uq_appointments_active_slot) rejects a
+# second 'booked' row for the same doctor/date/time even if two writers get
+# past the claim. Claiming first also takes SQLite's write lock, so the
+# same-day check below runs with no other booking in flight.
+
+
+class BookingError(Exception):
+    """Booking was refused; `message` is safe to show to the patient."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class SlotUnavailable(BookingError):
+    def __init__(self):
+        super().__init__("This slot has already been booked or is unavailable. Please choose another.")
+
+
+class PatientAlreadyBooked(BookingError):
+    def __init__(self):
+        super().__init__("You already have an appointment booked on this date with another doctor. "
+                         "Please choose a different day.")
+
+
+def find_window(doctor_id, slot_date, start_time):
+    """The availability window containing `start_time`, if any."""
+    return DoctorAvailability.query.filter(
+        DoctorAvailability.doctor_id == doctor_id,
+        DoctorAvailability.date == slot_date,
+        DoctorAvailability.start_time <= start_time,
+        DoctorAvailability.end_time > start_time,
+    ).first()
+
+
+def _update_mask(window, value, claim):
+    """Set (claim) or clear one interval bit, guarded on the window still
+    having the geometry the bit was computed from."""
+    conditions = [
+        DoctorAvailability.id == window.id,
+        DoctorAvailability.start_time == window.start_time,
+        DoctorAvailability.slot_minutes == window.slot_minutes,
+    ]
+    if claim:
+        conditions += [
+            DoctorAvailability.is_available == True,  # noqa: E712
+            DoctorAvailability.booked_mask.op('&')(value) == 0,
+        ]
+        new_mask = DoctorAvailability.booked_mask.op('|')(value)
+    else:
+        new_mask = DoctorAvailability.booked_mask.op('&')(~value)
+
+    return db.session.execute(
+        update(DoctorAvailability)
+        .where(*conditions)
+        .values(booked_mask=new_mask)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def book_appointment(patient_id, doctor_id, slot_date, start_time):
+    """Book the interval starting at `start_time` on `slot_date` and commit.
+
+    Returns the new Appointment, or raises a BookingError after rolling back."""
+    window = find_window(doctor_id, slot_date, start_time)
+    index = slots.interval_index(window, start_time) if window else None
+    if index is None or _update_mask(window, slots.bit(index), claim=True) != 1:
+        db.session.rollback()
+        raise SlotUnavailable()
+
+    # checking if the patient already has an appointment that day
+    patient_same_day = Appointment.query.filter_by(
+        patient_id=patient_id,
+        appointment_date=slot_date
+    ).filter(Appointment.status.in_(['booked', 'completed'])).first()
+    if patient_same_day:
+        db.session.rollback()
+        raise PatientAlreadyBooked()
+
+    appointment = Appointment(
+        patient_id=patient_id,
+        doctor_id=doctor_id,
+        appointment_date=slot_date,
+        appointment_time=start_time,
+        status='booked'
+    )
+    db.session.add(appointment)
+    stats.appointment_booked(doctor_id, slot_date)
+    event = events.record(doctor_id, slot_date, start_time, booked=True)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # another active booking holds this doctor/date/time
+        db.session.rollback()
+        raise SlotUnavailable()
+    slot_index.interval_booked(doctor_id, slot_date, index)
+    events.publish(event)
+    return appointment
+
+
+def release_interval(appointment):
+    """Free the interval held by an appointment (caller commits). Returns
+    the interval's index, or None if it is no longer in a window."""
+    window = find_window(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
+    index = slots.interval_index(window, appointment.appointment_time) if window else None
+    if index is not None:
+        _update_mask(window, slots.bit(index), claim=False)
+    return index
+
+
+def cancel_appointment(appointment):
+    """Cancel a booked appointment and reopen its interval."""
+    old_status = appointment.status
+    released = release_interval(appointment) if old_status == 'booked' else None
+    appointment.status = 'cancelled'
+    stats.appointment_status_changed(appointment, old_status)
+    event = None
+    if released is not None:
+        event = events.record(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time,
+                              booked=False)
+    db.session.commit()
+    if released is not None:
+        slot_index.interval_released(appointment.doctor_id, appointment.appointment_date, released)
+        events.publish(event)
+
+
+def release_booked(*criteria, today=None):
+    """Free the intervals held by the booked appointments from `today` on
+    that match `criteria`, ahead of deleting them (e.g. with their patient);
+    caller commits, then passes the result to intervals_released(). One
+    UPDATE per window touched."""
+    booked = db.session.execute(
+        select(Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time)
+        .where(*criteria, Appointment.status == 'booked', Appointment.appointment_date >= (today or date.today()))
+    ).all()
+    if not booked:
+        return []
+    windows = {
+        (window.doctor_id, window.date): window
+        for window in DoctorAvailability.query.filter(
+            tuple_(DoctorAvailability.doctor_id, DoctorAvailability.date).in_({(d, day) for d, day, _ in booked})
+        )
+    }
+    by_window = {}
+    for doctor_id, day, start_time in booked:
+        window = windows.get((doctor_id, day))
+        index = slots.interval_index(window, start_time) if window else None
+        if index is not None:
+            by_window.setdefault(window, []).append((start_time, index))
+
+    released = []
+    for window, intervals in by_window.items():
+        mask = 0
+        for _, index in intervals:
+            mask |= slots.bit(index)
+        if _update_mask(window, mask, claim=False):
+            released += [(window.doctor_id, window.date, start_time, index) for start_time, index in intervals]
+    recorded = events.record_many([(doctor_id, day, start_time, False) for doctor_id, day, start_time, _ in released])
+    return [(event, index) for event, (*_, index) in zip(recorded, released)]
+
+
+def intervals_released(released):
+    """After the commit: update the slot index and open booking pages."""
+    for event, index in released:
+        slot_index.interval_released(event.doctor_id, event.date, index)
+        events.publish(event)
+
+
+def complete_appointment(appointment):
+    old_status = appointment.status
+    appointment.status = 'completed'
+    stats.appointment_status_changed(appointment, old_status)
+    db.session.commit()
@@ -0,0 +1,325 @@
+"""Bulk import of departments, doctors, patients and availability windows.
+
+Streams a CSV or JSONL file, validates each row, and inserts valid rows in
+chunked transactions (one multi-row INSERT per table per chunk) instead of
+one ORM commit per row. Rejected rows are reported with their line number
+and reason, optionally written to a JSONL file.
+
+    python bulk_import.py departments departments.csv
+    python bulk_import.py doctors doctors.jsonl --chunk-size 5000
+    python bulk_import.py patients patients.csv --rejects rejected.jsonl
+    python bulk_import.py availability availability.csv
+
+Columns:
+    departments   department_name, description, slot_minutes
+    doctors       name, email, password, department, experience_years, slot_minutes
+    patients      name, email, password
+    availability  doctor_email, date (YYYY-MM-DD), start_time, end_time (HH:MM),
+                  is_available, slot_minutes
+
+Doctors whose department does not exist yet create it, like the add doctor
+form does. Duplicate emails (in the database or earlier in the file) are
+rejected, as are appointment lengths outside 5-240 minutes and windows of
+more than 63 appointments (the most a booking bitmap holds, see slots.py).
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert, select
+from app import app
+from models import db, User, Doctor, Patient, Department, DoctorAvailability
+import slots
+import stats
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class RowError(ValueError):
+    pass
+
+
+# ------------------ Reading ------------------
+def read_rows(path, fmt=None):
+    """Yield (line_number, row dict) from a CSV or JSONL file ('-' = stdin)."""
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'jsonl')
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    with stream:
+        if fmt == 'csv':
+            # line 1 is the header
+            for number, row in enumerate(csv.DictReader(stream), start=2):
+                yield number, row
+        else:
+            for number, line in enumerate(stream, start=1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError:
+                        yield number, {'__invalid__': line.rstrip('\n')}
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ------------------ Validation ------------------
+def required(row, field):
+    value = str(row.get(field) or '').strip()
+    if not value:
+        raise RowError(f"missing {field}")
+    return value
+
+
+def optional_int(row, field, minimum=0, maximum=None):
+    value = str(row.get(field) or '').strip()
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f"{field} is not a number")
+    if number < minimum:
+        raise RowError(f"{field} must be at least {minimum}")
+    if maximum is not None and number > maximum:
+        raise RowError(f"{field} must be at most {maximum}")
+    return number
+
+
+def slot_minutes_field(row):
+    return optional_int(row, 'slot_minutes', minimum=slots.MIN_SLOT_MINUTES, maximum=slots.MAX_SLOT_MINUTES)
+
+
+def email_field(row, seen_emails):
+    email = required(row, 'email').lower()
+    if '@' not in email:
+        raise RowError("invalid email")
+    if email in seen_emails:
+        raise RowError("email already registered")
+    return email
+
+
+def flag(row, field, default=True):
+    value = str(row.get(field) or '').strip().lower()
+    if not value:
+        return default
+    return value in ('1', 'true', 'yes', 'y', 'on')
+
+
+# ------------------ Importer ------------------
+class Importer:
+    """Holds the lookup maps loaded once per run and the counters."""
+
+    def __init__(self, conn, chunk_size=DEFAULT_CHUNK_SIZE, rejects=None):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.rejects = rejects
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.departments = {}  # department_name -> (id, slot_minutes)
+        self.emails = set()
+
+    def load_departments(self):
+        rows = self.conn.execute(select(Department.department_name, Department.id, Department.slot_minutes))
+        self.departments = {name: (dept_id, minutes) for name, dept_id, minutes in rows}
+
+    def load_emails(self):
+        self.emails = {email.lower() for email in self.conn.execute(select(User.user_email)).scalars()}
+
+    def reject(self, number, row, reason):
+        self.rejected += 1
+        if self.rejects:
+            self.rejects.write(json.dumps({'line': number, 'reason': reason, 'row': row}) + '\n')
+
+    def validate(self, rows, parse):
+        """Parse each row with `parse`, yielding only valid results."""
+        for number, row in rows:
+            self.read += 1
+            if '__invalid__' in row:
+                self.reject(number, row, "invalid JSON")
+                continue
+            try:
+                yield parse(row)
+            except RowError as e:
+                self.reject(number, row, str(e))
+
+    def run(self, rows, parse, write):
+        """Validate `rows` and hand them to `write` one chunk per transaction."""
+        for chunk in chunks(self.validate(rows, parse), self.chunk_size):
+            with self.conn.begin():
+                write(chunk)
+            self.inserted += len(chunk)
+
+    def ensure_departments(self, names):
+        """Create any departments in `names` not seen yet (caller's transaction)."""
+        new = sorted(set(names) - set(self.departments))
+        if new:
+            created = self.conn.execute(
+                insert(Department.__table__).returning(Department.id, Department.department_name,
+                                                       sort_by_parameter_order=True),
+                [{'department_name': name} for name in new]
+            )
+            for dept_id, name in created:
+                self.departments[name] = (dept_id, None)
+
+    def insert_users(self, rows, role):
+        """Insert users and return their ids in row order."""
+        result = self.conn.execute(
+            insert(User.__table__).returning(User.id, sort_by_parameter_order=True),
+            [{'user_name': r['name'], 'user_email': r['email'], 'user_password': r['password'],
+              'user_role': role} for r in rows]
+        )
+        return result.scalars().all()
+
+    # ---- departments ----
+    def parse_department(self, row):
+        name = required(row, 'department_name')
+        if name in self.departments:
+            raise RowError("department already exists")
+        self.departments[name] = None  # reserve against duplicates in the file
+        return {'department_name': name,
+                'description': (row.get('description') or '').strip() or None,
+                'slot_minutes': slot_minutes_field(row)}
+
+    def write_departments(self, rows):
+        created = self.conn.execute(
+            insert(Department.__table__).returning(Department.id, sort_by_parameter_order=True), rows
+        )
+        for dept_id, row in zip(created.scalars(), rows):
+            self.departments[row['department_name']] = (dept_id, row['slot_minutes'])
+
+    # ---- doctors / patients ----
+    def parse_person(self, row):
+        return {'name': required(row, 'name'), 'email': email_field(row, self.emails),
+                'password': required(row, 'password')}
+
+    def claim_email(self, person):
+        # only once the whole row is valid, so a rejected row does not block
+        # a later one with the same email
+        self.emails.add(person['email'])
+        return person
+
+    def parse_patient(self, row):
+        return self.claim_email(self.parse_person(row))
+
+    def parse_doctor(self, row):
+        person = self.parse_person(row)
+        person['department'] = required(row, 'department')
+        person['experience_years'] = optional_int(row, 'experience_years')
+        person['slot_minutes'] = slot_minutes_field(row)
+        return self.claim_email(person)
+
+    def write_doctors(self, rows):
+        self.ensure_departments(r['department'] for r in rows)
+        ids = self.insert_users(rows, 'doctor')
+        self.conn.execute(insert(Doctor.__table__), [
+            {'id': user_id, 'department_id': self.departments[r['department']][0],
+             'experience_years': r['experience_years'], 'slot_minutes': r['slot_minutes']}
+            for user_id, r in zip(ids, rows)
+        ])
+
+    def write_patients(self, rows):
+        ids = self.insert_users(rows, 'patient')
+        self.conn.execute(insert(Patient.__table__), [
+            {'id': user_id, 'patient_name': r['name']} for user_id, r in zip(ids, rows)
+        ])
+        stats.patients_registered(datetime.utcnow().date(), len(rows), executor=self.conn)
+
+    # ---- availability ----
+    def load_doctors(self):
+        rows = self.conn.execute(
+            select(User.user_email, Doctor.id, Doctor.slot_minutes, Department.slot_minutes)
+            .join(Doctor, Doctor.id == User.id)
+            .join(Department, Department.id == Doctor.department_id)
+        )
+        self.doctors = {email.lower(): (doctor_id, doctor_minutes or dept_minutes or slots.DEFAULT_SLOT_MINUTES)
+                        for email, doctor_id, doctor_minutes, dept_minutes in rows}
+        self.windows = set(self.conn.execute(select(DoctorAvailability.doctor_id, DoctorAvailability.date)))
+
+    def parse_window(self, row):
+        email = required(row, 'doctor_email').lower()
+        if email not in self.doctors:
+            raise RowError("unknown doctor")
+        doctor_id, slot_minutes = self.doctors[email]
+        try:
+            day = datetime.strptime(required(row, 'date'), '%Y-%m-%d').date()
+            start = datetime.strptime(required(row, 'start_time'), '%H:%M').time()
+            end = datetime.strptime(required(row, 'end_time'), '%H:%M').time()
+        except ValueError as e:
+            raise RowError(str(e))
+        if end <= start:
+            raise RowError("end_time must be after start_time")
+        slot_minutes = slot_minutes_field(row) or slot_minutes
+        error = slots.window_error(start, end, slot_minutes)
+        if error:
+            raise RowError(error)
+        if (doctor_id, day) in self.windows:
+            raise RowError("availability already exists for this doctor and date")
+        self.windows.add((doctor_id, day))
+        return {'doctor_id': doctor_id, 'date': day, 'start_time': start, 'end_time': end,
+                'is_available': flag(row, 'is_available'),
+                'slot_minutes': slot_minutes, 'booked_mask': 0}
+
+    def write_windows(self, rows):
+        self.conn.execute(insert(DoctorAvailability.__table__), rows)
+        stats.slots_offered([DoctorAvailability(**r) for r in rows], executor=self.conn)
+
+
+def import_file(kind, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, rejects=None):
+    """Import one file and return the Importer with its counters."""
+    with db.engine.connect() as conn:
+        importer = Importer(conn, chunk_size, rejects)
+        importer.load_departments()
+        if kind in ('doctors', 'patients'):
+            importer.load_emails()
+        if kind == 'availability':
+            importer.load_doctors()
+        # the first statement above opened a transaction; close it before chunking
+        conn.commit()
+
+        rows = read_rows(path, fmt)
+        parse, write = {
+            'departments': (importer.parse_department, importer.write_departments),
+            'doctors': (importer.parse_doctor, importer.write_doctors),
+            'patients': (importer.parse_patient, importer.write_patients),
+            'availability': (importer.parse_window, importer.write_windows),
+        }[kind]
+        importer.run(rows, parse, write)
+    return importer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=['departments', 'doctors', 'patients', 'availability'])
+    parser.add_argument('path', help="CSV or JSONL file, or - for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="defaults to the file extension")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument('--rejects', help="write rejected rows to this JSONL file")
+    args = parser.parse_args()
+
+    rejects = open(args.rejects, 'w', encoding='utf-8') if args.rejects else None
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            importer = import_file(args.kind, args.path, args.format, args.chunk_size, rejects)
+    finally:
+        if rejects:
+            rejects.close()
+    elapsed = time.perf_counter() - started
+
+    rate = importer.inserted / elapsed if elapsed else 0
+    print(f"{args.kind}: read {importer.read}, inserted {importer.inserted}, "
+          f"rejected {importer.rejected} in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return 1 if importer.rejected and not importer.inserted else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
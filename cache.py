@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Small in-process caches.
+#
+# Each gunicorn worker holds its own copy, so an invalidation only reaches
+# the worker that handled the write; the TTL bounds how long the other
+# workers can serve stale entries.
+
+# name -> cache, for the stats endpoint
+CACHES = {}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds
+    (ttl=None keeps them until evicted)."""
+
+    def __init__(self, name, maxsize=1024, ttl=300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Cached value for `key`, calling `loader()` on a miss. A loader
+        returning None (e.g. unknown id) is not cached."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key=_MISSING):
+        """Drop one key, or everything when called without a key."""
+        with self._lock:
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def all_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
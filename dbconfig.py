@@ -0,0 +1,108 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Engine settings for SQLite under gunicorn.
+#
+# Every new connection switches the database to WAL (readers no longer wait
+# for the writer and vice versa), relaxes fsync to synchronous=NORMAL (safe
+# in WAL mode: a power cut can lose the last commits but not corrupt the
+# file), waits up to busy_timeout for the write lock instead of failing with
+# "database is locked", and sizes the page cache and memory map.
+#
+# Each gunicorn worker process has its own engine and pool. The defaults are
+# sized for sync workers (one request at a time); raise HMS_POOL_SIZE for
+# threaded workers.
+#
+# Environment (defaults in brackets):
+#   HMS_DATABASE_URI            [sqlite:///hospital.db]
+#   HMS_REPLICA_URI             [none]  read replica, see routing.py
+#   HMS_SQLITE_TUNING           [1]  0 = plain SQLite defaults, for comparison
+#   HMS_SQLITE_BUSY_TIMEOUT_MS  [5000]
+#   HMS_SQLITE_SYNCHRONOUS      [NORMAL]
+#   HMS_SQLITE_CACHE_KIB        [65536]
+#   HMS_SQLITE_MMAP_BYTES       [268435456]
+#   HMS_POOL_SIZE               [5]
+#   HMS_MAX_OVERFLOW            [10]
+#   HMS_POOL_TIMEOUT            [30]
+#   HMS_POOL_RECYCLE            [-1]  seconds, -1 = never
+
+DEFAULT_URI = 'sqlite:///hospital.db'
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def database_uri():
+    return os.environ.get('HMS_DATABASE_URI', DEFAULT_URI)
+
+
+def replica_uri():
+    return os.environ.get('HMS_REPLICA_URI')
+
+
+def tuning_enabled():
+    return os.environ.get('HMS_SQLITE_TUNING', '1') != '0'
+
+
+def is_file_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`."""
+    if not is_file_sqlite(uri):
+        # in-memory SQLite uses a single-connection pool without these knobs
+        return {}
+    return {
+        'pool_size': _env_int('HMS_POOL_SIZE', 5),
+        'max_overflow': _env_int('HMS_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('HMS_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('HMS_POOL_RECYCLE', -1),
+    }
+
+
+def pragmas():
+    return [
+        'PRAGMA journal_mode = WAL',
+        f"PRAGMA synchronous = {os.environ.get('HMS_SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout = {_env_int('HMS_SQLITE_BUSY_TIMEOUT_MS', 5000)}",
+        # negative = KiB rather than pages
+        f"PRAGMA cache_size = -{_env_int('HMS_SQLITE_CACHE_KIB', 65536)}",
+        f"PRAGMA mmap_size = {_env_int('HMS_SQLITE_MMAP_BYTES', 268435456)}",
+    ]
+
+
+def install_pragmas(engine):
+    """Run the pragmas on each new DBAPI connection of `engine`."""
+    statements = pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def init_app(app, db):
+    """Configure the engine before db.init_app() and hook the pragmas after."""
+    uri = app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_uri())
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(uri))
+    db.init_app(app)
+    if tuning_enabled():
+        with app.app_context():
+            for engine in db.engines.values():
+                if is_file_sqlite(str(engine.url)):
+                    install_pragmas(engine)
+
+
+def dispose_after_fork(app, db):
+    """Drop connections inherited from the master process (gunicorn
+    --preload); each worker opens its own."""
+    with app.app_context():
+        db.engine.dispose(close=False)
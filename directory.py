@@ -0,0 +1,86 @@
+from collections import namedtuple
+from sqlalchemy import func
+from models import db, User, Doctor, Department
+from cache import TTLCache
+
+# Cached department and doctor directory for the patient pages.
+#
+# Entries are plain tuples rather than ORM objects so they can outlive the
+# session that loaded them. The admin write paths (add/edit/delete/blacklist
+# doctor) call invalidate(); the TTL covers the other workers.
+
+DepartmentEntry = namedtuple('DepartmentEntry', 'id department_name description slot_minutes')
+DoctorEntry = namedtuple('DoctorEntry', 'id name department_id department_name experience_years slot_minutes')
+
+_cache = TTLCache('directory', maxsize=4096, ttl=300)
+
+
+def _doctor_rows():
+    return (db.session.query(
+                Doctor.id, User.user_name, Doctor.department_id, Department.department_name,
+                Doctor.experience_years, Doctor.slot_minutes)
+            .join(User, Doctor.id == User.id)
+            .join(Department, Doctor.department_id == Department.id)
+            # blacklisted doctors are hidden from patients
+            .filter(User.user_role == 'doctor'))
+
+
+def _load_departments():
+    rows = (db.session.query(Department.id, Department.department_name,
+                             Department.description, Department.slot_minutes)
+            .order_by(Department.department_name))
+    return tuple(DepartmentEntry(*row) for row in rows)
+
+
+def _load_doctor(doctor_id):
+    row = _doctor_rows().filter(Doctor.id == doctor_id).first()
+    return DoctorEntry(*row) if row else None
+
+
+def _load_department_doctors(dept_id):
+    rows = _doctor_rows().filter(Doctor.department_id == dept_id).order_by(User.user_name)
+    doctors = tuple(DoctorEntry(*row) for row in rows)
+    for doctor in doctors:
+        _cache.set(('doctor', doctor.id), doctor)
+    return doctors
+
+
+def departments():
+    """All departments ordered by name."""
+    return _cache.get_or_load('departments', _load_departments)
+
+
+def department(dept_id):
+    return next((d for d in departments() if d.id == dept_id), None)
+
+
+def doctor(doctor_id):
+    """Profile of an active doctor, or None."""
+    return _cache.get_or_load(('doctor', doctor_id), lambda: _load_doctor(doctor_id))
+
+
+def department_doctors(dept_id):
+    return _cache.get_or_load(('department_doctors', dept_id), lambda: _load_department_doctors(dept_id))
+
+
+def _load_version():
+    departments = db.session.query(func.count(Department.id), func.max(Department.updated_at)).one()
+    doctors = (db.session.query(func.count(Doctor.id), func.max(Doctor.updated_at), func.max(User.updated_at))
+               .join(User, Doctor.id == User.id)
+               .filter(User.user_role == 'doctor')
+               .one())
+    return (*departments, *doctors)
+
+
+def version():
+    """Row counts and latest updated_at of the directory tables, cached
+    alongside the entries they describe (API ETags)."""
+    return _cache.get_or_load('version', _load_version)
+
+
+def invalidate():
+    _cache.invalidate()
+
+
+def stats():
+    return _cache.stats()
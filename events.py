@@ -0,0 +1,311 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert, select, delete
+from models import db, SlotEvent
+
+# Server-sent slot updates for the doctor booking page.
+#
+# A channel is one doctor on one date. When booking.py books or frees an
+# interval it records a SlotEvent row in the same transaction, and after the
+# commit publishes the event to this process's Broker, which hands it to
+# every open page subscribed to the channel. Pages connect to
+# /doctor/<id>/slots/events (see stream()) and mark the interval taken or
+# free without reloading.
+#
+# Other gunicorn workers (and the ASGI server) only see their own
+# publishes, so slot_events doubles as the cross-worker fan-out: a relay
+# thread in each process that has subscribers tails the table every
+# RELAY_SECONDS and publishes the rows written by other processes. It is a
+# local stand-in for a message bus such as Redis pub/sub. The row id is the
+# SSE event id, so a reconnecting page (Last-Event-ID) is replayed what it
+# missed from the table. Rows older than RETAIN_SECONDS are pruned by the
+# writes themselves (record()) and by the relay, at most every PRUNE_SECONDS
+# per process, so the table stays small whether or not anything subscribes.
+#
+# How long one request keeps the stream open (HMS_SSE_HOLD_SECONDS, default
+# 0) depends on the server. A sync worker cannot be tied up by an idle
+# page, so by default the response is just the replay and the browser
+# reconnects after RETRY_MS: a cheap indexed poll instead of a full page
+# reload. With threaded workers set it to e.g. 25. The async view in asgi.py
+# always holds the stream open.
+
+RELAY_SECONDS = 0.5
+STARTUP_SECONDS = 5
+RETAIN_SECONDS = 600
+PRUNE_SECONDS = 60
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+MAX_DAYS = 14
+
+Event = namedtuple('Event', 'id doctor_id date start booked')
+
+_settings = {'hold_seconds': 0}
+_pruned_at = None  # time.monotonic() of this process's last prune
+
+
+def _origin():
+    # per process; gunicorn forks after import
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# ------------------ Recording (booking.py) ------------------
+def record(doctor_id, day, start_time, booked):
+    """Write the event in the caller's transaction; publish() it after the
+    commit. Rolled back with the booking if that fails."""
+    maybe_prune()
+    start = start_time.strftime('%H:%M')
+    event_id = db.session.execute(
+        insert(SlotEvent)
+        .values(doctor_id=doctor_id, date=day, start=start, booked=booked, origin=_origin(),
+                created_at=datetime.utcnow())
+        .returning(SlotEvent.id)
+    ).scalar()
+    return Event(event_id, doctor_id, day, start, booked)
+
+
+def record_many(intervals):
+    """record() for several (doctor_id, day, start_time, booked) at once,
+    in one INSERT."""
+    if not intervals:
+        return []
+    maybe_prune()
+    origin = _origin()
+    now = datetime.utcnow()
+    rows = [{'doctor_id': doctor_id, 'date': day, 'start': start_time.strftime('%H:%M'), 'booked': booked,
+             'origin': origin, 'created_at': now}
+            for doctor_id, day, start_time, booked in intervals]
+    event_ids = db.session.execute(
+        insert(SlotEvent.__table__).returning(SlotEvent.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    return [Event(event_id, row['doctor_id'], row['date'], row['start'], row['booked'])
+            for event_id, row in zip(event_ids, rows)]
+
+
+def publish(event):
+    _broker.publish((event.doctor_id, event.date), event)
+
+
+# ------------------ Broker ------------------
+class Broker:
+    """In-process pub/sub. Subscribers pass a `deliver(event)` callback,
+    called on the publishing thread (so it must not block)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> {subscription id: deliver}
+        self._next_id = 0
+        self.published = 0
+
+    def subscribe(self, channels, deliver):
+        with self._lock:
+            self._next_id += 1
+            for channel in channels:
+                self._subscribers.setdefault(channel, {})[self._next_id] = deliver
+            return self._next_id
+
+    def unsubscribe(self, subscription, channels):
+        with self._lock:
+            for channel in channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.pop(subscription, None)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            delivers = list(self._subscribers.get(channel, {}).values())
+            self.published += 1
+        for deliver in delivers:
+            deliver(event)
+
+    def stats(self):
+        with self._lock:
+            return {'channels': len(self._subscribers),
+                    'subscriptions': len(set().union(*self._subscribers.values())),
+                    'published': self.published}
+
+
+_broker = Broker()
+
+
+# ------------------ Relay (cross-worker fan-out) ------------------
+class Relay:
+    """Tails slot_events and publishes other processes' rows locally."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.relayed = 0
+
+    def ensure_running(self):
+        """Start tailing from the newest event unless already running.
+        Threads do not survive a fork: one starts per process, on first use.
+        Returns once the starting point is read, so anything written after
+        the caller's replay is relayed."""
+        with self._lock:
+            if self._pid == os.getpid() or self.app is None:
+                return
+            self._pid = os.getpid()
+            started = threading.Event()
+            threading.Thread(target=self._run, args=(started,), name='slot-events-relay', daemon=True).start()
+            # the starting point is the server's, never a client's ?after=
+            started.wait(STARTUP_SECONDS)
+
+    def _run(self, started):
+        with self.app.app_context():
+            last_id = None
+            while True:
+                try:
+                    if last_id is None:
+                        last_id = latest_id()
+                        started.set()
+                    else:
+                        rows = db.session.execute(
+                            select(SlotEvent).where(SlotEvent.id > last_id).order_by(SlotEvent.id)
+                        ).scalars().all()
+                        origin = _origin()
+                        for row in rows:
+                            last_id = row.id
+                            # this process already published its own
+                            if row.origin != origin:
+                                self.relayed += 1
+                                self.broker.publish((row.doctor_id, row.date), _event(row))
+                        maybe_prune()
+                    db.session.commit()
+                except Exception:
+                    # the database may be locked for a moment; try again
+                    db.session.rollback()
+                finally:
+                    db.session.close()
+                time.sleep(RELAY_SECONDS)
+
+
+_relay = Relay(_broker)
+
+
+def prune():
+    cutoff = datetime.utcnow() - timedelta(seconds=RETAIN_SECONDS)
+    db.session.execute(delete(SlotEvent).where(SlotEvent.created_at < cutoff))
+
+
+def maybe_prune():
+    """prune() in the caller's transaction unless this process did so in
+    the last PRUNE_SECONDS."""
+    global _pruned_at
+    now = time.monotonic()
+    if _pruned_at is None or now - _pruned_at >= PRUNE_SECONDS:
+        _pruned_at = now
+        prune()
+
+
+def _event(row):
+    return Event(row.id, row.doctor_id, row.date, row.start, row.booked)
+
+
+# ------------------ Subscribing ------------------
+def channels(doctor_id, first_day, days):
+    return [(doctor_id, first_day + timedelta(days=i)) for i in range(days)]
+
+
+def subscribe(chans, deliver):
+    """Deliver new events on the channels. Subscribe before replaying from
+    the client's last event id: an event is then either replayed or
+    delivered (maybe both)."""
+    _relay.ensure_running()
+    return _broker.subscribe(chans, deliver)
+
+
+def unsubscribe(subscription, chans):
+    _broker.unsubscribe(subscription, chans)
+
+
+def latest_statement():
+    return select(db.func.coalesce(db.func.max(SlotEvent.id), 0))
+
+
+def latest_id():
+    """Id of the newest event; a page read after it streams from there."""
+    return db.session.execute(latest_statement()).scalar()
+
+
+def replay_statement(doctor_id, first_day, days, after):
+    """Events on the channels written after event id `after`."""
+    return (select(SlotEvent)
+            .where(SlotEvent.doctor_id == doctor_id, SlotEvent.id > after,
+                   SlotEvent.date.between(first_day, first_day + timedelta(days=days - 1)))
+            .order_by(SlotEvent.id))
+
+
+def stream_args(args, headers):
+    """(first day, days, after) from the query string and Last-Event-ID,
+    or None if they are malformed."""
+    try:
+        first_day = date.fromisoformat(args['from']) if args.get('from') else date.today()
+        days = min(max(int(args.get('days', 7)), 1), MAX_DAYS)
+        # the browser sends Last-Event-ID when it reconnects
+        after = int(headers.get('Last-Event-ID') or args.get('after') or 0)
+    except ValueError:
+        return None
+    return first_day, days, after
+
+
+# ------------------ SSE ------------------
+def format_event(event):
+    data = json.dumps({'date': event.date.isoformat(), 'start': event.start, 'booked': event.booked})
+    return f'id: {event.id}\nevent: slot\ndata: {data}\n\n'
+
+
+def preamble():
+    return f'retry: {RETRY_MS}\n\n'
+
+
+HEARTBEAT = ': keep-alive\n\n'
+
+
+def stream(doctor_id, first_day, days, after):
+    """SSE text for a sync worker: the missed events, then (if holding)
+    live ones until the hold time is up."""
+    hold = _settings['hold_seconds']
+    chans = channels(doctor_id, first_day, days)
+    inbox = queue.SimpleQueue()
+    subscription = subscribe(chans, inbox.put) if hold > 0 else None
+    try:
+        yield preamble()
+        replayed = set()
+        for row in db.session.execute(replay_statement(doctor_id, first_day, days, after)).scalars():
+            replayed.add(row.id)
+            yield format_event(_event(row))
+        # nothing else needs the connection while the stream is open
+        db.session.close()
+
+        deadline = time.monotonic() + hold
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                event = inbox.get(timeout=min(remaining, HEARTBEAT_SECONDS))
+            except queue.Empty:
+                yield HEARTBEAT
+                continue
+            # the replay may already have sent it
+            if event.id > after and event.id not in replayed:
+                yield format_event(event)
+    finally:
+        if subscription is not None:
+            unsubscribe(subscription, chans)
+
+
+def stats():
+    return dict(_broker.stats(), relayed=_relay.relayed, hold_seconds=_settings['hold_seconds'])
+
+
+def init_app(app):
+    _relay.app = app
+    _settings['hold_seconds'] = app.config.get('SSE_HOLD_SECONDS', _settings['hold_seconds'])
@@ -0,0 +1,189 @@
+"""Streaming export of appointments and patient history as CSV or NDJSON.
+
+Rows are read with a server-side cursor in batches (yield_per) and written
+out as they arrive, so memory stays flat and the first bytes go out
+immediately. Archived rows are included (see archive.py). Used by the admin
+export route and from the command line:
+
+    python export.py appointments --format csv --from 2025-01-01 --to 2025-03-31
+    python export.py history --format ndjson --department 2 -o history.ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+from models import db, User, Doctor, Department
+import archive
+
+BATCH_SIZE = 1000
+
+# rows per yielded chunk of output
+FLUSH_EVERY = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+DoctorUser = aliased(User)
+PatientUser = aliased(User)
+
+
+# ------------------ Queries ------------------
+def appointments_query(date_from=None, date_to=None, doctor_id=None, department_id=None):
+    appts = archive.all_appointments()
+    stmt = (select(
+                appts.c.id,
+                appts.c.appointment_date,
+                appts.c.appointment_time,
+                appts.c.status,
+                appts.c.doctor_id,
+                DoctorUser.user_name.label('doctor_name'),
+                Department.department_name.label('department'),
+                appts.c.patient_id,
+                PatientUser.user_name.label('patient_name'),
+                appts.c.created_at)
+            .join(Doctor, Doctor.id == appts.c.doctor_id)
+            .join(DoctorUser, DoctorUser.id == Doctor.id)
+            .join(Department, Department.id == Doctor.department_id)
+            .join(PatientUser, PatientUser.id == appts.c.patient_id)
+            .order_by(appts.c.appointment_date, appts.c.appointment_time, appts.c.id))
+
+    if date_from:
+        stmt = stmt.where(appts.c.appointment_date >= date_from)
+    if date_to:
+        stmt = stmt.where(appts.c.appointment_date <= date_to)
+    if doctor_id:
+        stmt = stmt.where(appts.c.doctor_id == doctor_id)
+    if department_id:
+        stmt = stmt.where(Doctor.department_id == department_id)
+    return stmt
+
+
+def history_query(date_from=None, date_to=None, doctor_id=None, department_id=None):
+    records = archive.all_history()
+    stmt = (select(
+                records.c.id,
+                records.c.created_at,
+                records.c.patient_id,
+                PatientUser.user_name.label('patient_name'),
+                records.c.doctor_id,
+                func.coalesce(records.c.doctor_name, DoctorUser.user_name).label('doctor_name'),
+                func.coalesce(records.c.department, Department.department_name).label('department'),
+                records.c.appointment_id,
+                records.c.visit_type,
+                records.c.test_type,
+                records.c.diagnosis,
+                records.c.treatment,
+                records.c.prescription)
+            .join(PatientUser, PatientUser.id == records.c.patient_id)
+            .outerjoin(Doctor, Doctor.id == records.c.doctor_id)
+            .outerjoin(DoctorUser, DoctorUser.id == Doctor.id)
+            .outerjoin(Department, Department.id == Doctor.department_id)
+            .order_by(records.c.created_at, records.c.id))
+
+    # created_at is a timestamp; compare on its date part
+    if date_from:
+        stmt = stmt.where(func.date(records.c.created_at) >= date_from.isoformat())
+    if date_to:
+        stmt = stmt.where(func.date(records.c.created_at) <= date_to.isoformat())
+    if doctor_id:
+        stmt = stmt.where(records.c.doctor_id == doctor_id)
+    if department_id:
+        stmt = stmt.where(Doctor.department_id == department_id)
+    return stmt
+
+
+QUERIES = {
+    'appointments': appointments_query,
+    'history': history_query,
+}
+
+
+def stream_rows(stmt):
+    """Yield the column names, then each row, from a dedicated connection
+    using a server-side cursor; the connection is released when the
+    generator ends."""
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=BATCH_SIZE).execute(stmt)
+        yield list(result.keys())
+        yield from result
+
+
+# ------------------ Formats ------------------
+def _text(value):
+    if value is None:
+        return ''
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(rows))
+    # the header goes out before the first batch is fetched
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_text(v) for v in row])
+        if count % FLUSH_EVERY == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(rows):
+    columns = next(rows)
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, (_text(v) for v in row)))))
+        if len(lines) >= FLUSH_EVERY:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+WRITERS = {
+    'csv': to_csv,
+    'ndjson': to_ndjson,
+}
+
+
+def export(kind, fmt, **filters):
+    """Generator of text chunks for an export of `kind` in format `fmt`."""
+    return WRITERS[fmt](stream_rows(QUERIES[kind](**filters)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=sorted(QUERIES))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat)
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat)
+    parser.add_argument('--doctor', dest='doctor_id', type=int)
+    parser.add_argument('--department', dest='department_id', type=int)
+    parser.add_argument('-o', '--output', help="defaults to stdout")
+    args = parser.parse_args()
+
+    from app import app
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        with app.app_context():
+            for chunk in export(args.kind, args.format, date_from=args.date_from, date_to=args.date_to,
+                                doctor_id=args.doctor_id, department_id=args.department_id):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
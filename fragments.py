@@ -0,0 +1,43 @@
+from flask import current_app
+from cache import TTLCache
+
+# Cache for rendered template fragments.
+#
+# A template wraps an expensive block (a listing row with its modals, a
+# sidebar) in a call block keyed by what the block shows:
+#
+#     {% call cached_fragment('admin_doctor_row', doctor.id, stamp(doctor, doctor.user, doctor.department)) %}
+#         ...
+#     {% endcall %}
+#
+# and the rendered HTML is reused until the key changes. stamp() is the
+# updated_at of each row the block reads, which every write path bumps
+# (see models.py), so an edit produces a new key and the old entry simply
+# ages out of the LRU; nothing has to be deleted on write, in this worker
+# or any other. The key must cover everything the block depends on, e.g.
+# the username in its links; loop counters belong outside the block.
+#
+# Nothing is cached in debug mode, where templates reload on change.
+
+_cache = TTLCache('fragments', maxsize=20000, ttl=3600)
+
+
+def stamp(*rows):
+    """Version of the rows a fragment shows, for its cache key."""
+    return tuple(row.updated_at for row in rows)
+
+
+def cached_fragment(name, *key, caller):
+    """Jinja call block: the body's HTML, rendered at most once per key."""
+    if current_app.debug:
+        return caller()
+    html = _cache.get((name,) + key)
+    if html is None:
+        html = caller()
+        _cache.set((name,) + key, html)
+    return html
+
+
+def init_app(app):
+    app.add_template_global(cached_fragment)
+    app.add_template_global(stamp)
@@ -0,0 +1,12 @@
+# Picked up by `gunicorn app:app` when run from this directory.
+#
+# With --preload the app (and its engine) is created in the master before
+# forking; drop any pooled connections so each worker opens its own.
+
+
+def post_fork(server, worker):
+    from app import app
+    from models import db
+    import dbconfig
+
+    dbconfig.dispose_after_fork(app, db)
@@ -0,0 +1,159 @@
+"""Patient history read model.
+
+History records carry the doctor's name and department as of the visit,
+filled in when the record is written, so the timeline never has to join
+back to doctors and users. patient_history_summary keeps one row per
+patient for the header of the history page: visits in total and per visit
+type, the last visit, and the active prescriptions (the latest one from
+each doctor who prescribed something). The summary is recomputed for a
+patient whenever their history changes, in the same transaction. Both read
+the archived records too (see archive.py).
+
+If the summaries drift (manual edits, a restored backup), rebuild them:
+
+    python history.py
+"""
+import argparse
+import json
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import select, text
+from models import db, PatientHistorySummary
+import archive
+import directory
+import queries
+
+PAGE_SIZE = 20
+
+Summary = namedtuple('Summary', 'visits visit_counts last_visit_at last_diagnosis last_doctor_name '
+                                'active_prescriptions')
+
+EMPTY_SUMMARY = Summary(0, {}, None, None, None, [])
+
+# One statement for any set of patients: `where` selects their history rows,
+# hot and archived.
+_COLUMNS = 'id, patient_id, doctor_id, visit_type, diagnosis, prescription, doctor_name, created_at'
+
+_SUMMARIZE = f"""
+    WITH scoped AS (
+        SELECT {_COLUMNS} FROM patient_history WHERE {{where}}
+        UNION ALL
+        SELECT {_COLUMNS} FROM patient_history_archive WHERE {{where}}
+    ),
+    ranked AS (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY created_at DESC, id DESC) AS recency
+        FROM scoped
+    ),
+    counts AS (
+        SELECT patient_id, SUM(n) AS visits, json_group_object(visit_type, n) AS visit_counts
+        FROM (SELECT patient_id, COALESCE(NULLIF(visit_type, ''), 'Other') AS visit_type, COUNT(*) AS n
+              FROM scoped GROUP BY 1, 2)
+        GROUP BY patient_id
+    ),
+    prescribed AS (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY patient_id, doctor_id ORDER BY created_at DESC, id DESC)
+                      AS per_doctor
+        FROM scoped WHERE COALESCE(prescription, '') != ''
+    ),
+    prescriptions AS (
+        SELECT patient_id,
+               json_group_array(json_object('prescription', prescription, 'doctor', doctor_name,
+                                            'date', date(created_at))) AS active
+        FROM (SELECT * FROM prescribed WHERE per_doctor = 1 ORDER BY patient_id, created_at DESC, id DESC)
+        GROUP BY patient_id
+    )
+    INSERT INTO patient_history_summary (patient_id, visits, visit_counts, last_visit_at, last_diagnosis,
+                                         last_doctor_name, active_prescriptions, updated_at)
+    SELECT r.patient_id, c.visits, c.visit_counts, r.created_at, r.diagnosis, r.doctor_name,
+           COALESCE(p.active, '[]'), :now
+    FROM ranked r
+    JOIN counts c ON c.patient_id = r.patient_id
+    LEFT JOIN prescriptions p ON p.patient_id = r.patient_id
+    WHERE r.recency = 1
+"""
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+# ------------------ Writing ------------------
+def fill_doctor_fields(record):
+    """Copy the doctor's current name and department onto a new record."""
+    doctor = directory.doctor(record.doctor_id)
+    if doctor:
+        record.doctor_name = doctor.name
+        record.department = doctor.department_name
+
+
+def refresh(patient_id, executor=None):
+    """Recompute one patient's summary (caller commits)."""
+    executor = executor or db.session
+    executor.execute(text("DELETE FROM patient_history_summary WHERE patient_id = :patient_id"),
+                     {'patient_id': patient_id})
+    executor.execute(text(_SUMMARIZE.format(where='patient_id = :patient_id')),
+                     {'patient_id': patient_id, 'now': _now()})
+
+
+def refresh_many(patient_ids, executor=None):
+    """refresh() for a set of patients, in two statements."""
+    executor = executor or db.session
+    params = {'patient_ids': json.dumps(sorted(patient_ids))}
+    where = 'patient_id IN (SELECT value FROM json_each(:patient_ids))'
+    executor.execute(text(f"DELETE FROM patient_history_summary WHERE {where}"), params)
+    executor.execute(text(_SUMMARIZE.format(where=where)), dict(params, now=_now()))
+
+
+def rebuild(conn):
+    """Recompute every summary from patient_history (caller's transaction)."""
+    conn.exec_driver_sql("DELETE FROM patient_history_summary")
+    conn.execute(text(_SUMMARIZE.format(where='true')), {'now': _now()})
+
+
+def backfill_doctor_fields(conn):
+    """Fill doctor_name and department on records written without them."""
+    conn.exec_driver_sql("""
+        UPDATE patient_history SET
+            doctor_name = COALESCE(NULLIF(doctor_name, ''),
+                                   (SELECT u.user_name FROM users u WHERE u.id = patient_history.doctor_id)),
+            department = COALESCE(NULLIF(department, ''),
+                                  (SELECT dept.department_name FROM doctors d
+                                   JOIN departments dept ON dept.id = d.department_id
+                                   WHERE d.id = patient_history.doctor_id))
+        WHERE COALESCE(doctor_name, '') = '' OR COALESCE(department, '') = ''
+    """)
+
+
+# ------------------ Reading ------------------
+def summary(patient_id):
+    row = db.session.get(PatientHistorySummary, patient_id)
+    if row is None:
+        return EMPTY_SUMMARY
+    counts = json.loads(row.visit_counts)
+    return Summary(row.visits, dict(sorted(counts.items(), key=lambda item: -item[1])), row.last_visit_at,
+                   row.last_diagnosis, row.last_doctor_name, json.loads(row.active_prescriptions))
+
+
+def timeline(patient_id, cursor=None):
+    """Page of a patient's history records (hot and archived), newest first."""
+    records = archive.all_history()
+    stmt = queries.keyset_statement(select(records).where(records.c.patient_id == patient_id),
+                                    (records.c.created_at, records.c.id), (datetime, int),
+                                    cursor, descending=True, page_size=PAGE_SIZE)
+    return queries.make_page(db.session.execute(stmt).all(), lambda record: (record.created_at, record.id),
+                             PAGE_SIZE)
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+
+    from app import app
+    with app.app_context(), db.engine.begin() as conn:
+        backfill_doctor_fields(conn)
+        rebuild(conn)
+        patients = conn.exec_driver_sql("SELECT COUNT(*) FROM patient_history_summary").scalar()
+    print(f"Rebuilt history summaries for {patients} patients.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+from collections import namedtuple
+from functools import wraps
+from flask import g, session, flash, redirect, url_for
+from models import db, User
+from cache import TTLCache
+
+# Request-scoped current user.
+#
+# login() stores the user id in the session. Before each request the id is
+# resolved to a small Identity through a per-worker cache, so routes know who
+# is calling without querying users by name. Doctor and Patient share their
+# primary key with User, so identity.id is also the profile id.
+#
+# Writes that change a user's name or role call invalidate(user_id); the
+# short TTL bounds how long other workers keep the old role (e.g. after a
+# blacklist).
+
+Identity = namedtuple('Identity', 'id name role')
+
+_cache = TTLCache('identity', maxsize=10000, ttl=60)
+
+
+def _load(user_id):
+    row = db.session.query(User.id, User.user_name, User.user_role).filter(User.id == user_id).first()
+    return Identity(*row) if row else None
+
+
+def get_identity(user_id):
+    return _cache.get_or_load(user_id, lambda: _load(user_id))
+
+
+def load_current_identity():
+    """before_request hook: resolve the session's user into g.identity."""
+    user_id = session.get('user_id')
+    g.identity = get_identity(user_id) if user_id is not None else None
+
+
+def current_identity():
+    return g.get('identity')
+
+
+def invalidate(user_id=None):
+    if user_id is None:
+        _cache.invalidate()
+    else:
+        _cache.invalidate(user_id)
+
+
+def role_required(*roles):
+    """Only let logged-in users with one of `roles` through; everyone else
+    is sent to the login page."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            identity = current_identity()
+            if identity is None or identity.role not in roles:
+                flash("Please log in to continue.", "danger")
+                return redirect(url_for('login'))
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
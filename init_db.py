@@ -1,9 +1,10 @@
 from app import app, db
 from models import User
+from migrate import initialize
 
-# Create tables and default admin
+# Create or migrate tables and default admin
 with app.app_context():
-    db.create_all()
+    initialize()
     
     # Create default admin if not exists
     admin = User.query.filter_by(user_role='admin').first()
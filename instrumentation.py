@@ -0,0 +1,234 @@
+import logging
+import math
+import threading
+import time
+from collections import deque, namedtuple, defaultdict
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request profiling.
+#
+# When enabled (HMS_PROFILING=1) every request records its wall time, the
+# number and total time of SQL statements (engine events), template render
+# time and response size. The last RING_SIZE requests are kept in a ring
+# buffer for percentiles; per-endpoint totals are kept for the Prometheus
+# counters. Requests slower than HMS_SLOW_REQUEST_MS are logged to
+# 'hms.slow' with their SQL.
+#
+# When disabled, init_app() registers nothing, so requests and queries run
+# exactly as without this module.
+
+log = logging.getLogger('hms.slow')
+
+RING_SIZE = 5000
+
+# statements kept per request for the slow log
+MAX_LOGGED_STATEMENTS = 50
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+Sample = namedtuple('Sample', 'endpoint status seconds sql_count sql_seconds template_seconds response_bytes')
+
+
+class Profile:
+    """Counters for the request in flight, kept on flask.g."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statements = []  # (seconds, sql), for the slow log
+        self._template_started = []
+
+
+class Recorder:
+    """Ring buffer of recent samples plus cumulative per-endpoint totals."""
+
+    def __init__(self, size=RING_SIZE):
+        self.samples = deque(maxlen=size)
+        self.totals = defaultdict(lambda: [0, 0.0, 0, 0.0, 0.0, 0])
+        self.statuses = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, sample):
+        with self._lock:
+            self.samples.append(sample)
+            totals = self.totals[sample.endpoint]
+            totals[0] += 1
+            totals[1] += sample.seconds
+            totals[2] += sample.sql_count
+            totals[3] += sample.sql_seconds
+            totals[4] += sample.template_seconds
+            totals[5] += sample.response_bytes
+            self.statuses[sample.endpoint, sample.status] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.samples), {k: list(v) for k, v in self.totals.items()}, dict(self.statuses)
+
+
+recorder = Recorder()
+settings = {'enabled': False, 'slow_seconds': 0.5}
+
+
+# ------------------ Hooks ------------------
+def _profile():
+    return g.get('_profile') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's execution context rather than the pooled
+    # connection, so a statement that raises (and never reaches
+    # after_cursor_execute) leaves nothing behind
+    if context is not None and _profile() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _profile()
+    started = getattr(context, '_profile_started', None)
+    if profile is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    profile.sql_count += 1
+    profile.sql_seconds += elapsed
+    if len(profile.statements) < MAX_LOGGED_STATEMENTS:
+        profile.statements.append((elapsed, statement))
+
+
+def _before_render(sender, template, context, **extra):
+    profile = _profile()
+    if profile is not None:
+        profile._template_started.append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    profile = _profile()
+    if profile is not None and profile._template_started:
+        started = profile._template_started.pop()
+        # nested renders (includes via render_template) count once
+        if not profile._template_started:
+            profile.template_seconds += time.perf_counter() - started
+
+
+def _start_request():
+    g._profile = Profile()
+
+
+def _finish_request(response):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return response
+    elapsed = time.perf_counter() - profile.started
+    # streamed responses have no length up front
+    size = response.content_length or 0
+    endpoint = request.endpoint or 'unmatched'
+    recorder.add(Sample(endpoint, response.status_code, elapsed, profile.sql_count,
+                        profile.sql_seconds, profile.template_seconds, size))
+
+    if elapsed >= settings['slow_seconds']:
+        statements = '\n'.join(f"  {seconds * 1000:8.1f} ms  {sql}"
+                               for seconds, sql in sorted(profile.statements, reverse=True))
+        log.warning("slow request %s %s (%s): %.0f ms, %d SQL statements in %.0f ms, templates %.0f ms\n%s",
+                    request.method, request.path, endpoint, elapsed * 1000, profile.sql_count,
+                    profile.sql_seconds * 1000, profile.template_seconds * 1000, statements)
+    return response
+
+
+def init_app(app):
+    """Register the profiling hooks if app.config['PROFILING'] is set."""
+    settings['enabled'] = bool(app.config.get('PROFILING'))
+    settings['slow_seconds'] = app.config.get('SLOW_REQUEST_MS', 500) / 1000
+    if not settings['enabled']:
+        return
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+
+# ------------------ Reports ------------------
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def _quantiles(values):
+    values = sorted(values)
+    return {f'p{int(p * 100)}': percentile(values, p) for p in PERCENTILES}
+
+
+def summary():
+    """Per-endpoint percentiles over the ring buffer, slowest p95 first."""
+    if not settings['enabled']:
+        return {'enabled': False}
+
+    samples, totals, _ = recorder.snapshot()
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample.endpoint].append(sample)
+
+    endpoints = []
+    for endpoint, rows in by_endpoint.items():
+        endpoints.append({
+            'endpoint': endpoint,
+            'requests': totals[endpoint][0],
+            'window': len(rows),
+            'seconds': _quantiles(s.seconds for s in rows),
+            'sql_count': _quantiles(s.sql_count for s in rows),
+            'sql_seconds': _quantiles(s.sql_seconds for s in rows),
+            'template_seconds': _quantiles(s.template_seconds for s in rows),
+            'response_bytes': _quantiles(s.response_bytes for s in rows),
+        })
+    endpoints.sort(key=lambda e: e['seconds']['p95'], reverse=True)
+    return {'enabled': True, 'window': len(samples), 'endpoints': endpoints}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus():
+    """Prometheus text exposition of the counters and request-time quantiles."""
+    samples, totals, statuses = recorder.snapshot()
+    lines = []
+
+    def metric(name, kind, help_text, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in values:
+            label_text = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value}')
+
+    metric('hms_requests_total', 'counter', 'Requests by endpoint and status.',
+           [({'endpoint': e, 'status': s}, n) for (e, s), n in sorted(statuses.items())])
+
+    durations = defaultdict(list)
+    for sample in samples:
+        durations[sample.endpoint].append(sample.seconds)
+    quantiles = []
+    for endpoint, values in sorted(durations.items()):
+        values.sort()
+        quantiles += [({'endpoint': endpoint, 'quantile': p}, percentile(values, p)) for p in PERCENTILES]
+    metric('hms_request_duration_seconds', 'summary',
+           'Request wall time; quantiles over the most recent requests.', quantiles)
+    lines += [f'hms_request_duration_seconds_sum{{endpoint="{_label(e)}"}} {t[1]}' for e, t in sorted(totals.items())]
+    lines += [f'hms_request_duration_seconds_count{{endpoint="{_label(e)}"}} {t[0]}' for e, t in sorted(totals.items())]
+
+    for index, name, help_text in (
+        (2, 'hms_sql_statements_total', 'SQL statements executed.'),
+        (3, 'hms_sql_seconds_total', 'Time spent executing SQL.'),
+        (4, 'hms_template_seconds_total', 'Time spent rendering templates.'),
+        (5, 'hms_response_bytes_total', 'Response body bytes (streamed responses not counted).'),
+    ):
+        metric(name, 'counter', help_text, [({'endpoint': e}, t[index]) for e, t in sorted(totals.items())])
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,243 @@
+import json
+import random
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import update, select
+from models import (db, User, Doctor, Patient, Appointment, DoctorAvailability, PatientHistory, Job,
+                    SlotEvent, WeeklySchedule, AvailabilityException, ArchivedAppointment, ArchivedHistory)
+import booking
+import directory
+import history
+import identity
+import stats
+
+# Background jobs kept in the `jobs` table.
+#
+# Request handlers enqueue() a job and commit; worker.py processes claim due
+# jobs one at a time with a conditional UPDATE (so two workers never take the
+# same job) and run the registered handler. The handler's changes and the
+# job's 'succeeded' status are committed together, so a crash mid-job leaves
+# nothing half-applied and the job is simply retried. Failures are retried
+# with exponential backoff until max_attempts, then marked 'failed'.
+#
+# A job left 'running' for longer than LEASE (its worker died) goes back to
+# the queue.
+
+HANDLERS = {}
+
+# callbacks for after the running job's commit, see after_commit()
+_after_commit = []
+
+BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 600
+LEASE = timedelta(minutes=10)
+
+
+def handler(kind):
+    """Register a function as the handler for jobs of `kind`. It is called
+    with the job's payload as keyword arguments inside the worker's session
+    and must not commit (see after_commit()); its return value is stored as
+    the job's result."""
+    def decorator(function):
+        HANDLERS[kind] = function
+        return function
+    return decorator
+
+
+def after_commit(callback):
+    """Call `callback()` once the running job's changes are committed,
+    e.g. to publish what it changed; dropped if the job fails."""
+    _after_commit.append(callback)
+
+
+def enqueue(kind, max_attempts=5, delay=None, **payload):
+    """Add a job to the session (the caller commits) and return it."""
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind {kind!r}")
+    job = Job(kind=kind, payload=json.dumps(payload), max_attempts=max_attempts,
+              run_at=datetime.utcnow() + (delay or timedelta()))
+    db.session.add(job)
+    return job
+
+
+def describe(job):
+    """Status of a job for polling."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_at': job.run_at.isoformat() if job.run_at else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'last_error': job.last_error,
+        'result': json.loads(job.result) if job.result else None,
+    }
+
+
+# ------------------ Worker side ------------------
+def requeue_stale():
+    """Put jobs whose worker disappeared back in the queue."""
+    count = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.started_at < datetime.utcnow() - LEASE)
+        .values(status='queued', locked_by=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def claim(worker_id):
+    """Take the oldest due job, or return None if there is none."""
+    now = datetime.utcnow()
+    oldest_due = (select(Job.id)
+                  .where(Job.status == 'queued', Job.run_at <= now)
+                  .order_by(Job.run_at, Job.id)
+                  .limit(1)
+                  .scalar_subquery())
+    job_id = db.session.execute(
+        update(Job)
+        # re-checked so a job taken by another worker in between is skipped
+        .where(Job.id == oldest_due, Job.status == 'queued')
+        .values(status='running', locked_by=worker_id, started_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    db.session.commit()
+    return db.session.get(Job, job_id) if job_id else None
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    # jitter so failed jobs do not all come back at once
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run(job):
+    """Run a claimed job and record the outcome."""
+    _after_commit.clear()
+    try:
+        result = HANDLERS[job.kind](**json.loads(job.payload))
+        job.status = 'succeeded'
+        job.result = json.dumps(result)
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = traceback.format_exc(limit=5)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + backoff(job.attempts)
+        job.locked_by = None
+        db.session.commit()
+    else:
+        while _after_commit:
+            _after_commit.pop(0)()
+    finally:
+        _after_commit.clear()
+    return job
+
+
+# ------------------ Handlers ------------------
+# Deletes run set-based over IN lists of up to CHUNK ids, so removing a
+# thousand accounts costs a few dozen statements (see admin_batch.py).
+CHUNK = 500
+
+
+def chunks(ids, size=CHUNK):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _existing(column, ids):
+    return {row_id for chunk in chunks(ids) for row_id in db.session.scalars(select(column).where(column.in_(chunk)))}
+
+
+def _delete(model, column, chunk):
+    return model.query.filter(column.in_(chunk)).delete(synchronize_session=False)
+
+
+@handler('delete_doctors')
+def delete_doctors(doctor_ids):
+    """Delete doctors with everything that refers to them, archived rows
+    included. Returns the ids deleted and not found."""
+    found = _existing(Doctor.id, doctor_ids)
+    patient_ids = set()
+    appointments = 0
+    for chunk in chunks(sorted(found)):
+        # Remove dependent rows first (stats, histories, appointments, availability)
+        stats.doctors_removed(chunk)
+        for model in (PatientHistory, ArchivedHistory):
+            patient_ids.update(db.session.scalars(select(model.patient_id).where(model.doctor_id.in_(chunk))
+                                                  .distinct()))
+            _delete(model, model.doctor_id, chunk)
+        for model in (Appointment, ArchivedAppointment):
+            appointments += _delete(model, model.doctor_id, chunk)
+        for model in (DoctorAvailability, SlotEvent, WeeklySchedule, AvailabilityException):
+            _delete(model, model.doctor_id, chunk)
+        _delete(Doctor, Doctor.id, chunk)
+        _delete(User, User.id, chunk)
+    history.refresh_many(patient_ids)
+
+    # only this worker's caches; the web workers' expire with their TTL
+    directory.invalidate()
+    for doctor_id in found:
+        identity.invalidate(doctor_id)
+    return {'deleted': sorted(found), 'not_found': sorted(set(doctor_ids) - found), 'appointments': appointments}
+
+
+@handler('delete_patients')
+def delete_patients(patient_ids):
+    """Delete patients with their appointments and history, archived rows
+    included. Returns the ids deleted and not found."""
+    found = _existing(Patient.id, patient_ids)
+    appointments = 0
+    released = []
+    for chunk in chunks(sorted(found)):
+        # reopen their upcoming intervals for other patients
+        released += booking.release_booked(Appointment.patient_id.in_(chunk))
+        stats.appointments_removed(Appointment.patient_id.in_(chunk))
+        stats.appointments_removed(ArchivedAppointment.patient_id.in_(chunk), model=ArchivedAppointment)
+        for model in (PatientHistory, ArchivedHistory):
+            _delete(model, model.patient_id, chunk)
+        for model in (Appointment, ArchivedAppointment):
+            appointments += _delete(model, model.patient_id, chunk)
+        _delete(Patient, Patient.id, chunk)
+        _delete(User, User.id, chunk)
+    # with no history left this just drops the summaries
+    history.refresh_many(found)
+
+    for patient_id in found:
+        identity.invalidate(patient_id)
+    after_commit(lambda: booking.intervals_released(released))
+    return {'deleted': sorted(found), 'not_found': sorted(set(patient_ids) - found), 'appointments': appointments}
+
+
+@handler('delete_doctor')
+def delete_doctor(doctor_id):
+    result = delete_doctors([doctor_id])
+    if not result['deleted']:
+        return {'deleted': False}
+    return {'deleted': True, 'appointments': result['appointments']}
+
+
+@handler('delete_patient')
+def delete_patient(patient_id):
+    result = delete_patients([patient_id])
+    if not result['deleted']:
+        return {'deleted': False}
+    return {'deleted': True, 'appointments': result['appointments']}
+
+
+@handler('rebuild_stats')
+def rebuild_stats():
+    stats.rebuild(db.session.connection())
+    return {'rebuilt': True}
@@ -0,0 +1,268 @@
+"""Versioned schema migrations for an existing hospital.db.
+
+`db.create_all()` only creates missing tables, so changes to existing tables
+(new indexes, new columns) are applied here. The schema version is kept in
+SQLite's `PRAGMA user_version`; each migration runs once, in order, inside
+one transaction.
+
+    python migrate.py             # upgrade to the latest version
+    python migrate.py --explain   # check that the hot queries use indexes
+"""
+import sys
+from datetime import datetime
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from app import app
+from models import db
+from slots import DEFAULT_SLOT_MINUTES
+import archive
+import history
+import search
+import stats
+
+
+# ------------------ Migrations ------------------
+def create_indexes(conn, *names):
+    """Create the named indexes as declared on the models."""
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def create_tables(conn, *names):
+    """Create the named tables (and their indexes) as declared on the models."""
+    for name in names:
+        db.metadata.tables[name].create(conn, checkfirst=True)
+
+
+def add_columns(conn, table_name, *names):
+    """ALTER TABLE ... ADD COLUMN for columns declared on the models."""
+    table = db.metadata.tables[table_name]
+    existing = {c['name'] for c in inspect(conn).get_columns(table_name)}
+    for name in names:
+        if name not in existing:
+            ddl = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f'ALTER TABLE {table_name} ADD COLUMN {ddl}')
+
+
+def add_lookup_indexes(conn):
+    create_indexes(
+        conn,
+        'ix_users_name_role',
+        'ix_doctors_department',
+        'ix_appointments_doctor_slot',
+        'ix_appointments_patient_date',
+        'ix_appointments_date_time',
+        'ix_availability_doctor_date_start',
+        'ix_history_patient_created',
+    )
+
+
+def add_active_slot_constraint(conn):
+    # Fails (and rolls back) if the table already holds double bookings;
+    # those have to be resolved by hand before upgrading.
+    create_indexes(conn, 'uq_appointments_active_slot')
+
+
+def add_slot_intervals(conn):
+    add_columns(conn, 'departments', 'slot_minutes')
+    add_columns(conn, 'doctors', 'slot_minutes')
+    add_columns(conn, 'doctor_availability', 'slot_minutes', 'booked_mask')
+
+    conn.exec_driver_sql(
+        'UPDATE doctor_availability SET slot_minutes = ? WHERE slot_minutes IS NULL',
+        (DEFAULT_SLOT_MINUTES,)
+    )
+    # Windows used to be closed by their single booking. Reopen them, keeping
+    # the first interval taken if that booking is still active or done.
+    conn.exec_driver_sql("""
+        UPDATE doctor_availability
+        SET is_available = 1,
+            booked_mask = CASE WHEN EXISTS (
+                SELECT 1 FROM appointments a
+                WHERE a.doctor_id = doctor_availability.doctor_id
+                  AND a.appointment_date = doctor_availability.date
+                  AND a.appointment_time = doctor_availability.start_time
+                  AND a.status IN ('booked', 'completed')
+            ) THEN 1 ELSE 0 END
+        WHERE is_available = 0 AND EXISTS (
+            SELECT 1 FROM appointments a
+            WHERE a.doctor_id = doctor_availability.doctor_id
+              AND a.appointment_date = doctor_availability.date
+              AND a.appointment_time = doctor_availability.start_time
+        )
+    """)
+
+
+def add_search_index(conn):
+    search.create_search_index(conn)
+    search.rebuild_search_index(conn)
+
+
+def add_stats_rollups(conn):
+    # rebuild() reads the archive tables (migration 11) too
+    create_tables(conn, 'doctor_day_stats', 'registration_stats', *archive.TABLES)
+    stats.rebuild(conn)
+
+
+def add_jobs_table(conn):
+    create_tables(conn, 'jobs')
+
+
+def add_weekly_schedules(conn):
+    create_tables(conn, 'weekly_schedules', 'availability_exceptions')
+    # Fails (and rolls back) if a doctor has two windows on one day; merge
+    # those by hand before upgrading.
+    create_indexes(conn, 'uq_availability_doctor_date')
+
+
+def add_updated_at(conn):
+    # existing rows start from created_at where the table has one
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+    for table in ('users', 'departments', 'doctors', 'patients', 'doctor_availability',
+                  'appointments', 'patient_history'):
+        add_columns(conn, table, 'updated_at')
+        initial = 'created_at' if 'created_at' in db.metadata.tables[table].c else 'NULL'
+        conn.exec_driver_sql(
+            f'UPDATE {table} SET updated_at = COALESCE({initial}, ?) WHERE updated_at IS NULL', (now,)
+        )
+
+
+def add_history_read_model(conn):
+    # rebuild() reads the archive tables (migration 11) too
+    create_tables(conn, 'patient_history_summary', *archive.TABLES)
+    history.backfill_doctor_fields(conn)
+    history.rebuild(conn)
+
+
+def add_slot_events(conn):
+    create_tables(conn, 'slot_events')
+
+
+def add_archive_tables(conn):
+    create_tables(conn, *archive.TABLES)
+
+
+# (version, description, function) - append new migrations at the end
+MIGRATIONS = [
+    (1, 'composite indexes for the hot lookup columns', add_lookup_indexes),
+    (2, 'unique index on active appointment slots', add_active_slot_constraint),
+    (3, 'fixed-length bookable intervals with a per-window bitmap', add_slot_intervals),
+    (4, 'full-text search index over doctors, departments and patients', add_search_index),
+    (5, 'rollup tables for the admin statistics page', add_stats_rollups),
+    (6, 'background job queue', add_jobs_table),
+    (7, 'recurring weekly schedules and exceptions', add_weekly_schedules),
+    (8, 'updated_at stamps for API ETags', add_updated_at),
+    (9, 'patient history summaries and denormalized doctor fields', add_history_read_model),
+    (10, 'slot change events for the live booking page', add_slot_events),
+    (11, 'archive tables for old appointments and history', add_archive_tables),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def set_version(conn, version):
+    conn.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def upgrade():
+    """Apply every migration newer than the database's version."""
+    with db.engine.begin() as conn:
+        version = current_version(conn)
+        for number, description, migration in MIGRATIONS:
+            if number > version:
+                print(f"Applying migration {number}: {description}")
+                migration(conn)
+                set_version(conn, number)
+                version = number
+    return version
+
+
+def initialize():
+    """Create tables for a new database, or migrate an existing one."""
+    fresh = not inspect(db.engine).has_table('users')
+    db.create_all()
+    if fresh:
+        # create_all already built the latest schema
+        with db.engine.begin() as conn:
+            set_version(conn, LATEST_VERSION)
+        return LATEST_VERSION
+    return upgrade()
+
+
+# ------------------ Query plan check ------------------
+# Representative forms of the queries the routes run on every request.
+HOT_QUERIES = {
+    'user by name and role':
+        "SELECT id FROM users WHERE user_name = 'x' AND user_role = 'doctor'",
+    'booked slot check':
+        "SELECT id FROM appointments WHERE doctor_id = 1 AND appointment_date = '2025-01-01' "
+        "AND appointment_time = '09:00:00.000000' AND status = 'booked'",
+    'doctor upcoming appointments':
+        "SELECT id FROM appointments WHERE doctor_id = 1 AND appointment_date >= '2025-01-01' "
+        "AND status = 'booked' ORDER BY appointment_date, appointment_time",
+    'patient appointments by date':
+        "SELECT id FROM appointments WHERE patient_id = 1 AND appointment_date = '2025-01-01'",
+    'appointment keyset page':
+        "SELECT id FROM appointments WHERE (appointment_date, appointment_time, id) > "
+        "('2025-01-01', '09:00:00.000000', 1) "
+        "ORDER BY appointment_date, appointment_time, id LIMIT 51",
+    'availability slot':
+        "SELECT id FROM doctor_availability WHERE doctor_id = 1 AND date = '2025-01-01' "
+        "AND start_time = '09:00:00.000000'",
+    'patient history':
+        "SELECT id FROM patient_history WHERE patient_id = 1 ORDER BY created_at DESC, id DESC LIMIT 21",
+    'doctors in department':
+        "SELECT id FROM doctors WHERE department_id = 1",
+    'doctor exceptions':
+        "SELECT id FROM availability_exceptions WHERE doctor_id = 1 AND date >= '2025-01-01' ORDER BY date",
+    'next due job':
+        "SELECT id FROM jobs WHERE status = 'queued' AND run_at <= '2025-01-01 00:00:00' "
+        "ORDER BY run_at, id LIMIT 1",
+    'stats date range':
+        "SELECT day, SUM(booked) FROM doctor_day_stats WHERE day BETWEEN '2025-01-01' AND '2025-01-31' "
+        "GROUP BY day",
+    'archive candidates':
+        "SELECT id FROM appointments WHERE appointment_date < '2025-01-01' AND id < 1000 "
+        "ORDER BY appointment_date, appointment_time LIMIT 500",
+    'archived patient history':
+        "SELECT id FROM patient_history_archive WHERE patient_id = 1 ORDER BY created_at DESC, id DESC LIMIT 21",
+    'slot events replay':
+        "SELECT id FROM slot_events WHERE doctor_id = 1 AND id > 10 "
+        "AND date BETWEEN '2025-01-01' AND '2025-01-07' ORDER BY id",
+}
+
+
+def plan_uses_index(plan):
+    """A plan is acceptable if no step is a full table scan or a sort."""
+    for detail in plan:
+        if detail.startswith('SCAN') and 'INDEX' not in detail:
+            return False
+        if 'TEMP B-TREE' in detail:
+            return False
+    return True
+
+
+def explain_hot_queries():
+    ok = True
+    with db.engine.connect() as conn:
+        for name, sql in HOT_QUERIES.items():
+            plan = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+            good = plan_uses_index(plan)
+            ok = ok and good
+            print(f"[{'ok' if good else 'SCAN'}] {name}")
+            for detail in plan:
+                print(f"       {detail}")
+    return ok
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        if '--explain' in sys.argv[1:]:
+            sys.exit(0 if explain_hot_queries() else 1)
+        version = upgrade()
+        print(f"Database schema is at version {version}.")
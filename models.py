@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from routing import RoutingSession
 
-# Creating the database
-db = SQLAlchemy()
+# Creating the database (db.session routes read-only views to the replica, see routing.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # ------------------ Model Users (Base Class) ------------------
 class User(db.Model):
@@ -14,6 +15,12 @@ class User(db.Model):
     user_password = db.Column(db.String(200), nullable=False)
     user_role = db.Column(db.String(20), nullable=False)  
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
+
+    __table_args__ = (
+        # doctor/patient routes look users up by name and role
+        db.Index('ix_users_name_role', 'user_name', 'user_role'),
+    )
 
     # Relationships (one-to-one with Doctor and Patient)
     doctor_profile = db.relationship('Doctor', back_populates='user', uselist=False)
@@ -26,6 +33,8 @@ class Department(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     department_name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
+    slot_minutes = db.Column(db.Integer)  # appointment length for the department, see slots.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
 
     # Relationships
     doctors = db.relationship('Doctor', back_populates='department', lazy=True)
@@ -37,6 +46,12 @@ class Doctor(db.Model):
     id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
     department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False)
     experience_years = db.Column(db.Integer)
+    slot_minutes = db.Column(db.Integer)  # overrides the department's appointment length
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
+
+    __table_args__ = (
+        db.Index('ix_doctors_department', 'department_id'),
+    )
 
     # Relationships
     user = db.relationship('User', back_populates='doctor_profile')
@@ -51,6 +66,7 @@ class Patient(db.Model):
 
     id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
     patient_name = db.Column(db.String(100), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
 
     # Relationships
     user = db.relationship('User', back_populates='patient_profile')
@@ -68,6 +84,19 @@ class Appointment(db.Model):
     appointment_time = db.Column(db.Time, nullable=False)
     status = db.Column(db.String(20), default='booked')  # booked, completed, cancelled
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
+
+    __table_args__ = (
+        # slot checks and the doctor dashboard
+        db.Index('ix_appointments_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_time', 'status'),
+        # patient dashboard and the one-appointment-per-day check
+        db.Index('ix_appointments_patient_date', 'patient_id', 'appointment_date'),
+        # keyset pagination of the admin listings
+        db.Index('ix_appointments_date_time', 'appointment_date', 'appointment_time'),
+        # at most one active booking per doctor/date/time
+        db.Index('uq_appointments_active_slot', 'doctor_id', 'appointment_date', 'appointment_time',
+                 unique=True, sqlite_where=db.text("status = 'booked'")),
+    )
 
     # Relationships
     patient = db.relationship('Patient', back_populates='appointments')
@@ -93,6 +122,11 @@ class PatientHistory(db.Model):
     department = db.Column(db.String(100))      
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
+
+    __table_args__ = (
+        db.Index('ix_history_patient_created', 'patient_id', 'created_at'),
+    )
 
     # Relationships
     patient = db.relationship('Patient', back_populates='medical_history')
@@ -100,6 +134,20 @@ class PatientHistory(db.Model):
     appointment = db.relationship('Appointment', back_populates='history_record')
 
 
+# ------------------ Patient History Read Model (see history.py) ------------------
+class PatientHistorySummary(db.Model):
+    __tablename__ = 'patient_history_summary'
+
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+    visit_counts = db.Column(db.Text, nullable=False, default='{}')  # JSON: visit type -> visits
+    last_visit_at = db.Column(db.DateTime)
+    last_diagnosis = db.Column(db.Text)
+    last_doctor_name = db.Column(db.String(100))
+    active_prescriptions = db.Column(db.Text, nullable=False, default='[]')  # JSON, newest first
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # ------------------ Doctor Availability Model ------------------
 class DoctorAvailability(db.Model):
     __tablename__ = 'doctor_availability'
@@ -110,6 +158,156 @@ class DoctorAvailability(db.Model):
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
     is_available = db.Column(db.Boolean, default=True)
+    slot_minutes = db.Column(db.Integer)  # interval length, frozen when the window is created
+    booked_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bit i = interval i booked
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # API ETags, see api.py
+
+    __table_args__ = (
+        db.Index('ix_availability_doctor_date_start', 'doctor_id', 'date', 'start_time'),
+        # one window per doctor per day; also the conflict target of the rollout upsert
+        db.Index('uq_availability_doctor_date', 'doctor_id', 'date', unique=True),
+    )
     
     # Relationship
-    doctor = db.relationship('Doctor', back_populates='availability_slots')
\ No newline at end of file
+    doctor = db.relationship('Doctor', back_populates='availability_slots')
+
+# ------------------ Recurring Schedule Models (see schedules.py) ------------------
+class WeeklySchedule(db.Model):
+    __tablename__ = 'weekly_schedules'
+
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday, as date.weekday()
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+
+    __table_args__ = (
+        db.Index('uq_weekly_schedules_doctor_weekday', 'doctor_id', 'weekday', unique=True),
+    )
+
+
+class AvailabilityException(db.Model):
+    __tablename__ = 'availability_exceptions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    # both empty = the doctor is away that day; otherwise the day's hours
+    start_time = db.Column(db.Time)
+    end_time = db.Column(db.Time)
+    reason = db.Column(db.String(200))
+
+    __table_args__ = (
+        db.Index('uq_availability_exceptions_doctor_date', 'doctor_id', 'date', unique=True),
+    )
+
+# ------------------ Rollup Models (see stats.py) ------------------
+class DoctorDayStats(db.Model):
+    __tablename__ = 'doctor_day_stats'
+
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    booked = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    cancelled = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    slots_offered = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # the stats page reads a date range across all doctors
+        db.Index('ix_doctor_day_stats_day', 'day'),
+    )
+
+
+class RegistrationStats(db.Model):
+    __tablename__ = 'registration_stats'
+
+    week_start = db.Column(db.Date, primary_key=True)  # Monday
+    patients = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+# ------------------ Background Job Model (see jobs.py) ------------------
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # not before
+    locked_by = db.Column(db.String(100))
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # workers claim the oldest due job
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+# ------------------ Slot Event Model (see events.py) ------------------
+class SlotEvent(db.Model):
+    __tablename__ = 'slot_events'
+
+    id = db.Column(db.Integer, primary_key=True)  # also the SSE event id
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    start = db.Column(db.String(5), nullable=False)  # HH:MM of the interval
+    booked = db.Column(db.Boolean, nullable=False)
+    origin = db.Column(db.String(100), nullable=False)  # process that wrote it
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # replay after Last-Event-ID for one doctor's page
+        db.Index('ix_slot_events_doctor_id', 'doctor_id', 'id'),
+        db.Index('ix_slot_events_created', 'created_at'),
+    )
+
+
+# ------------------ Archive Models (see archive.py) ------------------
+# Same columns as appointments and patient_history; rows keep their ids.
+class ArchivedAppointment(db.Model):
+    __tablename__ = 'appointments_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    appointment_date = db.Column(db.Date, nullable=False)
+    appointment_time = db.Column(db.Time, nullable=False)
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_appointments_archive_patient_date', 'patient_id', 'appointment_date'),
+        db.Index('ix_appointments_archive_doctor_date', 'doctor_id', 'appointment_date'),
+        # export order
+        db.Index('ix_appointments_archive_date_time', 'appointment_date', 'appointment_time'),
+    )
+
+
+class ArchivedHistory(db.Model):
+    __tablename__ = 'patient_history_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments_archive.id'), unique=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'))
+    visit_type = db.Column(db.String(50))
+    test_type = db.Column(db.String(100))
+    diagnosis = db.Column(db.Text)
+    treatment = db.Column(db.Text)
+    prescription = db.Column(db.Text)
+    doctor_name = db.Column(db.String(100))
+    department = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_history_archive_patient_created', 'patient_id', 'created_at'),
+        db.Index('ix_history_archive_doctor', 'doctor_id'),
+    )
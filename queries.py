@@ -0,0 +1,225 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, User, Doctor, Patient, Appointment, DoctorAvailability
+import search
+
+# Listing queries used by the dashboards.
+# Every listing eagerly loads the relationships its template walks
+# (patient.user, doctor.user, doctor.department), so a page costs a fixed
+# number of SELECTs no matter how many rows it shows.
+#
+# Long listings are paged with keyset cursors instead of OFFSET: the cursor
+# holds the sort key of the last row shown and the next page starts with a
+# "(key columns) > (cursor)" range condition, so page 500 costs the same as
+# page 1.
+
+PAGE_SIZE = 50
+
+Page = namedtuple('Page', 'items next_cursor')
+
+
+# ------------------ Keyset cursors ------------------
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, time)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """Turn a cursor back into key values, or None if it is missing or
+    malformed (a bad cursor just shows the first page)."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(types):
+            return None
+        return [t.fromisoformat(v) if t in (date, datetime, time) else t(v) for t, v in zip(types, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_statement(query, columns, types, cursor=None, descending=False, page_size=PAGE_SIZE):
+    """`query` (a Query or a select()) limited to the page after `cursor`,
+    one row longer than the page so make_page() can tell if more follow."""
+    after = decode_cursor(cursor, types)
+    if after is not None:
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*after))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*after))
+
+    order = [c.desc() for c in columns] if descending else list(columns)
+    return query.order_by(*order).limit(page_size + 1)
+
+
+def make_page(rows, key, page_size=PAGE_SIZE):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(key(rows[-1]))
+    return Page(rows, next_cursor)
+
+
+def keyset_page(query, columns, key, types, cursor=None, descending=False, page_size=PAGE_SIZE):
+    """Fetch one page of `query` ordered by `columns`.
+
+    `key(row)` returns the sort key of a row, `types` the Python type of each
+    key column (used to decode the cursor)."""
+    rows = keyset_statement(query, columns, types, cursor, descending, page_size).all()
+    return make_page(rows, key, page_size)
+
+
+APPOINTMENT_KEY_COLUMNS = (Appointment.appointment_date, Appointment.appointment_time, Appointment.id)
+APPOINTMENT_KEY_TYPES = (date, time, int)
+
+
+def appointment_key(appt):
+    return (appt.appointment_date, appt.appointment_time, appt.id)
+
+
+def appointment_page(query, cursor=None, descending=False):
+    return keyset_page(query, APPOINTMENT_KEY_COLUMNS, appointment_key,
+                       APPOINTMENT_KEY_TYPES, cursor, descending)
+
+
+def id_page(query, column, cursor=None):
+    return keyset_page(query, (column,), lambda row: (row.id,), (int,), cursor)
+
+
+# ------------------ Loader options ------------------
+def doctor_listing_options():
+    return (
+        joinedload(Doctor.user),
+        joinedload(Doctor.department),
+    )
+
+
+def patient_listing_options():
+    return (joinedload(Patient.user),)
+
+
+def appointment_listing_options():
+    return (
+        joinedload(Appointment.patient).joinedload(Patient.user),
+        joinedload(Appointment.doctor).joinedload(Doctor.user),
+        joinedload(Appointment.doctor).joinedload(Doctor.department),
+        # one-to-one from the other side; selectin keeps the LIMIT on the main query
+        selectinload(Appointment.history_record),
+    )
+
+
+# ------------------ Admin dashboard listings ------------------
+def admin_doctors(search_query='', cursor=None):
+    """Page of doctors with their user and department rows, optionally
+    filtered by a full-text search on name and department."""
+    query = Doctor.query.options(*doctor_listing_options())
+
+    if search_query:
+        found = search.matches(search.DOCTOR, search_query)
+        if found is None:
+            return Page([], None)
+        query = query.filter(Doctor.id.in_(select(found.c.id)))
+
+    return id_page(query, Doctor.id, cursor)
+
+
+def admin_patients(search_query='', cursor=None):
+    """Page of patients with their user rows, optionally filtered by a
+    full-text search on name."""
+    query = Patient.query.options(*patient_listing_options())
+
+    if search_query:
+        found = search.matches(search.PATIENT, search_query)
+        if found is None:
+            return Page([], None)
+        query = query.filter(Patient.id.in_(select(found.c.id)))
+
+    return id_page(query, Patient.id, cursor)
+
+
+def search_doctors_statement(search_query='', dept_id=None):
+    """search_doctors() as a select(), or None if nothing can match."""
+    stmt = (select(Doctor)
+            .join(User, Doctor.id == User.id)
+            .options(*doctor_listing_options())
+            .where(User.user_role == 'doctor'))
+
+    if search_query:
+        found = search.matches(search.DOCTOR, search_query)
+        if found is None:
+            return None
+        stmt = stmt.join(found, Doctor.id == found.c.id).order_by(found.c.rank)
+    else:
+        stmt = stmt.order_by(User.user_name)
+    if dept_id:
+        stmt = stmt.where(Doctor.department_id == dept_id)
+
+    return stmt.limit(search.SEARCH_LIMIT)
+
+
+def search_doctors(search_query='', dept_id=None):
+    """Active doctors for the patient search box, best matches first."""
+    stmt = search_doctors_statement(search_query, dept_id)
+    return db.session.scalars(stmt).all() if stmt is not None else []
+
+
+def upcoming_appointments(today, cursor=None):
+    query = (Appointment.query
+             .options(*appointment_listing_options())
+             .filter(Appointment.appointment_date >= today))
+    return appointment_page(query, cursor)
+
+
+def all_appointments(cursor=None):
+    query = Appointment.query.options(*appointment_listing_options())
+    return appointment_page(query, cursor)
+
+
+# ------------------ Patient dashboard listings ------------------
+# Built as select() statements so the async views (asgi.py) run the same
+# queries; the functions below execute them on db.session.
+def patient_upcoming_statement(patient_id, today):
+    return (select(Appointment)
+            .options(*appointment_listing_options())
+            .where(Appointment.patient_id == patient_id,
+                   Appointment.appointment_date >= today,
+                   Appointment.status == 'booked')
+            .order_by(Appointment.appointment_date, Appointment.appointment_time))
+
+
+def patient_past_statement(patient_id, today, cursor=None):
+    """Past appointments, newest first, one keyset page (see make_page())."""
+    stmt = (select(Appointment)
+            .options(*appointment_listing_options())
+            .where(Appointment.patient_id == patient_id,
+                   (Appointment.appointment_date < today) |
+                   Appointment.status.in_(['completed', 'cancelled'])))
+    return keyset_statement(stmt, APPOINTMENT_KEY_COLUMNS, APPOINTMENT_KEY_TYPES, cursor, descending=True)
+
+
+def patient_upcoming_appointments(patient_id, today):
+    return db.session.scalars(patient_upcoming_statement(patient_id, today)).all()
+
+
+def patient_past_appointments(patient_id, today, cursor=None):
+    """Page of past appointments, newest first."""
+    rows = db.session.scalars(patient_past_statement(patient_id, today, cursor)).all()
+    return make_page(rows, appointment_key)
+
+
+# ------------------ Doctor page ------------------
+def next_days(count, today=None):
+    today = today or date.today()
+    return [today + timedelta(days=i) for i in range(count)]
+
+
+def doctor_windows_statement(doctor_id, days):
+    """The doctor's availability windows on `days`, in time order."""
+    return (select(DoctorAvailability)
+            .where(DoctorAvailability.doctor_id == doctor_id, DoctorAvailability.date.in_(days))
+            .order_by(DoctorAvailability.date, DoctorAvailability.start_time))
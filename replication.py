@@ -0,0 +1,52 @@
+"""Local stand-in for a read replica: copies the primary SQLite database onto
+the replica file (HMS_REPLICA_URI) with SQLite's online backup API, once or
+every --interval seconds. Readers of the replica keep seeing the previous
+copy until each backup finishes.
+
+    HMS_REPLICA_URI=sqlite:///replica.db python replication.py --interval 1
+
+Keep the interval below HMS_REPLICA_STICKY_SECONDS so users never read a
+replica older than their own last write.
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from app import app
+from models import db
+import routing
+
+
+def sync(primary_path, replica_path):
+    """Copy the primary onto the replica in one backup step."""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interval', type=float, help="keep syncing every N seconds (default: sync once)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if routing.REPLICA not in db.engines:
+            parser.error("HMS_REPLICA_URI is not set")
+        primary = db.engines[None].url.database
+        replica = db.engines[routing.REPLICA].url.database
+
+    while True:
+        started = time.perf_counter()
+        sync(primary, replica)
+        print(f"synced {primary} -> {replica} in {(time.perf_counter() - started) * 1000:.0f} ms", flush=True)
+        if not args.interval:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
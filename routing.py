@@ -0,0 +1,88 @@
+import time
+from functools import wraps
+from flask import g, session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# Read/write routing between the primary database and a read replica.
+#
+# When HMS_REPLICA_URI is set the app gets a second engine under the bind key
+# 'replica'. Views marked @read_only send their queries there; everything
+# else, and any flush or INSERT/UPDATE/DELETE, goes to the primary.
+#
+# A replica lags the primary, so after a user's own write their reads stay on
+# the primary for STICKY_SECONDS (read-your-writes): the time of the last
+# write is kept in their session cookie. The window must be longer than the
+# replication interval (see replication.py).
+
+REPLICA = 'replica'
+
+STICKY_SECONDS = 5
+
+
+def replica_allowed():
+    if not has_request_context() or not g.get('read_only'):
+        return False
+    return time.time() - session.get('wrote_at', 0) > STICKY_SECONDS
+
+
+class RoutingSession(Session):
+    """db.session class that picks the replica for read-only views."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        writing = self._flushing or getattr(clause, 'is_dml', False)
+        if bind is None and not writing and replica_allowed():
+            replica = self._db.engines.get(REPLICA)
+            if replica is not None:
+                return replica
+        if writing and has_request_context():
+            g.wrote = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Let the view's queries use the replica (if one is configured)."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.pop('read_only', None)
+    return wrapped
+
+
+def remember_write(response):
+    """after_request hook: start the read-your-writes window."""
+    if g.pop('wrote', False):
+        session['wrote_at'] = time.time()
+    return response
+
+
+def binds(replica_uri):
+    """SQLALCHEMY_BINDS for an optional replica."""
+    return {REPLICA: replica_uri} if replica_uri else {}
+
+
+def init_app(app, db):
+    """Mark replica connections query-only and register the write hook
+    (after db.init_app)."""
+    global STICKY_SECONDS
+    STICKY_SECONDS = app.config.get('REPLICA_STICKY_SECONDS', STICKY_SECONDS)
+    app.after_request(remember_write)
+
+    with app.app_context():
+        replica = db.engines.get(REPLICA)
+    if replica is not None:
+        install_query_only(replica)
+
+
+def install_query_only(engine):
+    @event.listens_for(engine, 'connect')
+    def _query_only(dbapi_connection, connection_record):
+        # a stray write on the replica fails instead of diverging
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('PRAGMA query_only = ON')
+        finally:
+            cursor.close()
@@ -0,0 +1,164 @@
+"""Roll recurring weekly schedules out into availability windows.
+
+Each doctor keeps a weekly schedule (hours per weekday) and dated
+exceptions (a day away, or different hours that day). The rollout turns
+them into DoctorAvailability windows for the next --days days with one
+set-based upsert per batch of doctors, so doctors no longer re-enter their
+week by hand. Run it daily (cron) to keep the window rolling:
+
+    python schedules.py
+    python schedules.py --days 90 --batch-size 1000
+    python schedules.py --doctor 12     # one doctor only
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from models import db, WeeklySchedule
+import slots
+import stats
+
+# For each doctor with a schedule, the days of the range fall on a weekday
+# they work (weekly_schedules.weekday is Monday = 0 like date.weekday();
+# SQLite's %w is Sunday = 0). An exception replaces that day's hours, or
+# closes it when it has none.
+#
+# Existing windows are updated in place, except that a window which already
+# has bookings keeps its hours and interval length (the booked_mask bits
+# refer to them); it can still be closed. Days that drop out of a doctor's
+# schedule are closed by the second statement. In the daily rollout, doctors
+# without any schedule rows keep the windows they have (they never set up a
+# schedule); when a doctor saves an empty week on the availability page,
+# every window in the range is closed instead.
+#
+# Times are copied between Time columns as stored ('HH:MM:SS.ffffff' text);
+# updated_at is passed in because the model's onupdate does not apply to
+# plain SQL.
+
+DEFAULT_DAYS = 60
+DEFAULT_BATCH_SIZE = 500
+
+_WEEKDAY = "(CAST(strftime('%w', {0}) AS INTEGER) + 6) % 7"
+
+_UPSERT = f"""
+    WITH RECURSIVE days(day) AS (
+        SELECT :first_day
+        UNION ALL
+        SELECT date(day, '+1 day') FROM days WHERE day < :last_day
+    )
+    INSERT INTO doctor_availability (doctor_id, date, start_time, end_time, is_available,
+                                     slot_minutes, booked_mask, updated_at)
+    SELECT s.doctor_id, days.day,
+           COALESCE(e.start_time, s.start_time),
+           COALESCE(e.end_time, s.end_time),
+           e.id IS NULL OR e.start_time IS NOT NULL,
+           COALESCE(d.slot_minutes, dept.slot_minutes, {slots.DEFAULT_SLOT_MINUTES}),
+           0, :now
+    FROM days
+    JOIN weekly_schedules s ON s.weekday = {_WEEKDAY.format('days.day')}
+    JOIN users u ON u.id = s.doctor_id AND u.user_role = 'doctor'
+    JOIN doctors d ON d.id = s.doctor_id
+    LEFT JOIN departments dept ON dept.id = d.department_id
+    LEFT JOIN availability_exceptions e ON e.doctor_id = s.doctor_id AND e.date = days.day
+    WHERE s.doctor_id BETWEEN :first_doctor AND :last_doctor
+    ON CONFLICT (doctor_id, date) DO UPDATE SET
+        start_time = CASE WHEN booked_mask = 0 THEN excluded.start_time ELSE start_time END,
+        end_time = CASE WHEN booked_mask = 0 THEN excluded.end_time ELSE end_time END,
+        slot_minutes = CASE WHEN booked_mask = 0 THEN excluded.slot_minutes ELSE slot_minutes END,
+        is_available = excluded.is_available,
+        updated_at = excluded.updated_at
+    WHERE is_available IS NOT excluded.is_available
+       OR (booked_mask = 0 AND (start_time IS NOT excluded.start_time
+                                OR end_time IS NOT excluded.end_time
+                                OR slot_minutes IS NOT excluded.slot_minutes))
+"""
+
+_CLOSE_UNSCHEDULED = f"""
+    UPDATE doctor_availability SET is_available = 0, updated_at = :now
+    WHERE doctor_id BETWEEN :first_doctor AND :last_doctor
+      AND date BETWEEN :first_day AND :last_day
+      AND is_available
+      AND (NOT :keep_unscheduled
+           OR EXISTS (SELECT 1 FROM weekly_schedules s WHERE s.doctor_id = doctor_availability.doctor_id))
+      AND NOT EXISTS (SELECT 1 FROM weekly_schedules s
+                      WHERE s.doctor_id = doctor_availability.doctor_id
+                        AND s.weekday = {_WEEKDAY.format('doctor_availability.date')})
+"""
+
+
+def date_range(days, start=None):
+    """First and last day of a rollout of `days` days from `start` (today)."""
+    first_day = start or date.today()
+    return first_day, first_day + timedelta(days=days - 1)
+
+
+def roll_out(executor, first_doctor, last_doctor, first_day, last_day, keep_unscheduled=True):
+    """Write the windows of doctors first_doctor..last_doctor (by id) for
+    first_day..last_day and refresh their rollups, in the caller's
+    transaction. With keep_unscheduled=False a doctor without schedule rows
+    has every window closed. Returns the number of windows inserted or
+    changed."""
+    params = {'first_doctor': first_doctor, 'last_doctor': last_doctor,
+              'first_day': first_day.isoformat(), 'last_day': last_day.isoformat(),
+              'keep_unscheduled': keep_unscheduled,
+              'now': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')}
+    executor.execute(text(_UPSERT), params)
+    # the driver reports no rowcount for statements starting with WITH
+    changed = executor.execute(text('SELECT changes()')).scalar()
+    changed += executor.execute(text(_CLOSE_UNSCHEDULED), params).rowcount
+    stats.recount_slots_offered(executor, first_doctor, last_doctor, first_day, last_day)
+    return changed
+
+
+def roll_out_doctor(doctor_id, days=DEFAULT_DAYS, keep_unscheduled=True):
+    """Apply one doctor's edited schedule (request session; caller commits)."""
+    return roll_out(db.session, doctor_id, doctor_id, *date_range(days), keep_unscheduled=keep_unscheduled)
+
+
+def doctor_batches(conn, batch_size):
+    """(first id, last id) ranges covering the doctors with a schedule."""
+    doctor_ids = conn.execute(
+        db.select(WeeklySchedule.doctor_id).distinct().order_by(WeeklySchedule.doctor_id)
+    ).scalars().all()
+    for i in range(0, len(doctor_ids), batch_size):
+        batch = doctor_ids[i:i + batch_size]
+        yield batch[0], batch[-1]
+
+
+def roll_out_all(days=DEFAULT_DAYS, batch_size=DEFAULT_BATCH_SIZE, start=None):
+    """Roll every doctor's schedule out, one transaction per batch so the
+    write lock is only held briefly. Returns (batches, windows changed)."""
+    first_day, last_day = date_range(days, start)
+    with db.engine.connect() as conn:
+        batches = list(doctor_batches(conn, batch_size))
+    changed = 0
+    for first_doctor, last_doctor in batches:
+        with db.engine.begin() as conn:
+            changed += roll_out(conn, first_doctor, last_doctor, first_day, last_day)
+    return len(batches), changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="length of the rolling window")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="doctors per transaction")
+    parser.add_argument('--doctor', type=int, help="roll out this doctor only")
+    args = parser.parse_args()
+
+    from app import app
+
+    started = time.perf_counter()
+    with app.app_context():
+        if args.doctor:
+            changed = roll_out_doctor(args.doctor, args.days)
+            db.session.commit()
+            batches = 1
+        else:
+            batches, changed = roll_out_all(args.days, args.batch_size)
+    print(f"{changed} windows written in {batches} batches ({time.perf_counter() - started:.1f}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import re
+from sqlalchemy import event, text
+from models import db
+
+# Full-text search over doctors, departments and patients (SQLite FTS5).
+#
+# One row per searchable entity in the `search_index` virtual table. The
+# kind of entity is encoded in the rowid (entity id * 4 + kind) so triggers
+# can update a row by rowid instead of scanning the index. Triggers on
+# users, doctors, patients and departments keep it in sync; nothing in the
+# application writes to it directly.
+#
+# Doctor rows carry the doctor's name plus their department's name and
+# description, so "cardio" or "heart" finds cardiologists.
+
+DOCTOR, PATIENT, DEPARTMENT = 1, 2, 3
+
+# Results per search box
+SEARCH_LIMIT = 50
+
+_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        name, department, description,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    # name hits rank above department hits, above description hits
+    "INSERT INTO search_index(search_index, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')",
+
+    # doctors
+    """CREATE TRIGGER IF NOT EXISTS search_doctor_insert AFTER INSERT ON doctors BEGIN
+        INSERT INTO search_index(rowid, name, department, description)
+        SELECT NEW.id * 4 + 1, u.user_name, d.department_name, d.description
+        FROM users u, departments d WHERE u.id = NEW.id AND d.id = NEW.department_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_doctor_update AFTER UPDATE OF department_id ON doctors BEGIN
+        UPDATE search_index
+        SET department = (SELECT department_name FROM departments WHERE id = NEW.department_id),
+            description = (SELECT description FROM departments WHERE id = NEW.department_id)
+        WHERE rowid = NEW.id * 4 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_doctor_delete AFTER DELETE ON doctors BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1;
+    END""",
+
+    # patients
+    """CREATE TRIGGER IF NOT EXISTS search_patient_insert AFTER INSERT ON patients BEGIN
+        INSERT INTO search_index(rowid, name)
+        SELECT NEW.id * 4 + 2, user_name FROM users WHERE id = NEW.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_patient_delete AFTER DELETE ON patients BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2;
+    END""",
+
+    # renaming a user renames their doctor or patient entry
+    """CREATE TRIGGER IF NOT EXISTS search_user_rename AFTER UPDATE OF user_name ON users BEGIN
+        UPDATE search_index SET name = NEW.user_name WHERE rowid IN (NEW.id * 4 + 1, NEW.id * 4 + 2);
+    END""",
+
+    # departments
+    """CREATE TRIGGER IF NOT EXISTS search_department_insert AFTER INSERT ON departments BEGIN
+        INSERT INTO search_index(rowid, name, department, description)
+        VALUES (NEW.id * 4 + 3, NEW.department_name, NEW.department_name, NEW.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_department_update
+    AFTER UPDATE OF department_name, description ON departments BEGIN
+        UPDATE search_index
+        SET name = NEW.department_name, department = NEW.department_name, description = NEW.description
+        WHERE rowid = NEW.id * 4 + 3;
+        UPDATE search_index SET department = NEW.department_name, description = NEW.description
+        WHERE rowid IN (SELECT id * 4 + 1 FROM doctors WHERE department_id = NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_department_delete AFTER DELETE ON departments BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 3;
+    END""",
+]
+
+
+def create_search_index(conn):
+    for statement in _DDL:
+        conn.exec_driver_sql(statement)
+
+
+def rebuild_search_index(conn):
+    """Repopulate the index from the base tables."""
+    conn.exec_driver_sql("DELETE FROM search_index")
+    conn.exec_driver_sql("""
+        INSERT INTO search_index(rowid, name, department, description)
+        SELECT doc.id * 4 + 1, u.user_name, d.department_name, d.description
+        FROM doctors doc JOIN users u ON u.id = doc.id JOIN departments d ON d.id = doc.department_id
+    """)
+    conn.exec_driver_sql("""
+        INSERT INTO search_index(rowid, name)
+        SELECT p.id * 4 + 2, u.user_name FROM patients p JOIN users u ON u.id = p.id
+    """)
+    conn.exec_driver_sql("""
+        INSERT INTO search_index(rowid, name, department, description)
+        SELECT id * 4 + 3, department_name, department_name, description FROM departments
+    """)
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(target, conn, **kw):
+    # create_all() builds the index for new databases; migrate.py adds it
+    # to existing ones
+    create_search_index(conn)
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def matches(kind, query):
+    """Subquery of (id, rank) for entities of `kind` matching `query`, or
+    None if the query has no searchable words. Lower rank is better."""
+    expression = match_expression(query)
+    if not expression:
+        return None
+    return (text("SELECT rowid / 4 AS id, rank FROM search_index "
+                 "WHERE search_index MATCH :expression AND rowid % 4 = :kind")
+            .bindparams(expression=expression, kind=kind)
+            .columns(id=db.Integer, rank=db.Float)
+            .subquery())
@@ -0,0 +1,204 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, time as dtime
+from sqlalchemy import text
+from models import db, User, Doctor, Department
+import slots
+
+# In-process index of free intervals for the next HORIZON_DAYS days.
+#
+# "Earliest free slots in department X / for doctor Y" would otherwise mean
+# loading every doctor's windows. The index keeps each window's geometry and
+# booked_mask in memory (the mask already says which intervals are taken), so
+# a search is a heap merge over the matching doctors' windows for each day,
+# taking free intervals in time order until it has enough.
+#
+# The booking service updates the mask after its commit (interval_booked /
+# interval_released) and schedule edits reload the doctor (doctor_changed).
+# Like the caches in cache.py each gunicorn worker has its own index and only
+# sees its own writes, so the whole index is rebuilt every REFRESH_SECONDS and
+# when the day changes. A stale entry can only offer a slot that is already
+# gone; booking re-checks it in the database and refuses.
+
+HORIZON_DAYS = 14
+REFRESH_SECONDS = 30
+
+Window = namedtuple('Window', 'start slot_minutes count mask is_available')  # start in minutes
+DoctorInfo = namedtuple('DoctorInfo', 'id name department_id department_name')
+FreeSlot = namedtuple('FreeSlot', 'date start end doctor_id doctor_name department_id department_name')
+
+
+# geometry computed in SQL so loading does not parse 70k Time values
+_WINDOWS = f"""
+    SELECT doctor_id, date, {slots.sql_minutes('start_time')}, {slots.SQL_SLOT_MINUTES},
+           {slots.SQL_SLOT_COUNT}, booked_mask, is_available
+    FROM doctor_availability
+    WHERE date BETWEEN :first_day AND :last_day
+"""
+
+
+def _time(minutes):
+    return dtime(minutes // 60, minutes % 60)
+
+
+def _next_free(window, index):
+    """First free interval of `window` at or after `index`, or None."""
+    free = (~window.mask & ((1 << window.count) - 1)) >> index
+    if not free:
+        return None
+    return index + (free & -free).bit_length() - 1
+
+
+class SlotIndex:
+
+    def __init__(self, horizon_days=HORIZON_DAYS, refresh_seconds=REFRESH_SECONDS):
+        self.horizon_days = horizon_days
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._doctors = {}      # doctor id -> DoctorInfo, ordered by name
+        self._departments = {}  # department id -> [DoctorInfo]
+        self._windows = {}      # doctor id -> {date: Window}
+        self._first_day = None
+        self._built_at = None
+        self.builds = 0
+        self.lookups = 0
+
+    # ---- loading ----
+    def _load_windows(self, first_day, doctor_id=None):
+        """{doctor id: {date: Window}} for the horizon."""
+        sql = _WINDOWS + (' AND doctor_id = :doctor_id' if doctor_id is not None else '')
+        params = {'first_day': first_day.isoformat(),
+                  'last_day': (first_day + timedelta(days=self.horizon_days - 1)).isoformat(),
+                  'doctor_id': doctor_id}
+        days = {}
+        windows = {}
+        for doctor, day, start, length, count, mask, available in db.session.execute(text(sql), params):
+            if day not in days:
+                days[day] = date.fromisoformat(day)
+            windows.setdefault(doctor, {})[days[day]] = Window(start, length, count, mask or 0, bool(available))
+        return windows
+
+    def build(self, today=None):
+        """Load the index from the database (two queries)."""
+        first_day = today or date.today()
+        doctors = {
+            row.id: DoctorInfo(*row)
+            for row in (db.session.query(Doctor.id, User.user_name, Doctor.department_id,
+                                         Department.department_name)
+                        .join(User, Doctor.id == User.id)
+                        .join(Department, Doctor.department_id == Department.id)
+                        # blacklisted doctors are hidden from patients
+                        .filter(User.user_role == 'doctor')
+                        .order_by(User.user_name))
+        }
+        departments = {}
+        for doctor in doctors.values():
+            departments.setdefault(doctor.department_id, []).append(doctor)
+        windows = self._load_windows(first_day)
+        with self._lock:
+            self._doctors, self._departments, self._windows = doctors, departments, windows
+            self._first_day = first_day
+            self._built_at = time.monotonic()
+            self.builds += 1
+
+    def _ensure_fresh(self, today):
+        if (self._built_at is None or self._first_day != today
+                or time.monotonic() - self._built_at > self.refresh_seconds):
+            self.build(today)
+
+    def invalidate(self):
+        """Rebuild on the next lookup (doctors added, renamed or removed)."""
+        self._built_at = None
+
+    # ---- incremental updates (after the change is committed) ----
+    def _set_bit(self, doctor_id, day, index, booked):
+        with self._lock:
+            windows = self._windows.get(doctor_id)
+            window = windows.get(day) if windows else None
+            if window is not None:
+                mask = window.mask | slots.bit(index) if booked else window.mask & ~slots.bit(index)
+                windows[day] = window._replace(mask=mask)
+
+    def interval_booked(self, doctor_id, day, index):
+        self._set_bit(doctor_id, day, index, True)
+
+    def interval_released(self, doctor_id, day, index):
+        self._set_bit(doctor_id, day, index, False)
+
+    def doctor_changed(self, doctor_id):
+        """Reload one doctor's windows (schedule or exception edited)."""
+        if self._built_at is None or doctor_id not in self._doctors:
+            return
+        windows = self._load_windows(self._first_day, doctor_id).get(doctor_id, {})
+        with self._lock:
+            self._windows[doctor_id] = windows
+
+    # ---- lookup ----
+    def earliest(self, department_id=None, name=None, days=7, limit=20, now=None):
+        """The `limit` earliest free intervals in the next `days` days (at
+        most the horizon), for a department and/or doctors whose name
+        contains `name`, as FreeSlots ordered by date and time."""
+        now = now or datetime.now()
+        today = now.date()
+        self._ensure_fresh(today)
+        self.lookups += 1
+
+        with self._lock:
+            if department_id is not None:
+                doctors = self._departments.get(department_id, [])
+            else:
+                doctors = self._doctors.values()
+            if name:
+                doctors = [d for d in doctors if name.lower() in d.name.lower()]
+            doctor_windows = [(d, self._windows.get(d.id, {})) for d in doctors]
+
+        found = []
+        for offset in range(min(days, self.horizon_days)):
+            day = today + timedelta(days=offset)
+            not_before = now.hour * 60 + now.minute if offset == 0 else -1
+            # (start, name, id, index, doctor, window) for each doctor's
+            # next free interval; popped in time order
+            heap = []
+            for doctor, windows in doctor_windows:
+                window = windows.get(day)
+                if window is None or not window.is_available:
+                    continue
+                # intervals starting after `not_before`
+                index = _next_free(window, max(0, (not_before - window.start) // window.slot_minutes + 1))
+                if index is not None:
+                    heap.append((window.start + index * window.slot_minutes, doctor.name, doctor.id,
+                                 index, doctor, window))
+            heapq.heapify(heap)
+            while heap and len(found) < limit:
+                start, _, _, index, doctor, window = heapq.heappop(heap)
+                found.append(FreeSlot(day, _time(start), _time(start + window.slot_minutes), doctor.id,
+                                      doctor.name, doctor.department_id, doctor.department_name))
+                index = _next_free(window, index + 1)
+                if index is not None:
+                    heapq.heappush(heap, (window.start + index * window.slot_minutes, doctor.name, doctor.id,
+                                          index, doctor, window))
+            if len(found) >= limit:
+                break
+        return found
+
+    def stats(self):
+        return {
+            'doctors': len(self._doctors),
+            'windows': sum(len(w) for w in self._windows.values()),
+            'first_day': self._first_day.isoformat() if self._first_day else None,
+            'age_seconds': round(time.monotonic() - self._built_at, 1) if self._built_at else None,
+            'builds': self.builds,
+            'lookups': self.lookups,
+        }
+
+
+_index = SlotIndex()
+
+earliest = _index.earliest
+interval_booked = _index.interval_booked
+interval_released = _index.interval_released
+doctor_changed = _index.doctor_changed
+invalidate = _index.invalidate
+stats = _index.stats
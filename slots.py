@@ -0,0 +1,89 @@
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+
+# Bookable intervals inside a DoctorAvailability window.
+#
+# A window (one per doctor per day) is split into fixed-length intervals of
+# `slot_minutes`. Which intervals are taken is stored on the window itself as
+# a bitmap in `booked_mask` (bit i set = interval i booked), so a day with 40
+# appointments is still one row. The length is resolved from the doctor, then
+# the department, then DEFAULT_SLOT_MINUTES, and frozen onto the window when
+# it is created so existing bitmaps keep their meaning.
+
+DEFAULT_SLOT_MINUTES = 15
+
+# booked_mask is a signed 64-bit SQLite integer
+MAX_SLOTS_PER_WINDOW = 63
+
+# appointment lengths the admin forms and bulk_import.py accept
+MIN_SLOT_MINUTES = 5
+MAX_SLOT_MINUTES = 240
+
+Interval = namedtuple('Interval', 'index start end is_free')
+
+
+def slot_minutes_for(doctor):
+    return doctor.slot_minutes or doctor.department.slot_minutes or DEFAULT_SLOT_MINUTES
+
+
+def window_slot_minutes(window):
+    return window.slot_minutes or DEFAULT_SLOT_MINUTES
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def slot_count(window):
+    length = _minutes(window.end_time) - _minutes(window.start_time)
+    return max(0, min(length // window_slot_minutes(window), MAX_SLOTS_PER_WINDOW))
+
+
+def window_error(start_time, end_time, slot_minutes):
+    """Why hours from start_time to end_time in `slot_minutes` intervals
+    cannot be offered, or None. slot_count() would drop the intervals past
+    MAX_SLOTS_PER_WINDOW, so such hours are refused where they are entered."""
+    count = (_minutes(end_time) - _minutes(start_time)) // slot_minutes
+    if count <= MAX_SLOTS_PER_WINDOW:
+        return None
+    longest = MAX_SLOTS_PER_WINDOW * slot_minutes
+    return (f"{start_time:%H:%M}-{end_time:%H:%M} would be {count} appointments of {slot_minutes} minutes; "
+            f"a day holds at most {MAX_SLOTS_PER_WINDOW} ({longest // 60}h{longest % 60:02d} at that length).")
+
+
+def bit(index):
+    return 1 << index
+
+
+def intervals(window):
+    """All intervals of a window, with whether each one can be booked."""
+    step = timedelta(minutes=window_slot_minutes(window))
+    start = datetime.combine(date.min, window.start_time)
+    mask = window.booked_mask or 0
+    for i in range(slot_count(window)):
+        end = start + step
+        yield Interval(i, start.time(), end.time(),
+                       bool(window.is_available) and not mask & bit(i))
+        start = end
+
+
+def interval_index(window, start_time):
+    """Index of the interval starting at `start_time`, or None if no
+    interval of this window starts there."""
+    offset = _minutes(start_time) - _minutes(window.start_time)
+    step = window_slot_minutes(window)
+    if start_time.second or offset < 0 or offset % step:
+        return None
+    index = offset // step
+    return index if index < slot_count(window) else None
+
+
+# The same arithmetic in SQL, for set-based statements over
+# doctor_availability (times are stored as 'HH:MM:SS.ffffff' text).
+def sql_minutes(column):
+    return f"(CAST(substr({column}, 1, 2) AS INTEGER) * 60 + CAST(substr({column}, 4, 2) AS INTEGER))"
+
+
+SQL_SLOT_MINUTES = f"COALESCE(slot_minutes, {DEFAULT_SLOT_MINUTES})"
+SQL_SLOT_COUNT = (f"MAX(0, MIN(({sql_minutes('end_time')} - {sql_minutes('start_time')}) "
+                  f"/ {SQL_SLOT_MINUTES}, {MAX_SLOTS_PER_WINDOW}))")
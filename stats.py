@@ -0,0 +1,226 @@
+"""Operational statistics kept in rollup tables.
+
+doctor_day_stats holds one row per doctor per day with the number of
+appointments in each status and the intervals the doctor offered that day;
+registration_stats holds new patients per week. The booking, status and
+cancel paths update them in the same transaction as the change itself, so
+the stats page reads a handful of pre-aggregated rows instead of every
+appointment.
+
+If the rollups drift (manual edits, a restored backup), rebuild them from
+the base tables:
+
+    python stats.py
+"""
+import argparse
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert
+from models import db, User, Doctor, Department, Appointment, DoctorDayStats, RegistrationStats
+import slots
+
+STATUSES = ('booked', 'completed', 'cancelled')
+
+
+class Totals(namedtuple('Totals', 'label booked completed cancelled slots_offered')):
+    """Counts for one bucket (a day, doctor or department) of the stats page."""
+
+    @property
+    def appointments(self):
+        return self.booked + self.completed + self.cancelled
+
+    def _share(self, part, whole):
+        return part / whole if whole else None
+
+    @property
+    def completion_rate(self):
+        return self._share(self.completed, self.appointments)
+
+    @property
+    def cancellation_rate(self):
+        return self._share(self.cancelled, self.appointments)
+
+    @property
+    def utilization(self):
+        # intervals taken (booked or done) out of intervals offered
+        return self._share(self.booked + self.completed, self.slots_offered)
+
+
+# ------------------ Incremental updates ------------------
+def _bump(executor, model, key, **deltas):
+    """Add `deltas` to the row at `key`, creating it if needed."""
+    stmt = insert(model).values(**key, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={name: getattr(model, name) + stmt.excluded[name] for name in deltas}
+    )
+    executor.execute(stmt)
+
+
+def appointment_booked(doctor_id, day, executor=None):
+    _bump(executor or db.session, DoctorDayStats, {'doctor_id': doctor_id, 'day': day}, booked=1)
+
+
+def appointment_status_changed(appointment, old_status, executor=None):
+    """Move one appointment from `old_status` to its current status."""
+    new_status = appointment.status
+    if old_status == new_status:
+        return
+    deltas = {}
+    if old_status in STATUSES:
+        deltas[old_status] = -1
+    if new_status in STATUSES:
+        deltas[new_status] = 1
+    if deltas:
+        _bump(executor or db.session, DoctorDayStats,
+              {'doctor_id': appointment.doctor_id, 'day': appointment.appointment_date}, **deltas)
+
+
+def appointments_removed(*criteria, executor=None, model=Appointment):
+    """Subtract appointments matching `criteria` that are about to be
+    deleted (call before the DELETE); `model` may be ArchivedAppointment."""
+    executor = executor or db.session
+    groups = executor.execute(
+        db.select(model.doctor_id, model.appointment_date, model.status, func.count())
+        .where(*criteria)
+        .group_by(model.doctor_id, model.appointment_date, model.status)
+    ).all()
+    for doctor_id, day, status, count in groups:
+        if status in STATUSES:
+            _bump(executor, DoctorDayStats, {'doctor_id': doctor_id, 'day': day}, **{status: -count})
+
+
+def doctors_removed(doctor_ids, executor=None):
+    (executor or db.session).execute(db.delete(DoctorDayStats).where(DoctorDayStats.doctor_id.in_(doctor_ids)))
+
+
+def slots_offered(windows, executor=None):
+    """Record how many intervals each window offers (one window per doctor
+    per day, so this replaces the day's figure)."""
+    rows = [{'doctor_id': w.doctor_id, 'day': w.date,
+             'slots_offered': slots.slot_count(w) if w.is_available else 0} for w in windows]
+    if rows:
+        stmt = insert(DoctorDayStats)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['doctor_id', 'day'],
+            set_={'slots_offered': stmt.excluded.slots_offered}
+        )
+        (executor or db.session).execute(stmt, rows)
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def patients_registered(day, count=1, executor=None):
+    _bump(executor or db.session, RegistrationStats, {'week_start': week_start(day)}, patients=count)
+
+
+# ------------------ Rebuild ------------------
+_SLOTS_OFFERED = f"""
+    INSERT INTO doctor_day_stats (doctor_id, day, slots_offered)
+    SELECT doctor_id, date, CASE WHEN is_available THEN {slots.SQL_SLOT_COUNT} ELSE 0 END
+    FROM doctor_availability WHERE {{where}}
+    ON CONFLICT (doctor_id, day) DO UPDATE SET slots_offered = excluded.slots_offered
+"""
+
+
+def recount_slots_offered(conn, first_doctor, last_doctor, first_day, last_day):
+    """Recompute slots_offered for the windows of a range of doctors and
+    days, after a set-based change to doctor_availability."""
+    conn.execute(
+        text(_SLOTS_OFFERED.format(
+            where="doctor_id BETWEEN :first_doctor AND :last_doctor AND date BETWEEN :first_day AND :last_day"
+        )),
+        {'first_doctor': first_doctor, 'last_doctor': last_doctor,
+         'first_day': first_day.isoformat(), 'last_day': last_day.isoformat()}
+    )
+
+
+def rebuild(conn):
+    """Recompute every rollup from the base tables (caller's transaction)."""
+    conn.exec_driver_sql("DELETE FROM doctor_day_stats")
+    conn.exec_driver_sql("""
+        INSERT INTO doctor_day_stats (doctor_id, day, booked, completed, cancelled, slots_offered)
+        SELECT doctor_id, appointment_date,
+               SUM(status = 'booked'), SUM(status = 'completed'), SUM(status = 'cancelled'), 0
+        FROM (SELECT doctor_id, appointment_date, status FROM appointments
+              UNION ALL
+              SELECT doctor_id, appointment_date, status FROM appointments_archive)
+        GROUP BY doctor_id, appointment_date
+    """)
+    conn.exec_driver_sql(_SLOTS_OFFERED.format(where='true'))
+
+    conn.exec_driver_sql("DELETE FROM registration_stats")
+    # date(..., 'weekday 0', '-6 days') is the Monday of the week
+    conn.exec_driver_sql("""
+        INSERT INTO registration_stats (week_start, patients)
+        SELECT date(u.created_at, 'weekday 0', '-6 days'), COUNT(*)
+        FROM patients p JOIN users u ON u.id = p.id
+        WHERE u.created_at IS NOT NULL
+        GROUP BY 1
+    """)
+
+
+# ------------------ Reading ------------------
+def _totals(label, date_from, date_to):
+    """Query of `label` plus the summed counters over a date range."""
+    return (db.session.query(
+                label,
+                func.sum(DoctorDayStats.booked), func.sum(DoctorDayStats.completed),
+                func.sum(DoctorDayStats.cancelled), func.sum(DoctorDayStats.slots_offered))
+            .select_from(DoctorDayStats)
+            .filter(DoctorDayStats.day >= date_from, DoctorDayStats.day <= date_to))
+
+
+def daily_totals(date_from, date_to):
+    rows = (_totals(DoctorDayStats.day, date_from, date_to)
+            .group_by(DoctorDayStats.day)
+            .order_by(DoctorDayStats.day))
+    return [Totals(*row) for row in rows]
+
+
+def doctor_totals(date_from, date_to):
+    rows = (_totals(User.user_name, date_from, date_to)
+            .join(User, User.id == DoctorDayStats.doctor_id)
+            .group_by(DoctorDayStats.doctor_id)
+            .order_by(User.user_name))
+    return [Totals(*row) for row in rows]
+
+
+def department_totals(date_from, date_to):
+    rows = (_totals(Department.department_name, date_from, date_to)
+            .join(Doctor, Doctor.id == DoctorDayStats.doctor_id)
+            .join(Department, Department.id == Doctor.department_id)
+            .group_by(Department.id)
+            .order_by(Department.department_name))
+    return [Totals(*row) for row in rows]
+
+
+def overall(rows):
+    """Sum of a list of Totals."""
+    return Totals('Total', *(sum(r[i] for r in rows) for i in range(1, len(Totals._fields))))
+
+
+def weekly_registrations(date_from, date_to):
+    return (db.session.query(RegistrationStats.week_start, RegistrationStats.patients)
+            .filter(RegistrationStats.week_start >= week_start(date_from),
+                    RegistrationStats.week_start <= date_to)
+            .order_by(RegistrationStats.week_start)
+            .all())
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+
+    from app import app
+    with app.app_context(), db.engine.begin() as conn:
+        rebuild(conn)
+        days = conn.exec_driver_sql("SELECT COUNT(*) FROM doctor_day_stats").scalar()
+        weeks = conn.exec_driver_sql("SELECT COUNT(*) FROM registration_stats").scalar()
+    print(f"Rebuilt {days} doctor-day rows and {weeks} registration weeks.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# set before the app is imported; every test starts from an empty file
+_DATABASE_DIR = tempfile.mkdtemp(prefix='hms-tests-')
+os.environ['HMS_DATABASE_URI'] = 'sqlite:///' + os.path.join(_DATABASE_DIR, 'hospital.db')
+
+import pytest
+from app import app as flask_app
+from models import db
+import cache
+import migrate
+import slot_index
+
+
+def reset_database():
+    """Drop the database file and the in-process caches, then create the
+    latest schema."""
+    db.session.remove()
+    db.engine.dispose()
+    for name in os.listdir(_DATABASE_DIR):
+        os.remove(os.path.join(_DATABASE_DIR, name))
+    migrate.initialize()
+    for entry in cache.CACHES.values():
+        entry.invalidate()
+    slot_index.invalidate()
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        reset_database()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def fresh_database(app):
+    """Call to start over from an empty database within one test."""
+    return reset_database
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,29 @@
+import pytest
+from models import db, User, Patient
+
+
+@pytest.fixture
+def admin(client):
+    db.session.add(User(user_name='admin', user_email='admin@test', user_password='x', user_role='admin'))
+    patient = User(user_name='pat', user_email='pat@test', user_password='x', user_role='patient')
+    db.session.add(patient)
+    db.session.flush()
+    db.session.add(Patient(id=patient.id, patient_name='pat'))
+    db.session.commit()
+    client.post('/login', data={'user_email': 'admin@test', 'user_password': 'x'})
+    return client
+
+
+@pytest.mark.parametrize('body', [[1, 2], 'blacklist', 7, {'action': ['blacklist'], 'ids': [2]},
+                                  {'action': 'blacklist', 'ids': '2'}])
+def test_malformed_json_is_refused(admin, body):
+    response = admin.post('/admin/batch/patients', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_blacklist_reports_each_id(admin):
+    patient_id = Patient.query.one().id
+    response = admin.post('/admin/batch/patients', json={'action': 'blacklist', 'ids': [patient_id, 999]})
+    assert response.get_json()['results'] == [{'id': patient_id, 'outcome': 'blacklisted'},
+                                              {'id': 999, 'outcome': 'not found'}]
@@ -0,0 +1,46 @@
+from datetime import date, datetime, time, timedelta
+import pytest
+from models import db, User, Doctor, Patient, Department, Appointment, ArchivedHistory
+
+
+@pytest.fixture
+def patient(app):
+    department = Department(department_name='Cardiology')
+    users = [User(user_name='doc', user_email='doc@test', user_password='x', user_role='doctor'),
+             User(user_name='pat', user_email='pat@test', user_password='x', user_role='patient')]
+    db.session.add_all([department] + users)
+    db.session.flush()
+    db.session.add_all([Doctor(id=users[0].id, department_id=department.id),
+                        Patient(id=users[1].id, patient_name='pat')])
+    db.session.add(Appointment(patient_id=users[1].id, doctor_id=users[0].id,
+                               appointment_date=date.today() + timedelta(days=1), appointment_time=time(9),
+                               status='booked'))
+    db.session.commit()
+    return users[1]
+
+
+def revalidate(client, path, etag):
+    return client.get(path, headers={'If-None-Match': etag})
+
+
+def test_renaming_the_doctor_changes_the_appointments_etag(client, patient):
+    client.post('/login', data={'user_email': 'pat@test', 'user_password': 'x'})
+    etag = client.get('/api/v1/appointments').headers['ETag']
+    assert revalidate(client, '/api/v1/appointments', etag).status_code == 304
+
+    db.session.get(User, Doctor.query.one().id).user_name = 'Dr. Renamed'
+    db.session.commit()
+    response = revalidate(client, '/api/v1/appointments', etag)
+    assert response.status_code == 200
+    assert response.get_json()['appointments'][0]['doctor'] == 'Dr. Renamed'
+
+
+def test_history_etag_covers_archived_records(client, patient):
+    client.post('/login', data={'user_email': 'pat@test', 'user_password': 'x'})
+    path = f'/api/v1/patients/{patient.id}/history'
+    etag = client.get(path).headers['ETag']
+
+    db.session.add(ArchivedHistory(id=1, patient_id=patient.id, doctor_id=Doctor.query.one().id,
+                                   diagnosis='old', created_at=datetime(2020, 1, 1), updated_at=datetime(2020, 1, 1)))
+    db.session.commit()
+    assert revalidate(client, path, etag).status_code == 200
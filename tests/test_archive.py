@@ -0,0 +1,52 @@
+from datetime import date, datetime, time, timedelta
+import pytest
+from models import db, User, Doctor, Patient, Department, Appointment, PatientHistory, ArchivedHistory
+import archive
+
+OLD = date.today() - timedelta(days=400)
+
+
+@pytest.fixture
+def people(app):
+    department = Department(department_name='Cardiology')
+    users = [User(user_name='doc', user_email='doc@test', user_password='x', user_role='doctor'),
+             User(user_name='pat', user_email='pat@test', user_password='x', user_role='patient')]
+    db.session.add_all([department] + users)
+    db.session.flush()
+    db.session.add_all([Doctor(id=users[0].id, department_id=department.id),
+                        Patient(id=users[1].id, patient_name='pat')])
+    db.session.commit()
+    return users[0].id, users[1].id
+
+
+def add_visit(doctor_id, patient_id, day, with_record=True):
+    appointment = Appointment(patient_id=patient_id, doctor_id=doctor_id, appointment_date=day,
+                              appointment_time=time(9), status='completed')
+    db.session.add(appointment)
+    db.session.flush()
+    if with_record:
+        db.session.add(PatientHistory(patient_id=patient_id, doctor_id=doctor_id, appointment_id=appointment.id,
+                                      diagnosis='dx', created_at=datetime.combine(day, time(9))))
+    db.session.commit()
+    return appointment
+
+
+def test_archiving_never_frees_the_newest_history_id(people):
+    doctor_id, patient_id = people
+    add_visit(doctor_id, patient_id, OLD)
+    # newer appointment without a record: the old one is not the newest appointment
+    add_visit(doctor_id, patient_id, OLD + timedelta(days=1), with_record=False)
+    cutoff = archive.cutoff_for(365)
+
+    archive.archive(cutoff)
+    added = PatientHistory(patient_id=patient_id, doctor_id=doctor_id, diagnosis='new')
+    db.session.add(added)
+    db.session.commit()
+    archived_ids = set(db.session.scalars(db.select(ArchivedHistory.id)))
+    assert added.id not in archived_ids
+
+    # once it is no longer the newest, the record moves; archiving again succeeds
+    assert archive.archive(cutoff)['history'] == 1
+    archive.archive(cutoff)
+    assert db.session.scalars(db.select(ArchivedHistory.id)).all() == [1]
+    assert db.session.scalars(db.select(PatientHistory.id)).all() == [added.id]
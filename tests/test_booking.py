@@ -0,0 +1,46 @@
+from datetime import date, time, timedelta
+import pytest
+from models import db, User, Doctor, Patient, Department, Appointment, DoctorAvailability, SlotEvent
+import booking
+import jobs
+
+
+@pytest.fixture
+def window(app):
+    department = Department(department_name='Cardiology', slot_minutes=15)
+    db.session.add(department)
+    users = [User(user_name=name, user_email=f'{name}@test', user_password='x', user_role=role)
+             for name, role in (('doc', 'doctor'), ('first', 'patient'), ('second', 'patient'))]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.add(Doctor(id=users[0].id, department_id=department.id))
+    db.session.add_all([Patient(id=user.id, patient_name=user.user_name) for user in users[1:]])
+    window = DoctorAvailability(doctor_id=users[0].id, date=date.today() + timedelta(days=1),
+                                start_time=time(9), end_time=time(10), slot_minutes=15)
+    db.session.add(window)
+    db.session.commit()
+    return window
+
+
+def run_job(kind, **payload):
+    jobs.enqueue(kind, **payload)
+    db.session.commit()
+    job = jobs.run(jobs.claim('test'))
+    assert job.status == 'succeeded', job.last_error
+    return jobs.describe(job)['result']
+
+
+def test_deleting_a_patient_reopens_their_intervals(window):
+    first, second = (user.id for user in User.query.filter_by(user_role='patient').order_by(User.id))
+    booking.book_appointment(first, window.doctor_id, window.date, time(9, 15))
+    with pytest.raises(booking.SlotUnavailable):
+        booking.book_appointment(second, window.doctor_id, window.date, time(9, 15))
+
+    result = run_job('delete_patients', patient_ids=[first])
+    assert result['deleted'] == [first] and result['appointments'] == 1
+
+    db.session.expire_all()
+    assert window.booked_mask == 0
+    assert SlotEvent.query.order_by(SlotEvent.id.desc()).first().booked is False
+    appointment = booking.book_appointment(second, window.doctor_id, window.date, time(9, 15))
+    assert Appointment.query.filter_by(status='booked').all() == [appointment]
@@ -0,0 +1,39 @@
+import time
+from datetime import date, datetime, timedelta, time as dtime
+from models import db, SlotEvent
+import events
+
+
+def test_recording_prunes_old_events_without_a_relay(app, monkeypatch):
+    monkeypatch.setattr(events, '_pruned_at', None)
+    stale = datetime.utcnow() - timedelta(seconds=events.RETAIN_SECONDS + 1)
+    db.session.add(SlotEvent(doctor_id=1, date=date.today(), start='09:00', booked=True, origin='gone',
+                             created_at=stale))
+    db.session.commit()
+
+    event = events.record(1, date.today(), dtime(9, 15), booked=True)
+    db.session.commit()
+    assert [row.id for row in SlotEvent.query] == [event.id]
+    assert events.stats()['subscriptions'] == 0
+
+
+def test_relay_starts_from_the_newest_event(app):
+    def write(start):
+        row = SlotEvent(doctor_id=1, date=date.today(), start=start, booked=True, origin='another-worker')
+        db.session.add(row)
+        db.session.commit()
+        return row.id
+
+    write('09:00')
+    broker = events.Broker()
+    relay = events.Relay(broker)
+    relay.app = app
+    delivered = []
+    broker.subscribe([(1, date.today())], delivered.append)
+    relay.ensure_running()
+
+    new_id = write('09:15')
+    deadline = time.monotonic() + 5
+    while not delivered and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert [event.id for event in delivered] == [new_id]
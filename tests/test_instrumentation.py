@@ -0,0 +1,30 @@
+import pytest
+from flask import g
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from models import db
+import instrumentation
+
+
+@pytest.fixture
+def profiled(app):
+    event.listen(db.engine, 'before_cursor_execute', instrumentation._before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', instrumentation._after_cursor_execute)
+    with app.test_request_context():
+        g._profile = instrumentation.Profile()
+        yield g._profile
+    event.remove(db.engine, 'before_cursor_execute', instrumentation._before_cursor_execute)
+    event.remove(db.engine, 'after_cursor_execute', instrumentation._after_cursor_execute)
+
+
+def test_a_failed_statement_leaves_nothing_on_the_connection(profiled):
+    connection = db.session.connection()
+    info = dict(connection.info)
+    with pytest.raises(OperationalError):
+        connection.execute(text('SELECT * FROM no_such_table'))
+    assert dict(connection.info) == info
+
+    db.session.rollback()
+    db.session.execute(text('SELECT 1'))
+    assert profiled.sql_count == 1
+    assert profiled.statements[0][1] == 'SELECT 1'
@@ -0,0 +1,85 @@
+import threading
+from argparse import Namespace
+from datetime import date
+from sqlalchemy import event
+from models import db, User
+from bench import datagen
+import cache
+import history
+import stats
+
+# Statements per page must not grow with the data: the listings are
+# eager-loaded and paged (see queries.py), so a page costs the same few
+# queries at any size.
+MAX_STATEMENTS = 10
+
+SIZES = [
+    {'doctors': 4, 'patients': 40, 'appointments': 300},
+    {'doctors': 16, 'patients': 160, 'appointments': 3000},
+]
+
+
+def generate(**sizes):
+    args = Namespace(departments=3, days_past=14, days_ahead=7, history_ratio=0.8, cancel_ratio=0.1,
+                     seed=1, anchor=date.today(), chunk_size=10000, **sizes)
+    with db.engine.connect() as conn:
+        datagen.generate(conn, args)
+        with conn.begin():
+            stats.rebuild(conn)
+            history.rebuild(conn)
+        conn.commit()
+
+
+class StatementCounter:
+    """Statements run on this thread (not e.g. a relay thread left by
+    another test)."""
+
+    def __init__(self):
+        self.count = 0
+        self.thread = threading.get_ident()
+
+    def __call__(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self)
+
+
+def statements(client, path):
+    """Statements run to render `path` with cold in-process caches."""
+    for entry in cache.CACHES.values():
+        entry.invalidate()
+    with StatementCounter() as counter:
+        response = client.get(path)
+    assert response.status_code == 200, path
+    return counter.count
+
+
+def page_costs(app):
+    patient = db.session.execute(db.select(User).filter_by(user_email='patient1@bench.test')).scalar_one()
+    pages = {}
+    for email, password in (('admin@hms.com', 'admin@123'), ('doctor1@bench.test', datagen.PASSWORD),
+                            (patient.user_email, datagen.PASSWORD)):
+        client = app.test_client()
+        dashboard = client.post('/login', data={'user_email': email, 'user_password': password}).location
+        pages[dashboard.split('/')[1]] = statements(client, dashboard)
+    pages['history'] = statements(client, f'/patient/{patient.user_name}/patient/{patient.id}/history')
+    return pages
+
+
+def test_page_query_counts_do_not_grow_with_the_data(app, fresh_database):
+    costs = []
+    for sizes in SIZES:
+        fresh_database()
+        generate(**sizes)
+        costs.append(page_costs(app))
+
+    small, large = costs
+    assert set(small) == {'admin_dashboard', 'doctor_dashboard', 'patient_dashboard', 'history'}
+    assert large == small
+    assert max(small.values()) <= MAX_STATEMENTS, small
@@ -0,0 +1,45 @@
+from datetime import date, time, timedelta
+from models import db, User, Doctor, Department, DoctorAvailability, WeeklySchedule
+import schedules
+
+
+def add_doctor(name, weekdays=()):
+    department = Department.query.first() or Department(department_name='Cardiology', slot_minutes=15)
+    user = User(user_name=name, user_email=f'{name}@test', user_password='x', user_role='doctor')
+    db.session.add_all([department, user])
+    db.session.flush()
+    db.session.add(Doctor(id=user.id, department_id=department.id))
+    db.session.add_all([WeeklySchedule(doctor_id=user.id, weekday=weekday, start_time=time(9),
+                                       end_time=time(12)) for weekday in weekdays])
+    db.session.commit()
+    return user
+
+
+def open_windows(doctor_id):
+    return DoctorAvailability.query.filter(DoctorAvailability.doctor_id == doctor_id,
+                                           DoctorAvailability.date >= date.today(),
+                                           DoctorAvailability.is_available == True).count()  # noqa: E712
+
+
+def test_saving_an_empty_week_closes_every_window(client):
+    doctor = add_doctor('doc', weekdays=range(7))
+    schedules.roll_out_all(days=14)
+    assert open_windows(doctor.id) == 14
+
+    client.post('/login', data={'user_email': 'doc@test', 'user_password': 'x'})
+    response = client.post('/doctor/doc/availability', data={})
+    assert response.status_code == 302
+    assert WeeklySchedule.query.count() == 0
+    assert open_windows(doctor.id) == 0
+
+
+def test_rollout_keeps_windows_of_doctors_without_a_schedule(app):
+    scheduled = add_doctor('scheduled', weekdays=[0])
+    legacy = add_doctor('legacy')
+    db.session.add_all([DoctorAvailability(doctor_id=legacy.id, date=date.today() + timedelta(days=i),
+                                           start_time=time(9), end_time=time(10)) for i in range(3)])
+    db.session.commit()
+
+    schedules.roll_out_all(days=14)
+    assert open_windows(scheduled.id) == 2
+    assert open_windows(legacy.id) == 3
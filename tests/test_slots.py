@@ -0,0 +1,60 @@
+from datetime import date, time, timedelta
+import pytest
+from models import db, User, Doctor, Department, DoctorAvailability, WeeklySchedule
+import bulk_import
+import slots
+
+
+def test_window_error():
+    assert slots.window_error(time(9), time(14, 15), 5) is None
+    assert 'at most 63' in slots.window_error(time(9), time(17), 5)
+    assert slots.window_error(time(9), time(19, 30), 10) is None
+    assert slots.window_error(time(9), time(20), 10) is not None
+
+
+@pytest.fixture
+def doctor(client):
+    department = Department(department_name='Cardiology', slot_minutes=15)
+    users = [User(user_name='admin', user_email='admin@test', user_password='x', user_role='admin'),
+             User(user_name='doc', user_email='doc@test', user_password='x', user_role='doctor')]
+    db.session.add_all([department] + users)
+    db.session.flush()
+    db.session.add(Doctor(id=users[1].id, department_id=department.id, experience_years=3))
+    db.session.add(WeeklySchedule(doctor_id=users[1].id, weekday=0, start_time=time(9), end_time=time(17)))
+    db.session.commit()
+    return db.session.get(Doctor, users[1].id)
+
+
+def test_edit_doctor_refuses_a_length_that_does_not_fit_the_schedule(client, doctor):
+    client.post('/login', data={'user_email': 'admin@test', 'user_password': 'x'})
+    form = {'name': 'doc', 'email': 'doc@test', 'experience_years': 3, 'department_id': doctor.department_id}
+    client.post(f'/admin/edit_doctor/{doctor.id}', data=dict(form, slot_minutes=5))
+    db.session.expire_all()
+    assert doctor.slot_minutes is None
+
+    client.post(f'/admin/edit_doctor/{doctor.id}', data=dict(form, slot_minutes=10))
+    db.session.expire_all()
+    assert doctor.slot_minutes == 10
+
+
+def test_weekly_hours_must_fit_the_appointment_length(client, doctor):
+    doctor.slot_minutes = 5
+    db.session.commit()
+    client.post('/login', data={'user_email': 'doc@test', 'user_password': 'x'})
+    client.post('/doctor/doc/availability', data={'works_1': 'on', 'start_1': '09:00', 'end_1': '17:00'})
+    assert WeeklySchedule.query.filter_by(weekday=1).count() == 0
+
+    client.post('/doctor/doc/availability/exceptions',
+                data={'date': (date.today() + timedelta(days=1)).isoformat(), 'start_time': '08:00',
+                      'end_time': '18:00'})
+    assert DoctorAvailability.query.count() == 0
+
+
+def test_bulk_import_rejects_windows_that_do_not_fit(doctor, tmp_path):
+    path = tmp_path / 'availability.csv'
+    path.write_text('doctor_email,date,start_time,end_time,is_available,slot_minutes\n'
+                    'doc@test,2030-01-07,09:00,17:00,1,5\n'
+                    'doc@test,2030-01-08,09:00,14:00,1,5\n')
+    importer = bulk_import.import_file('availability', str(path))
+    assert DoctorAvailability.query.count() == 1
+    assert importer.rejected == 1
@@ -0,0 +1,74 @@
+"""Background job worker (see jobs.py).
+
+Runs --processes worker processes that claim and run due jobs from the jobs
+table, polling every --poll seconds when the queue is empty. Stop with
+Ctrl-C or SIGTERM; each process finishes its current job first.
+
+    python worker.py
+    python worker.py --processes 4 --poll 0.5
+    python worker.py --drain      # run every due job once and exit
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def work(poll, drain, stop):
+    # the parent handles Ctrl-C and SIGTERM (also sent to the whole process
+    # group, e.g. by systemd) and sets `stop`, so the current job finishes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    from app import app
+    import jobs
+
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    with app.app_context():
+        last_sweep = 0
+        while not stop.is_set():
+            if time.monotonic() - last_sweep > 60:
+                if jobs.requeue_stale():
+                    print(f"[{worker_id}] requeued stale jobs", flush=True)
+                last_sweep = time.monotonic()
+
+            job = jobs.claim(worker_id)
+            if job is None:
+                if drain:
+                    return
+                stop.wait(poll)
+                continue
+
+            started = time.perf_counter()
+            job = jobs.run(job)
+            print(f"[{worker_id}] job #{job.id} {job.kind}: {job.status} "
+                  f"(attempt {job.attempts}, {time.perf_counter() - started:.2f}s)", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--poll', type=float, default=1.0, help="seconds between polls of an empty queue")
+    parser.add_argument('--drain', action='store_true', help="exit once no job is due")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    stop = ctx.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    processes = [ctx.Process(target=work, args=(args.poll, args.drain, stop)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for process in processes:
+            process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())